@@ -7,6 +7,9 @@ import psycopg2.extras
 from psycopg2 import sql
 import pandas as pd
 
+from Model.RowCounter import RowCounter
+from Model.ViewMaterializer import ViewMaterializer
+
 class DatasetHistoryManager:
     """Class that manages the transformation history of a dataset.
 
@@ -15,25 +18,22 @@ class DatasetHistoryManager:
         db_connection: psycopg2 database connection to execute SQL queries.
         engine: SQLalchemy engine to use pandas functionality.
         track: Boolean indicating whether the transformation has to be written in history.
+        lazy: Boolean indicating whether backups are stored as views until the table they select from is modified.
     """
 
-    def __init__(self, setid, db_connection, track = True):
+    def __init__(self, setid, db_connection, track = True, lazy = False):
         self.setid = setid
         self.db_connection = db_connection
-        self.entry_count = self.__initialize_entrycount()
         self.track = track
+        self.lazy = lazy
+        self.materializer = ViewMaterializer(db_connection)
         self.choice_dict = None
-        
-    def __initialize_entrycount(self):
-        cur = self.db_connection.cursor()
-        query = "SELECT COUNT(*) FROM system.dataset_history WHERE setid = %s"
-        cur.execute(sql.SQL(query), [self.setid])
-        return int(cur.fetchone()[0])
+        self.batch = None
         
     def get_rowcount(self, tablename=None):
         """Quick method to get the number of rows in the dataset history table."""
         if tablename is None: #If we're viewing history of all the tables.
-            return self.entry_count
+            return RowCounter().get_history_count(self.db_connection, self.setid)
 
         else:
             cur = self.db_connection.cursor()
@@ -51,14 +51,58 @@ class DatasetHistoryManager:
             parameters: List of parameters used with the transformation
             transformation_type: Integer representing the transformation used.
         """
+        RowCounter().invalidate(self.setid, table_name)
         if self.track is False:
             return
         param_array = self.__python_list_to_postgres_array(parameters, transformation_type)
+        if self.batch is not None: #The entry is written when the batch is flushed
+            self.batch.append((self.setid, table_name, attribute, transformation_type, param_array, origin_table))
+            return
         cur = self.db_connection.cursor()
         query = 'INSERT INTO SYSTEM.DATASET_HISTORY VALUES (%s, %s, %s, %s, %s, %s) RETURNING transformation_id'
         cur.execute(sql.SQL(query), [self.setid, table_name, attribute, transformation_type, param_array, origin_table])
         t_id = cur.fetchone()[0]
         self.db_connection.commit()
+        RowCounter().invalidate_history(self.setid)
+        self.__update_backups(table_name, t_id, transformation_type == 0)
+
+    def begin_batch(self):
+        """Method that makes write_to_history collect the entries instead of writing them, until flush_batch is called."""
+        self.batch = []
+
+    def discard_batch(self):
+        """Method that stops collecting entries without writing the entries collected so far."""
+        self.batch = None
+
+    def flush_batch(self):
+        """Method that writes all the entries collected since begin_batch in a single insert and stops collecting.
+        The insert is committed together with all the other uncommitted changes made through the connection,
+        afterwards the backups are updated once for every table in the batch.
+        """
+        entries = self.batch
+        self.batch = None
+        if not entries:
+            self.db_connection.commit()
+            return
+
+        cur = self.db_connection.cursor()
+        query = 'INSERT INTO SYSTEM.DATASET_HISTORY VALUES %s RETURNING transformation_id'
+        t_ids = [x[0] for x in psycopg2.extras.execute_values(cur, query, entries, fetch=True)]
+        self.db_connection.commit()
+        RowCounter().invalidate_history(self.setid)
+
+        last_ids = dict()
+        copied = set()
+        for entry, t_id in zip(entries, t_ids):
+            last_ids[entry[1]] = max(t_id, last_ids.get(entry[1], t_id))
+            if entry[3] == 0:
+                copied.add(entry[1])
+        for table_name, t_id in last_ids.items():
+            self.__update_backups(table_name, t_id, table_name in copied)
+
+    def __update_backups(self, table_name, t_id, is_copy):
+        """Method that makes a backup of the table after transformation t_id if it's time to make one or if the
+        table was just created as a copy, only the two latest backups of a table are kept."""
         backups = self.get_latest_backups(table_name)
         backup_id = 0
         if len(backups) > 0:
@@ -70,7 +114,7 @@ class DatasetHistoryManager:
                 backup_name = self.__get_backup_name_from_id(min(backups))
                 self.__delete_backup(backup_name)
                 self.__delete_history_entry(min(backups))
-        elif transformation_type == 0:
+        elif is_copy is True:
             self.__backup_table(table_name, t_id)
             
                 
@@ -232,6 +276,7 @@ class DatasetHistoryManager:
         cur = self.db_connection.cursor()
         cur.execute(('DELETE FROM system.dataset_history WHERE transformation_id = %s'), [t_id])
         self.db_connection.commit()
+        RowCounter().invalidate_history(self.setid)
         
     def __python_list_to_postgres_array(self, py_list, transformation_type):
         """Method that represents a python list as a postgres array for inserting into a PostreSQL database."""
@@ -257,17 +302,18 @@ class DatasetHistoryManager:
 
     def __backup_table(self, tablename, t_id):
         cur = self.db_connection.cursor()
-        backup = 'backup."{}"'.format(str(t_id))
-        backup_query = 'CREATE TABLE {} AS SELECT * FROM "{}"."{}"'.format(backup, str(self.setid), tablename)
         query = 'INSERT INTO SYSTEM.DATASET_HISTORY VALUES (%s, %s, %s, %s, %s, %s)'
-        cur.execute(backup_query)
+        if self.lazy is True: #The backup is only copied once the table gets modified
+            self.materializer.create_lazy_copy(str(self.setid), tablename, 'backup', str(t_id))
+        else:
+            backup = 'backup."{}"'.format(str(t_id))
+            backup_query = 'CREATE TABLE {} AS SELECT * FROM "{}"."{}"'.format(backup, str(self.setid), tablename)
+            cur.execute(backup_query)
         cur.execute(query, [self.setid, str(t_id), '', -1, '{}', tablename])
         self.db_connection.commit()
 
     def __delete_backup(self, backup_name):
-        cur = self.db_connection.cursor()
-        backup = 'backup."{}"'.format(str(backup_name))
-        cur.execute('DROP TABLE {}'.format(backup))
+        self.materializer.drop('backup', str(backup_name))
         self.db_connection.commit()
 
     def __get_backup_name_from_id(self, t_id):
@@ -7,6 +7,11 @@ from Model.db_access import get_sqla_eng
 from Model.TableUploader import TableUploader
 from Model.DatasetDownloader import DatasetDownloader
 from Model.QueryManager import QueryManager
+from Model.RowCounter import RowCounter
+from Model.ViewMaterializer import ViewMaterializer
+from Model.ChunkedUploadManager import ChunkedUploadManager
+from Model.DatabaseConfiguration import DatabaseConfiguration
+from Model.UploadJobQueue import UploadJobQueue
 
 from Controller.TableViewer import TableViewer
 from Controller.TableTransformer import TableTransformer
@@ -75,13 +80,19 @@ class DatasetInfo:
     def getTableTransformer(self, tablename):
         """Retrieves a TableTransformer object associated with the specified set and table."""
 
-        return TableTransformer(self.setid, self.db_conn, get_sqla_eng())
+        return TableTransformer(self.setid, self.db_conn, get_sqla_eng(), lazy = True)
+    # ENDMETHOD
+
+    def isLazyCopy(self, tablename):
+        """Returns whether the specified table is a copy that is stored as a view over another table."""
+
+        return ViewMaterializer(self.db_conn).is_view(self.setid, tablename)
     # ENDMETHOD
 
     def getDownloader(self):
         """Retrieves a DatasetDownloader object associated with the dataset."""
 
-        return DatasetDownloader(setid=self.setid, db_connection=self.db_conn)
+        return DatasetDownloader(setid=self.setid, db_connection=self.db_conn, db_config=DatabaseConfiguration())
     # ENDMETHOD
 
     def getTableJoiner(self, table1, table2, newtable):
@@ -92,7 +103,49 @@ class DatasetInfo:
 
     def getUploader(self):
         """Retrieve the TableUploader for this dataset."""
-        return TableUploader(self.setid, db_connection=self.db_conn, engine=get_sqla_eng())
+        return TableUploader(self.setid, db_connection=self.db_conn, engine=get_sqla_eng(), db_config=DatabaseConfiguration())
+    # ENDMETHOD
+
+    def queueUpload(self, filename, userid, header, automatic_types, delimiter, quotechar, encoding):
+        """Queues a file to be loaded into the dataset in the background and returns the id of the job.
+        The folder containing the file is removed once the job is finished."""
+        return UploadJobQueue(DatabaseConfiguration()).enqueue(self.db_conn, self.setid, userid, filename, header=header,
+                                                               automatic_types=automatic_types, delimiter=delimiter,
+                                                               quotechar=quotechar, encoding=encoding)
+    # ENDMETHOD
+
+    def startChunkedUpload(self, filename, userid, size, header, automatic_types, delimiter, quotechar, encoding):
+        """Starts an upload of a file of size bytes that is sent in chunks, and queues the job that loads it.
+        Returns the upload. The folder containing the file is removed once the job is finished."""
+        uploads = ChunkedUploadManager(self.db_conn)
+        upload_id = uploads.start(self.setid, userid, filename, size)
+        UploadJobQueue(DatabaseConfiguration()).enqueue(self.db_conn, self.setid, userid, filename, header=header,
+                                                        automatic_types=automatic_types, delimiter=delimiter,
+                                                        quotechar=quotechar, encoding=encoding,
+                                                        upload_id=upload_id, bytes_total=size)
+        return uploads.get(upload_id)
+    # ENDMETHOD
+
+    def getChunkedUpload(self, upload_id):
+        """Retrieves a chunked upload of the dataset, None if it doesn't exist."""
+        upload = ChunkedUploadManager(self.db_conn).get(upload_id)
+        if upload is None or upload['setid'] != self.setid:
+            return None
+        return upload
+    # ENDMETHOD
+
+    def appendChunk(self, upload_id, offset, data, checksum):
+        """Writes a chunk of a chunked upload of the dataset and returns the upload. Once the upload
+        is complete, the job that loads the file is started (if it wasn't running yet)."""
+        upload = ChunkedUploadManager(self.db_conn).append(upload_id, offset, data, checksum)
+        if upload['status'] == 'complete':
+            UploadJobQueue(DatabaseConfiguration()).release(self.db_conn, upload_id)
+        return upload
+    # ENDMETHOD
+
+    def getUploadJobs(self):
+        """Retrieves the upload jobs of the dataset that are unfinished or finished recently."""
+        return UploadJobQueue(DatabaseConfiguration()).get_jobs(self.db_conn, self.setid)
     # ENDMETHOD
 
     def getHistoryManager(self):
@@ -122,7 +175,12 @@ class DatasetInfo:
         if not tablename in self.getTableNames():
             raise RuntimeError("Invalid tablename.")
 
-        qm = QueryManager(db_conn = self.db_conn, engine = None)
-        qm.destroyTable("\"{}\".\"{}\"".format(self.setid, tablename), cascade = True)
-        qm.destroyTable("\"original_{}\".\"{}\"".format(self.setid, tablename), if_exists = True, cascade = True) # this one may not always exist!
+        # copies and backups that are views over the table are materialized instead of dropped along with it
+        materializer = ViewMaterializer(self.db_conn)
+        materializer.drop(self.setid, tablename)
+        materializer.drop("original_" + str(self.setid), tablename, if_exists = True) # this one may not always exist!
+        self.db_conn.commit()
+
+        RowCounter().invalidate(self.setid, tablename)
+        RowCounter().invalidate("original_" + str(self.setid), tablename)
     # ENDMETHOD
@@ -6,6 +6,8 @@ import numpy as np
 import psycopg2
 from psycopg2 import sql
 from Model.QueryManager import QueryManager
+from Model.RowCounter import RowCounter
+from Model.ViewMaterializer import ViewMaterializer
 from Controller.DatasetHistoryManager import DatasetHistoryManager
 
 
@@ -156,7 +158,10 @@ class Deduplicator:
             self.dataframes[(setid, tablename)] = self.dataframes[(setid, tablename)].drop(self.entries_to_remove[(setid, tablename)])
 
             dataframe = self.dataframes[(setid, tablename)]
+            ViewMaterializer(self.db_connection).prepare_for_write(schema, tablename)
+            self.db_connection.commit()
             dataframe.to_sql(tablename, self.engine, schema=schema, if_exists="replace", index=False)
+            RowCounter().invalidate(schema, tablename)
 
             dataset_history_manager = DatasetHistoryManager(setid, self.db_connection)
             try:
@@ -257,6 +262,7 @@ class Deduplicator:
                                                                                                      sql.Identifier(str(setid)),
                                                                                                      sql.Identifier(tablename))
             attributes = QueryManager(self.db_connection, None).get_col_names(str(setid), tablename)
+            ViewMaterializer(self.db_connection).prepare_for_write(setid, tablename)
             for row in rows:
                 current_query = query
                 for i in range(len(attributes) - 1):
@@ -270,6 +276,7 @@ class Deduplicator:
                 self.cur.execute(current_query, row)
 
             self.db_connection.commit()
+            RowCounter().invalidate(setid, tablename)
 
     def __init__(self, db_connection, engine):
         if Deduplicator.__instance is None:
@@ -7,6 +7,8 @@ import sqlalchemy
 import numpy as np
 import pandas as pd
 
+from Model.RowCounter import RowCounter
+from Model.ViewMaterializer import ViewMaterializer
 from Controller.DatasetHistoryManager import DatasetHistoryManager
 
 
@@ -28,6 +30,7 @@ class QueryExecutor:
         self.engine = engine
         self.write_perm = write_perm
         self.history_manager = DatasetHistoryManager(setid, db_conn, track)
+        self.materializer = ViewMaterializer(db_conn)
         self.altered_data = {}
         self.cur = None
 
@@ -63,6 +66,8 @@ class QueryExecutor:
         print(statements)
         self.cur = self.db_conn.cursor()
         try:
+            #Tables stored as views have to be materialized before the role without CREATE permission is assumed
+            self.__prepare_for_write(statements)
             self.cur.execute('SET LOCAL ROLE {}'.format(self.__get_dataset_role()))
             for statement in statements:
                 result = self.__execute_statement(statement)
@@ -74,6 +79,8 @@ class QueryExecutor:
 
         #If nothing failed and every statement has been succesfully executed commit
         self.db_conn.commit()
+        #The statements can write to any table of the dataset, so none of the cached row counts can be trusted
+        RowCounter().invalidate(self.schema)
         #If some table has been altered due one or more queries in this transaction
 
         if len(self.altered_data) > 0:
@@ -153,6 +160,9 @@ class QueryExecutor:
         if self.write_perm is False: # Without write permissions, you can only use SELECT statmements.
             if type(statement_obj) != psqlparse.nodes.SelectStmt:
                 return False
+            # which also can't write to tables in their WITH clause
+            if self.__get_write_targets(statement_obj) != set():
+                return False
                 
         permitted = [psqlparse.nodes.parsenodes.SelectStmt, psqlparse.nodes.parsenodes.InsertStmt,
                      psqlparse.nodes.parsenodes.UpdateStmt, psqlparse.nodes.parsenodes.DeleteStmt]
@@ -172,14 +182,69 @@ class QueryExecutor:
 
     def __get_modified_table(self, query):
         """Method that returns which table has been modified after a INSERT / UPDATE / DELETE statement.
-        This is usually the first table occurence in the query.
+        This is the table the statement writes to, or one of the tables its WITH clause writes to.
         """
-        words  = query.split()
+        targets = self.__get_write_targets(psqlparse.parse(query)[0])
+        tables = self.__get_valid_tables()
+        for table in sorted(targets or []):
+            if table in tables:
+                return table
+        raise self.QueryError('Table used in query does not belong in the dataset.')
+
+    def __prepare_for_write(self, statements):
+        """Method that materializes the tables that are modified by the statements, and the views selecting from them,
+        so that a statement only changes the contents of the table it writes to. The tables written to are taken
+        from the parsed statements, if they can't be determined every table of the dataset is materialized."""
         tables = self.__get_valid_tables()
-        for w in words:
-            if w in tables:
-                return w
-        raise self.ValueError('Table used in query does not belong in the dataset.')
+        targets = set()
+        for statement in statements:
+            try:
+                parsed = psqlparse.parse(statement)
+            except psqlparse.exceptions.PSqlParseError:
+                #The statement is refused with a syntax error when it's executed
+                continue
+
+            for statement_obj in parsed:
+                statement_targets = self.__get_write_targets(statement_obj)
+                if statement_targets is None:
+                    targets = set(tables)
+                    break
+                targets |= statement_targets
+
+        for tablename in targets:
+            if tablename in tables:
+                self.materializer.prepare_for_write(self.schema, tablename)
+
+    def __get_write_targets(self, statement_obj):
+        """Method that returns the names of the tables that a parsed statement writes to, including the
+        data-modifying statements in its WITH clause. Returns None if the tables can't be determined."""
+        write_types = [psqlparse.nodes.parsenodes.InsertStmt, psqlparse.nodes.parsenodes.UpdateStmt,
+                       psqlparse.nodes.parsenodes.DeleteStmt]
+        if type(statement_obj) not in write_types + [psqlparse.nodes.parsenodes.SelectStmt]:
+            return None
+
+        targets = set()
+        if type(statement_obj) in write_types:
+            relation = statement_obj.relation
+            if type(relation) != psqlparse.nodes.primnodes.RangeVar or relation.relname is None:
+                return None
+            if relation.schemaname is not None and relation.schemaname != self.schema:
+                raise self.PermissionError('Unable to execute query: only tables of this dataset can be modified.')
+            targets.add(relation.relname)
+
+        with_clause = statement_obj.with_clause
+        if with_clause is not None:
+            if type(with_clause) != psqlparse.nodes.parsenodes.WithClause:
+                return None
+            for cte in with_clause.ctes:
+                if type(cte) != psqlparse.nodes.parsenodes.CommonTableExpr:
+                    return None
+                cte_targets = self.__get_write_targets(cte.ctequery)
+                if cte_targets is None:
+                    return None
+                targets |= cte_targets
+
+        return targets
 
     def __get_dataset_role(self):
         """Method that returns the role with specific permissions over the dataset."""
@@ -9,6 +9,8 @@ import pandas as pd
 
 from Controller.DatasetHistoryManager import DatasetHistoryManager
 from Model.SQLTypeHandler import SQLTypeHandler
+from Model.RowCounter import RowCounter
+from Model.ViewMaterializer import ViewMaterializer
 
 class TableTransformer:
     """Class that performs transformations and various actions on SQL tables to support the data cleaning process.
@@ -20,16 +22,22 @@ class TableTransformer:
         db_connection: psycopg2 database connection to execute SQL queries
         engine: SQLalchemy engine to use pandas functionality
         track: Boolean indicating whether TableTransformer needs to write to history.
+        lazy: Boolean indicating whether copies of tables are stored as views over the original table,
+              such a view is only turned into a real table when it (or the table it selects from) is modified.
     """
 
-    def __init__(self, setid, db_conn, engine, replace=True, track=True):
+    def __init__(self, setid, db_conn, engine, replace=True, track=True, lazy=False):
         self.setid = setid
         self.schema = str(setid)
         self.replace = replace
         self.db_connection = db_conn
         self.engine = engine
         self.track = track
-        self.history_manager = DatasetHistoryManager(setid, db_conn, track)
+        self.lazy = lazy
+        self.materializer = ViewMaterializer(db_conn)
+        self.history_manager = DatasetHistoryManager(setid, db_conn, track, lazy)
+        self.__batch = False
+        self.__attribute_types = dict()
 
     class TTError(Exception):
         """
@@ -53,12 +61,19 @@ class TableTransformer:
         This exception is raised whenever an operation is provided with an inappropiate value causing
         the operation to fail.
         """
+    def __commit(self):
+        """Commit the changes, unless a pipeline is running in which case everything is committed at the end."""
+        if self.__batch is False:
+            self.db_connection.commit()
+
     def get_attribute_type(self, table, attribute):
         """Execute query that returns the type of the attribute of an SQL table in the dataset schema."""
+        if (table, attribute) in self.__attribute_types: #Types are only cached while a pipeline is running
+            return self.__attribute_types[(table, attribute)][0]
         cur = self.db_connection.cursor()
         cur.execute(("SELECT data_type FROM information_schema.columns WHERE table_schema = %s "
                      "AND table_name = %s AND column_name = %s LIMIT 1"), (self.schema, table, attribute))
-        self.db_connection.commit()
+        self.__commit()
         return cur.fetchone()[0]
 
     def get_attribute_type_with_length(self, table, attribute):
@@ -68,7 +83,7 @@ class TableTransformer:
         cur.execute(("SELECT data_type, character_maximum_length FROM information_schema.columns"
                     " WHERE table_schema = %s AND table_name =  %s AND column_name = %s LIMIT 1"),
                     (self.schema, table, attribute))
-        self.db_connection.commit()
+        self.__commit()
         return cur.fetchone()
 
     def drop_attribute(self, schema, table, attribute):
@@ -76,7 +91,7 @@ class TableTransformer:
         cur = self.db_connection.cursor()
         query_args = [sql.Identifier(schema),sql.Identifier(table), sql.Identifier(attribute)]
         cur.execute(sql.SQL("ALTER TABLE {}.{} DROP COLUMN IF EXISTS {}").format(*query_args))
-        self.db_connection.commit()
+        self.__commit()
 
     def rename_attribute(self, table, old, new):
         """Execute auery that renames the column of an SQL table."""
@@ -84,14 +99,13 @@ class TableTransformer:
         query_args = [sql.Identifier(self.schema), sql.Identifier(table),
                       sql.Identifier(old), sql.Identifier(new)]
         cur.execute(sql.SQL('ALTER TABLE {}.{} RENAME {} TO {}').format(*query_args))
-        self.db_connection.commit()
+        self.__commit()
 
     def drop_table(self, table):
         """Execute query that drops an SQL table of the dataset."""
-        cur = self.db_connection.cursor()
-        query_args = [sql.Identifier(self.schema), sql.Identifier(table)]
-        cur.execute(sql.SQL("DROP TABLE IF EXISTS {}.{}").format(*query_args))
-        self.db_connection.commit()
+        self.materializer.drop(self.schema, table, True)
+        self.__commit()
+        RowCounter().invalidate(self.schema, table)
         
     def create_copy_of_table(self, schema1, tablename1, schema2, tablename2):
         """Execute query that copies a whole table to another table with name new_name."""
@@ -99,14 +113,15 @@ class TableTransformer:
         query_args = [sql.Identifier(schema2), sql.Identifier(tablename2),
                      sql.Identifier(schema1), sql.Identifier(tablename1)]
         cur.execute(sql.SQL("CREATE TABLE {}.{} AS SELECT * FROM {}.{}").format(*query_args))
-        self.db_connection.commit()
+        self.__commit()
+        RowCounter().invalidate(schema2, tablename2)
 
     def nullify_column(self, tablename, attribute):
         """Execute query that sets empty strings in text columns to NULL in an SQL table."""
         cur = self.db_connection.cursor()
         query_args = [sql.Identifier(self.schema), sql.Identifier(tablename), sql.Identifier(attribute)]
         cur.execute(sql.SQL("UPDATE {0}.{1} SET {2} = NULL WHERE length({2}) = 0").format(*query_args)) 
-        self.db_connection.commit()
+        self.__commit()
 
     def load_table_in_dataframe(self, table):
         """Load all the data of a SQL table in a pandas dataframe."""
@@ -130,31 +145,50 @@ class TableTransformer:
         but in case it's an operation that needs to result in a new table, we create table 'new_name' and return that name.
         """
         if self.replace is True:
+            self.__prepare_for_write(tablename)
             return tablename
         else:
-            resulting_t = self.copy_table(tablename, new_name)
+            resulting_t = self.copy_table(tablename, new_name, True)
             return resulting_t
+
+    def __prepare_for_write(self, tablename):
+        """Make sure that writing to the table doesn't affect the views selecting from it and vice versa."""
+        if self.materializer.prepare_for_write(self.schema, tablename) is True:
+            RowCounter().invalidate(self.schema, tablename)
+        self.__commit()
+
+    def materialize_table(self, tablename):
+        """Method that stores a table that was copied lazily as a real table."""
+        self.materializer.materialize(self.schema, tablename)
+        self.__commit()
             
-    def copy_table(self, old, new):
+    def copy_table(self, old, new, materialize=False):
         """In case the transformation has to result in a new table, we copy the existing one to a new table in this dataset
         and perform the operation on this newly created copy.
 
         Parameters:
            old: A string representing the name of the old table we're constructing the new one from.
            new: A string representing the name of the new table constructed after performing a transformation.
+           materialize: Boolean indicating whether the copy has to be a real table, even if TableTransformer is lazy.
         """
         if new == "":
             raise self.ValueError('No tablename given to the new table resulting from this operation. Please assign a valid tablename.')
 
         new_name = self.__get_unique_name(new, new, False)
         query_args = [self.schema, old, self.schema, new_name]
-        self.create_copy_of_table(*query_args)
+        if self.lazy is True and materialize is False:
+            self.materializer.create_lazy_copy(*query_args)
+            self.__commit()
+            RowCounter().invalidate(self.schema, new_name)
+        else:
+            self.create_copy_of_table(*query_args)
         self.history_manager.write_to_history(new_name, old, '', [], 0)
         return new_name
 
     def change_attribute_name(self, table, attribute, new_name):
         """Transformation that changes the name of a table attribute."""
         new_name = self.__get_unique_name(table, new_name)
+        self.__prepare_for_write(table)
         self.rename_attribute(table, attribute, new_name)
         self.history_manager.write_to_history(table, table, attribute, [new_name], 17)
 
@@ -211,11 +245,11 @@ class TableTransformer:
             cur.execute(sql.SQL(delete_query).format(*identifiers), values)
         except:
             if resulting_table != tablename:
-                self.db_connection.commit()
+                self.__commit()
                 self.drop_table(resulting_table)
             raise self.ValueError('Could not delete rows using this predicate since it contains invalid input value(s) for the attributes.')
         
-        self.db_connection.commit()
+        self.__commit()
         clean_predicate = cur.query
         clean_predicate = clean_predicate.decode('utf-8').replace('"', '\\"')
         self.history_manager.write_to_history(resulting_table, resulting_table, 'None', [clean_predicate], 15)
@@ -326,7 +360,7 @@ class TableTransformer:
             else:
                 error_msg = "Conversion failed due to values in attribute that can't correctly be converted to {}.".format(to_type)
                 raise self.ValueError(error_msg)
-        self.db_connection.commit()
+        self.__commit()
         return to_type
 
     def __convert_numeric(self, tablename, attribute, to_type, length):
@@ -336,7 +370,7 @@ class TableTransformer:
         sql_query = "ALTER TABLE {}.{} ALTER COLUMN  {} TYPE %s" % to_type
         self.db_connection.cursor().execute(sql.SQL(sql_query).format(sql.Identifier(self.schema), sql.Identifier(tablename),
                                                                                               sql.Identifier(attribute)), [to_type])
-        self.db_connection.commit()
+        self.__commit()
         return to_type
     
     def change_attribute_type(self, tablename, attribute, to_type, data_format="", length=None, new_name=""):
@@ -356,7 +390,7 @@ class TableTransformer:
             else:
                 to_type2 = self.__convert_numeric(resulting_table, attribute, to_type, length)
         except:
-            self.db_connection.commit()
+            self.__commit()
             #If anything went wrong in the transformation, the new table has to be dropped.
             if resulting_table != tablename:
                 self.drop_table(resulting_table)
@@ -415,11 +449,11 @@ class TableTransformer:
 
         if pattern != "":
             cur.execute(sql.SQL(query1).format(*query_args), [pattern])
-            self.db_connection.commit()
+            self.__commit()
 
         if length is not None:
             cur.execute(sql.SQL(query2).format(*query_args), [length])
-            self.db_connection.commit()
+            self.__commit()
             
         #If we were to create a new table for this operation, this already happened, so overwrite the newly created table.
         if self.replace is False:
@@ -450,7 +484,7 @@ class TableTransformer:
 
         except:
             if resulting_table != tablename:
-                self.db_connection.commit()
+                self.__commit()
                 self.drop_table(resulting_table)
             raise
             
@@ -478,7 +512,7 @@ class TableTransformer:
                 cur = self.db_connection.cursor()
                 cur.execute(sql.SQL(sql_query).format(sql.Identifier(self.schema), sql.Identifier(resulting_table),
                                                       sql.Identifier(attribute)), (original_value, replacement, value))
-                self.db_connection.commit()
+                self.__commit()
                 
         if replace_all is True: #If replace_all was False the operation was already performed by the query above.           
             try:
@@ -486,7 +520,7 @@ class TableTransformer:
                                                                               sql.Identifier(attribute)), (replacement, value))
             except psycopg2.DataError:
                 raise self.ValueError("Could not perform find-and-replace due to an invalid input value for this attribute.")
-            self.db_connection.commit()
+            self.__commit()
         self.history_manager.write_to_history(resulting_table, resulting_table, attribute, [original_value, replacement, exact, replace_all], 8)
         
     def regex_find_and_replace(self, tablename, attribute, regex, replacement, case_sens=False, new_name=""):
@@ -506,7 +540,7 @@ class TableTransformer:
 
         except:
             if resulting_table != tablename:
-                self.db_connection.commit()
+                self.__commit()
                 self.drop_table(resulting_table)
             raise
 
@@ -529,58 +563,47 @@ class TableTransformer:
             error_msg = str(e)  + ". Please refer to the PostgreSQL documentation on regular expressions for more information."
             raise self.ValueError(error_msg)
 
-        self.db_connection.commit()
+        self.__commit()
         self.history_manager.write_to_history(resulting_table, resulting_table, attribute, [regex, replacement, case_sens], 9)
         
-    def __get_simplified_types(self, tablename, data_frame):
-        """Method that makes sure pandas dataframe uses correct datatypes when writing to SQL."""
-        new_attributes = data_frame.columns.values.tolist()
-        new_types = {}
-        sqla_type = None
-        for  elem in new_attributes:
-            psql_type = self.get_attribute_type_with_length(tablename, str(elem))
-            if psql_type is not None:
-                sqla_type = SQLTypeHandler().to_sqla_object(psql_type[0])
-                if sqla_type is None:
-                    if psql_type[0] == 'character varying':
-                        sqla_type = sqlalchemy.types.VARCHAR(psql_type[1])
-                    elif psql_type[0] == 'character':
-                        sqla_type = sqlalchemy.types.CHAR(psql_type[1])
-                    else:
-                        #Then this is another type that won't bring us trouble.
-                        continue
-            else:
-                pd_type = str(data_frame[elem].dtype)
-                sqla_type = SQLTypeHandler().to_sqla_object(pd_type)
-                
-            new_types[elem] = sqla_type
-        return new_types
-    
-    def one_hot_encode(self, tablename, attribute, new_name=""):
-        """Method that performs one hot encoding given an attribute"""
-        df = self.load_table_in_dataframe(tablename)
-        encoded = pd.get_dummies(df[attribute]) #Perfom one-hot-encoding
-        df = df.drop(attribute, axis=1) #Drop the attribute used for encoding
-        df = df.join(encoded) #Join the original attributes with the encoded table
-        new_dtypes = self.__get_simplified_types(tablename, df)
-        eventual_table = "" #This will be the name of table containing the changes.
-        if self.replace is True:
-            #If the table should be replaced, drop it and recreate it.
-            df.to_sql(name=tablename, con=self.engine, schema=self.schema, if_exists='replace', index = False, dtype = new_dtypes)
-            eventual_table = tablename
-        elif self.replace is False:
-            #We need to create a new table and leave the original untouched
-            new_name = self.__get_unique_name("", new_name, False)
-            df.to_sql(name=new_name, con=self.engine, schema=self.schema, if_exists='fail', index = False, dtype = new_dtypes)
-            eventual_table = new_name
-            
-        self.history_manager.write_to_history(eventual_table, eventual_table, attribute, [], 14)
+    def one_hot_encode(self, tablename, attribute, new_name="", max_categories=250):
+        """Method that performs one hot encoding given an attribute.
+        For every distinct (non-null) value of the attribute an INTEGER column named after the value is added that is
+        1 for the rows containing that value and 0 otherwise. Afterwards the attribute itself is dropped.
+
+        Parameters:
+            max_categories: The maximum number of distinct values, and therefore columns, that are allowed.
+        """
+        cur = self.db_connection.cursor()
+        query_args = [sql.Identifier(attribute), sql.Identifier(self.schema), sql.Identifier(tablename)]
+        cur.execute(sql.SQL("SELECT DISTINCT {0} FROM {1}.{2} WHERE {0} IS NOT NULL ORDER BY {0} LIMIT %s").format(*query_args),
+                    [max_categories + 1])
+        categories = [x[0] for x in cur.fetchall()]
+        if len(categories) > max_categories:
+            raise self.ValueError('One-hot-encoding failed due the attribute having more than {} distinct values.'.format(max_categories))
+
+        resulting_table = self.get_resulting_table(tablename, new_name)
+        column_names = []
+        for category in categories:
+            #Different values can still have the same string representation, so the chosen names are reserved
+            column_names.append(self.__get_unique_name(resulting_table, str(category), reserved=column_names))
+
+        if len(categories) > 0:
+            table = [sql.Identifier(self.schema), sql.Identifier(resulting_table)]
+            new_columns = sql.SQL(', ').join([sql.SQL('ADD COLUMN {} INTEGER').format(sql.Identifier(x)) for x in column_names])
+            cur.execute(sql.SQL('ALTER TABLE {}.{} ').format(*table) + new_columns)
+            #Every indicator column is computed in the same UPDATE so the table is only rewritten once
+            assignments = sql.SQL(', ').join([sql.SQL('{} = CASE WHEN {} = %s THEN 1 ELSE 0 END').format(sql.Identifier(x),
+                                                                                                   sql.Identifier(attribute))
+                                              for x in column_names])
+            cur.execute(sql.SQL('UPDATE {}.{} SET ').format(*table) + assignments, categories)
+
+        #The attribute is dropped in the same transaction, so a failure can't leave both it and the new columns behind
+        query_args = [sql.Identifier(self.schema), sql.Identifier(resulting_table), sql.Identifier(attribute)]
+        cur.execute(sql.SQL("ALTER TABLE {}.{} DROP COLUMN IF EXISTS {}").format(*query_args))
+        self.__commit()
+        self.history_manager.write_to_history(resulting_table, resulting_table, attribute, [], 14)
         
-    def __calculate_zscore(self, mean, standard_dev, value):
-        """Method to quickly calculate z-scores"""
-        zscore = (value - mean) / standard_dev
-        return zscore
-    
     def normalize_using_zscore(self, tablename, attribute, overwrite=True, new_name = ""):
         """Method that normalizes the values of an attribute using the z-score.
         This will normalize everything in a 1-point range, thus [0-1].
@@ -593,55 +616,39 @@ class TableTransformer:
         attr_type = self.get_attribute_type(tablename, attribute)
         if SQLTypeHandler().is_numerical(attr_type) is False:
             raise self.AttrTypeError("Normalization failed due attribute not being of numeric type (neither integer or float)")
-        
-        df = self.load_table_in_dataframe(tablename)
+
+        resulting_table = self.get_resulting_table(tablename, new_name)
         og_attribute = attribute
+        cur = self.db_connection.cursor()
         if overwrite is False:
             new_col = attribute + '_normalized'
-            new_col = self.__get_unique_name(tablename, new_col)
-            df[new_col] = df[attribute]
-            # Now reference new_col as the attribute used in this method
-            attribute = new_col
-            
-        mean = df[attribute].mean()
-        #Calculate the standard deviation, for this method we consider the data as the population
-        #and not a sample so we don't use Bessel's correction
-        standard_deviation = df[attribute].std(ddof=0)
-        #Get the series containing values and convert them to float so that they can be assigned with their z-scores
-        column = df[attribute].astype(float)
-        #Calculate all the z-scores
-        for i in range(column.size):
-            zscore = self.__calculate_zscore(mean, standard_deviation, column[i])
-            #limit the extremes to -2 and +2
-            if zscore < -2:
-                zscore = 2
-            elif zscore > 2:
-                zscore = 2
-            column[i] = zscore
-        
-        column = column.divide(4) #Divide all the values by 4 to get a 1-point range
-        column = column.add(0.5) #Now the mean is 0, so add 0.5 to have the mean at 0.5
-        df.update(column)
-        new_dtypes = self.__get_simplified_types(tablename, df)
-        #Casting the attribute back to int would be problematic so make sure it's float
-        new_dtypes[attribute] = sqlalchemy.types.Float(precision=25, asdecimal=True)
-        eventual_table = ""
-
-        if self.replace is True:
-            #If the table should be replaced, drop it and recreate it.
-            df.to_sql(name=tablename, con=self.engine, schema=self.schema, if_exists='replace', index = False, dtype = new_dtypes)
-            eventual_table = tablename
-        elif self.replace is False:
-            #We need to create a new table and leave the original untouched
-            new_name = self.__get_unique_name("", new_name, False)
-            df.to_sql(name=new_name, con=self.engine, schema=self.schema, if_exists='fail', index = False, dtype = new_dtypes)
-            eventual_table = new_name
-
-        self.history_manager.write_to_history(eventual_table, eventual_table, attribute, [overwrite, og_attribute], 13)
+            attribute = self.__get_unique_name(resulting_table, new_col)
+            query_args = [sql.Identifier(self.schema), sql.Identifier(resulting_table), sql.Identifier(attribute)]
+            cur.execute(sql.SQL("ALTER TABLE {}.{} ADD COLUMN {} DOUBLE PRECISION").format(*query_args))
+        else:
+            #Casting the attribute back to int would be problematic so make sure it's float
+            query_args = [sql.Identifier(self.schema), sql.Identifier(resulting_table), sql.Identifier(attribute)]
+            cur.execute(sql.SQL("ALTER TABLE {0}.{1} ALTER COLUMN {2} TYPE DOUBLE PRECISION"
+                                " USING {2}::DOUBLE PRECISION").format(*query_args))
+
+        #The mean and standard deviation are computed once in the subquery. For this method we consider the data
+        #as the population and not a sample so we don't use Bessel's correction (stddev_pop instead of stddev).
+        #The z-scores are limited to 2 at the extremes, divided by 4 to get a 1-point range and the mean is moved to 0.5
+        query = ("UPDATE {0}.{1} SET {3} = (CASE WHEN abs(({2} - s.mean) / s.sd) > 2 THEN 2"
+                 " ELSE ({2} - s.mean) / s.sd END) / 4 + 0.5"
+                 " FROM (SELECT avg({2})::DOUBLE PRECISION AS mean,"
+                 " NULLIF(stddev_pop({2}), 0)::DOUBLE PRECISION AS sd FROM {0}.{1}) AS s")
+        query_args = [sql.Identifier(self.schema), sql.Identifier(resulting_table),
+                      sql.Identifier(og_attribute), sql.Identifier(attribute)]
+        cur.execute(sql.SQL(query).format(*query_args))
+        self.__commit()
+
+        self.history_manager.write_to_history(resulting_table, resulting_table, attribute, [overwrite, og_attribute], 13)
         
-    def __get_unique_name(self, tablename, name, is_attribute=True):
+    def __get_unique_name(self, tablename, name, is_attribute=True, reserved=()):
         """Method that makes sure an attribute name or table name given the name
         is unique or else make an unique variation of it by appending a number.
+        The names in reserved are treated as taken as well, names are cut to the length postgres allows.
         """
         cur = self.db_connection.cursor()
         if is_attribute is True:
@@ -653,7 +660,9 @@ class TableTransformer:
             
         cur.execute(sql.SQL(query), [str(self.setid)])
         query_result = cur.fetchall()
-        name_list = [x[0] for x in query_result] #List of all the attribute/table names in the table.
+        name_list = [x[0] for x in query_result] + list(reserved) #List of all the attribute/table names in the table.
+        type_handler = SQLTypeHandler()
+        name = type_handler.truncate_identifier(name)
         name_size = len(name)
         count = 0
         max_nr = 0
@@ -671,9 +680,16 @@ class TableTransformer:
 
         if count == 0:
             return name
-        else:
-            new_name = name + "_" + str(max_nr + 1)
-            return new_name
+
+        #The name may have to be cut short to make room for the number, which can make it collide again
+        number = max_nr + 1
+        while True:
+            suffix = "_" + str(number)
+            new_name = type_handler.truncate_identifier(name, type_handler.max_identifier_length - len(suffix)) + suffix
+            if new_name not in name_list:
+                return new_name
+            number += 1
+
         
     def __make_binlabels(self, bins):
         binlabels = []
@@ -686,6 +702,42 @@ class TableTransformer:
         truncated = "%.3f" % fp_num
         return float(truncated)
         
+    def __discretize_into_column(self, tablename, attribute, expression, params):
+        """Method that adds a categorical column for an attribute and fills it in a single UPDATE.
+
+        Parameters:
+            expression: String containing the SQL expression that computes the label of a row, {0} is the attribute.
+            params: The query parameters used in the expression.
+        """
+        column_name = attribute + "_categorical"
+        category = self.__get_unique_name(tablename, column_name)
+        cur = self.db_connection.cursor()
+        query_args = [sql.Identifier(self.schema), sql.Identifier(tablename), sql.Identifier(category)]
+        cur.execute(sql.SQL("ALTER TABLE {}.{} ADD COLUMN {} VARCHAR(255)").format(*query_args))
+        query = sql.SQL("UPDATE {1}.{2} SET {3} = " + expression).format(sql.Identifier(attribute), *query_args)
+        cur.execute(query, params)
+        self.__commit()
+
+    def __discretize_using_bins(self, tablename, attribute, bins):
+        """Method that discretizes an attribute in the intervals [bins[i-1] , bins[i][ using width_bucket."""
+        #width_bucket returns i for values in [bins[i-1] , bins[i][ and an index outside the label array
+        #(which yields NULL) for values outside of all the bins.
+        binlabels = self.__make_binlabels(bins)
+        expression = "(%s::VARCHAR[])[width_bucket({0}::DOUBLE PRECISION, %s::DOUBLE PRECISION[])]"
+        self.__discretize_into_column(tablename, attribute, expression, [binlabels, [float(x) for x in bins]])
+
+    def __get_minimum_and_maximum(self, tablename, attribute, integer_bool):
+        """Method that returns the minimum and maximum value of a numerical attribute."""
+        cur = self.db_connection.cursor()
+        query = "SELECT MIN({0}), MAX({0}) FROM {1}.{2}"
+        if integer_bool is False:
+            query = "SELECT MIN({0})::DOUBLE PRECISION, MAX({0})::DOUBLE PRECISION FROM {1}.{2}"
+        cur.execute(sql.SQL(query).format(sql.Identifier(attribute), sql.Identifier(self.schema), sql.Identifier(tablename)))
+        minimum, maximum = cur.fetchone()
+        if minimum is None:
+            raise self.ValueError("Discretization failed due the attribute only containing NULL values.")
+        return minimum, maximum
+
     def discretize_using_equal_width(self, tablename, attribute, nr_bins, new_name=""):
         """Method that calulates the bins for an equi-distant discretization and performs it"""
         attr_type = self.get_attribute_type(tablename, attribute)
@@ -693,9 +745,8 @@ class TableTransformer:
             raise self.AttrTypeError("Discretization failed due attribute not being of numeric type (neither integer or float)")
 
         integer_bool = SQLTypeHandler().is_integer(attr_type)
-        df = self.load_table_in_dataframe(tablename)
-        minimum = df[attribute].min()
-        maximum = df[attribute].max() + 0.0001 #Add a little bit to make sure the max element is included
+        minimum, maximum = self.__get_minimum_and_maximum(tablename, attribute, integer_bool)
+        maximum = maximum + 0.0001 #Add a little bit to make sure the max element is included
         leftmost_edge = (math.floor(minimum * 1000) / 1000)
         rightmost_edge = (math.ceil(maximum * 1000) / 1000)
         value_range = rightmost_edge - leftmost_edge
@@ -715,25 +766,9 @@ class TableTransformer:
                 next_interval = self.__truncate_float(bins[i] + bin_width)
             bins.append(next_interval)
 
-        #Make labels for these intervals using the list of bin values
-        binlabels = self.__make_binlabels(bins)
-        column_name = attribute + "_categorical"
-        category = self.__get_unique_name(tablename, column_name)
-        df[category] = pd.cut(df[attribute], bins, right=False, labels = binlabels, include_lowest=True)
-        new_dtypes = self.__get_simplified_types(tablename, df)
-        eventual_table = "" #This the table that eventually becomes the table with the resulting changes
-
-        if self.replace is True:
-            #If the table should be replaced, drop it and recreate it.
-            df.to_sql(name=tablename, con=self.engine, schema=self.schema, if_exists='replace', index = False, dtype = new_dtypes)
-            eventual_table = tablename
-        elif self.replace is False:
-            #We need to create a new table and leave the original untouched
-            new_name = self.__get_unique_name("", new_name, False)
-            df.to_sql(name=new_name, con=self.engine, schema=self.schema, if_exists='fail', index = False, dtype = new_dtypes)
-            eventual_table = new_name
-        
-        self.history_manager.write_to_history(eventual_table, eventual_table, attribute, [nr_bins], 6)
+        resulting_table = self.get_resulting_table(tablename, new_name)
+        self.__discretize_using_bins(resulting_table, attribute, bins)
+        self.history_manager.write_to_history(resulting_table, resulting_table, attribute, [nr_bins], 6)
 
     def __calculate_equifrequent_indices(self, width, remainder, nr_bins):
         """Calculates the indices of the list that represent bin edges for discretize_using_equal_frequency."""
@@ -755,60 +790,52 @@ class TableTransformer:
         if SQLTypeHandler().is_numerical(attr_type) is False:
             raise self.AttrTypeError("Discretization failed due attribute not being of numeric type (neither integer or float)")
 
+        cur = self.db_connection.cursor()
+        query_args = [sql.Identifier(attribute), sql.Identifier(self.schema), sql.Identifier(tablename)]
+        cur.execute(sql.SQL("SELECT COUNT({0}), MAX({0}) FROM {1}.{2}").format(*query_args))
+        nr_values, maximum = cur.fetchone()
+        if nr_values == 0:
+            raise self.ValueError("Discretization failed due the attribute only containing NULL values.")
+
         round_to_int = True
-        df = self.load_table_in_dataframe(tablename)
         if attr_type != 'integer':
-            if df[attribute].max() < 2: #Probably working with values [0-1]
+            if maximum < 2: #Probably working with values [0-1]
                 round_to_int = False
-        nr_values = df[attribute].size
         nr_bins = math.floor(math.sqrt(nr_values))
         if nr_bins < 2:
             nr_bins = 2
         elif nr_bins > 20:
             nr_bins = 20
-        
-        elements = df[attribute].tolist() #Load all the elements in a python list
-        elements.sort()
-        list_size = len(elements)
-        indices = []
 
         #Let's first try the naïve approach
-        bin_width = math.floor(list_size / nr_bins)
-        remainder = list_size % nr_bins
+        bin_width = math.floor(nr_values / nr_bins)
+        remainder = nr_values % nr_bins
         indices   = self.__calculate_equifrequent_indices(bin_width, remainder, nr_bins)
 
+        #Fetch only the elements at the bin edges instead of the whole sorted column. The element at index i of the
+        #sorted column is the first one whose cumulative distribution reaches (i + 0.5) / nr_values.
+        fractions = [(index + 0.5) / nr_values for index in indices]
+        query = "SELECT percentile_disc(%s::DOUBLE PRECISION[]) WITHIN GROUP (ORDER BY {0}) FROM {1}.{2}"
+        if SQLTypeHandler().is_integer(attr_type) is False:
+            query = query.replace("ORDER BY {0}", "ORDER BY {0}::DOUBLE PRECISION")
+        cur.execute(sql.SQL(query).format(*query_args), [fractions])
+        elements = cur.fetchone()[0]
+
         #Calculate actual values for the bins
         bins = [elements[0]]
-        for i in range(1, len(indices)):
-            index = indices[i]
+        for i in range(1, len(elements)):
             if round_to_int is True:
-                value = math.ceil(elements[index] + 0.0001)
+                value = math.ceil(elements[i] + 0.0001)
             else:
-                value = round((elements[index] + 0.05), 1)
+                value = round((elements[i] + 0.05), 1)
             bins.append(value)
 
         bins = list(set(bins))
         bins.sort()
 
-        #Make binlabels to represent the bins.
-        binlabels = self.__make_binlabels(bins)
-        column_name = attribute + "_categorical"
-        category = self.__get_unique_name(tablename, column_name)
-        df[category] = pd.cut(df[attribute], bins, right=False, labels = binlabels, include_lowest=True)
-        new_dtypes = self.__get_simplified_types(tablename, df)
-        eventual_table = "" #This the table that eventually becomes the table with the resulting changes
-        
-        if self.replace is True:
-            #If the table should be replaced, drop it and recreate it.
-            df.to_sql(name=tablename, con=self.engine, schema=self.schema, if_exists='replace', index = False, dtype = new_dtypes)
-            eventual_table = tablename
-        elif self.replace is False:
-            #We need to create a new table and leave the original untouched
-            new_name = self.__get_unique_name("", new_name, False)
-            df.to_sql(name=new_name, con=self.engine, schema=self.schema, if_exists='fail', index = False, dtype = new_dtypes)
-            eventual_table = new_name
-            
-        self.history_manager.write_to_history(eventual_table, eventual_table, attribute, [], 5)
+        resulting_table = self.get_resulting_table(tablename, new_name)
+        self.__discretize_using_bins(resulting_table, attribute, bins)
+        self.history_manager.write_to_history(resulting_table, resulting_table, attribute, [], 5)
         
     def discretize_using_custom_ranges(self, tablename, attribute, ranges, exclude_right=True, new_name=""):
         """Method that discretizes given a a list representing the bins.
@@ -822,46 +849,32 @@ class TableTransformer:
         if SQLTypeHandler().is_numerical(attr_type) is False:
             raise self.AttrTypeError("Discretization failed due attribute not being of numeric type (neither integer or float)")
 
-        df = self.load_table_in_dataframe(tablename)
-        bracket = ""
-        bins = ranges
+        for i in range(1, len(ranges)):
+            if ranges[i-1] >= ranges[i]:
+                raise self.ValueError("Discretization failed due the bins not being in increasing order.")
 
         if exclude_right is True:
             bracket = "["
+            condition = "WHEN {0} >= %s AND {0} < %s THEN %s "
         else:
             bracket = "]"
+            condition = "WHEN {0} > %s AND {0} <= %s THEN %s "
 
-        binlabels = []
+        #Values that don't fall in any of the bins become NULL
+        expression = "CASE "
+        params = []
         for i in range(1, len(ranges)):
-            label = bracket + str(bins[i-1]) + " , " + str(bins[i]) + bracket                           
-            binlabels.append(label)
-
-        if exclude_right is True:
-            param_a = False
-            param_b = True
-        else:
-            param_a = True
-            param_b = False
+            label = bracket + str(ranges[i-1]) + " , " + str(ranges[i]) + bracket
+            expression += condition
+            params.extend([ranges[i-1], ranges[i], label])
+        expression += "END"
 
-        column_name = attribute + "_categorical"
-        category = self.__get_unique_name(tablename, column_name)
-        df[category] = pd.cut(df[attribute], ranges, right=param_a, labels = binlabels, include_lowest=param_b)
-        new_dtypes = self.__get_simplified_types(tablename, df)
-        eventual_table = "" #This the table that eventually becomes the table with the resulting changes
+        resulting_table = self.get_resulting_table(tablename, new_name)
+        self.__discretize_into_column(resulting_table, attribute, expression, params)
 
-        if self.replace is True:
-            #If the table should be replaced, drop it and recreate it.
-            df.to_sql(name=tablename, con=self.engine, schema=self.schema, if_exists='replace', index = False, dtype = new_dtypes)
-            eventual_table = tablename
-        elif self.replace is False:
-            #We need to create a new table and leave the original untouched
-            new_name = self.__get_unique_name("", new_name, False)
-            df.to_sql(name=new_name, con=self.engine, schema=self.schema, if_exists='fail', index = False, dtype = new_dtypes)
-            eventual_table = new_name
-
-        arg_list = ranges
+        arg_list = list(ranges)
         arg_list.append(exclude_right)
-        self.history_manager.write_to_history(eventual_table, eventual_table, attribute, arg_list, 4)
+        self.history_manager.write_to_history(resulting_table, resulting_table, attribute, arg_list, 4)
         
     def delete_outliers(self, tablename, attribute, larger, value, replacement, new_name=""):
         """Method that gets rid of outliers of an attribute by setting them to null.
@@ -887,7 +900,7 @@ class TableTransformer:
         cur = self.db_connection.cursor()
         cur.execute(sql.SQL(sql_query).format(sql.Identifier(self.schema), sql.Identifier(resulting_table),
                                               sql.Identifier(attribute)), (replacement, value))
-        self.db_connection.commit()
+        self.__commit()
         self.history_manager.write_to_history(resulting_table, resulting_table, attribute, [larger, value, replacement], 3)
         
     def __fill_nulls_with_x(self, attribute, table,  x):
@@ -898,35 +911,46 @@ class TableTransformer:
         """
         query_args = [sql.Identifier(self.schema), sql.Identifier(table), sql.Identifier(attribute)]
         self.db_connection.cursor().execute(sql.SQL("UPDATE {0}.{1} SET {2} = %s  WHERE {2} is null").format(*query_args), [x])
-        self.db_connection.commit()
+        self.__commit()
+        
+    def __fill_nulls_with_aggregate(self, attribute, table, aggregate):
+        """Method that fills null values of an attribute with the result of an aggregate over the attribute.
+        The aggregate is computed and the nulls are filled in a single statement, the computed value is returned.
+
+        Parameter:
+            aggregate: String containing the SQL aggregate expression, {2} is the attribute.
+        """
+        query_args = [sql.Identifier(self.schema), sql.Identifier(table), sql.Identifier(attribute)]
+        query = ("WITH computed AS (SELECT (" + aggregate + ")::DOUBLE PRECISION AS value FROM {0}.{1}),"
+                 " filled AS (UPDATE {0}.{1} AS t SET {2} = computed.value FROM computed WHERE t.{2} IS NULL)"
+                 " SELECT value FROM computed")
+        cur = self.db_connection.cursor()
+        cur.execute(sql.SQL(query).format(*query_args))
+        value = cur.fetchone()[0]
+        self.__commit()
+        return value
         
     def fill_nulls_with_mean(self, tablename, attribute, new_name=""):
         """Method that fills null values of an attribute with the mean."""
-        resulting_table = self.get_resulting_table(tablename, new_name)
         #Let's check if the attribute is a numeric type, this should not be performed on non-numeric types
         attr_type = self.get_attribute_type(tablename, attribute)
         if SQLTypeHandler().is_numerical(attr_type) is False:
             raise self.AttrTypeError("Filling nulls failed due attribute not being of numeric type (neither integer or float)")
 
-        df = self.load_table_in_dataframe(tablename)
-        mean = df[attribute].mean()
-
-        self.__fill_nulls_with_x(attribute, resulting_table, mean)
+        resulting_table = self.get_resulting_table(tablename, new_name)
+        mean = self.__fill_nulls_with_aggregate(attribute, resulting_table, "avg({2})")
         self.history_manager.write_to_history(resulting_table, resulting_table, attribute, [mean], 10)
 
 
     def fill_nulls_with_median(self, tablename, attribute, new_name=""):
         """Method that fills null values of an attribute with the median."""
-        resulting_table = self.get_resulting_table(tablename, new_name)
         #Let's check if the attribute is a numeric type, this should not be performed on non-numeric types
         attr_type = self.get_attribute_type(tablename, attribute)
         if SQLTypeHandler().is_numerical(attr_type) is False:
             raise self.AttrTypeError("Filling nulls failed due attribute not being of numeric type (neither integer or float)")
 
-        df = self.load_table_in_dataframe(tablename)
-        median = df[attribute].median()
-
-        self.__fill_nulls_with_x(attribute, resulting_table, median)
+        resulting_table = self.get_resulting_table(tablename, new_name)
+        median = self.__fill_nulls_with_aggregate(attribute, resulting_table, "percentile_cont(0.5) WITHIN GROUP (ORDER BY {2})")
         self.history_manager.write_to_history(resulting_table, resulting_table, attribute, [median], 11)
 
 
@@ -1011,5 +1035,168 @@ class TableTransformer:
 
         cur.execute(sql.SQL(query).format(sql.Identifier(self.schema), sql.Identifier(resulting_table),
                                           sql.Identifier(attr_name), sql.Identifier(attribute)))
-        self.db_connection.commit()
+        self.__commit()
         self.history_manager.write_to_history(resulting_table, resulting_table, attribute, [extraction_arg], 7)
+
+    def run_pipeline(self, tablename, steps, new_name=""):
+        """Method that performs a series of transformations (e.g. a cleaning recipe) on a table as a single transaction.
+        If any of the transformations fails, none of them are performed. Consecutive find-and-replace, regex
+        find-and-replace, outlier deletion and custom null filling steps are fused into a single UPDATE so the table
+        is only rewritten once for all of them. The history entries of all the steps are written in one insert.
+        Returns the name of the table containing the result.
+
+        Parameters:
+            steps: A list of (transformation, parameters) tuples, where transformation is the name of a transformation
+                   method of TableTransformer (e.g. 'fill_nulls_with_mean') and parameters a dict containing its
+                   arguments except for the tablename, like {'attribute': 'price'}.
+            new_name: The name of the new table if the TableTransformer is not set to overwrite.
+        """
+        for transformation, parameters in steps:
+            if transformation not in self.__pipeline_steps or not isinstance(parameters, dict):
+                raise self.ValueError('The transformation "{}" can not be used in a pipeline.'.format(transformation))
+
+        replace = self.replace
+        self.__batch = True
+        self.history_manager.begin_batch()
+        try:
+            resulting_table = self.get_resulting_table(tablename, new_name)
+            self.replace = True #All the steps have to be performed on the resulting table.
+            self.__load_attribute_types(resulting_table)
+            group = []
+            for transformation, parameters in steps:
+                if transformation not in self.__fusable_steps:
+                    self.__execute_fused_steps(resulting_table, group)
+                    group = []
+                    getattr(self, transformation)(resulting_table, **parameters)
+                    #The transformation may have changed the attributes of the table
+                    self.__load_attribute_types(resulting_table)
+                    continue
+
+                depth = len([x for x in group if x[1].get('attribute') == parameters.get('attribute')])
+                if depth >= 3: #Every nested step repeats the expression of the previous one, so limit the nesting
+                    self.__execute_fused_steps(resulting_table, group)
+                    group = []
+                group.append((transformation, parameters))
+
+            self.__execute_fused_steps(resulting_table, group)
+            self.history_manager.flush_batch() #This also commits all the transformations
+        except:
+            self.db_connection.rollback()
+            self.history_manager.discard_batch()
+            RowCounter().invalidate(self.schema)
+            raise
+        finally:
+            self.__batch = False
+            self.__attribute_types = dict()
+            self.replace = replace
+
+        return resulting_table
+
+    __pipeline_steps = ['change_attribute_name', 'delete_attribute', 'delete_rows_using_predicate_logic', 'change_attribute_type',
+                        'force_attribute_type', 'find_and_replace', 'regex_find_and_replace', 'one_hot_encode',
+                        'normalize_using_zscore', 'discretize_using_equal_width', 'discretize_using_equal_frequency',
+                        'discretize_using_custom_ranges', 'delete_outliers', 'fill_nulls_with_mean', 'fill_nulls_with_median',
+                        'fill_nulls_with_custom_value', 'extract_part_of_date']
+
+    __fusable_steps = ['find_and_replace', 'regex_find_and_replace', 'delete_outliers', 'fill_nulls_with_custom_value']
+
+    def __load_attribute_types(self, tablename):
+        """Method that caches the types of all the attributes of a table for the duration of a pipeline."""
+        cur = self.db_connection.cursor()
+        cur.execute(("SELECT c.column_name, c.data_type, format_type(a.atttypid, a.atttypmod)"
+                     " FROM information_schema.columns c JOIN pg_attribute a"
+                     " ON a.attrelid = (quote_ident(c.table_schema) || '.' || quote_ident(c.table_name))::regclass"
+                     " AND a.attname = c.column_name WHERE c.table_schema = %s AND c.table_name = %s"),
+                    (self.schema, tablename))
+        self.__attribute_types = dict()
+        for attribute, data_type, full_type in cur.fetchall():
+            self.__attribute_types[(tablename, attribute)] = (data_type, full_type)
+
+    def __execute_fused_steps(self, tablename, steps):
+        """Method that performs a group of fusable pipeline steps with a single UPDATE. Steps on the same attribute
+        are nested in the order they were given, so each step sees the result of the previous one."""
+        if len(steps) == 0:
+            return
+
+        expressions = dict()
+        attributes = []
+        for transformation, parameters in steps:
+            attribute = parameters.get('attribute')
+            if (tablename, attribute) not in self.__attribute_types:
+                raise self.ValueError('The attribute "{}" does not exist in the table.'.format(attribute))
+            if attribute not in attributes:
+                attributes.append(attribute)
+            current = expressions.get(attribute, sql.Identifier(attribute))
+            expressions[attribute] = self.__fused_expression(tablename, transformation, parameters, current)
+
+        assignments = [sql.SQL('{} = {}').format(sql.Identifier(x), expressions[x]) for x in attributes]
+        #Only the rows that actually change are rewritten
+        changes = [sql.SQL('{} IS DISTINCT FROM {}').format(expressions[x], sql.Identifier(x)) for x in attributes]
+        query = sql.SQL('UPDATE {}.{} SET {} WHERE {}').format(sql.Identifier(self.schema), sql.Identifier(tablename),
+                                                             sql.SQL(', ').join(assignments), sql.SQL(' OR ').join(changes))
+        try:
+            self.db_connection.cursor().execute(query)
+        except psycopg2.DataError as e:
+            raise self.ValueError("Could not perform the transformations due to an invalid input value: " + str(e))
+
+        for transformation, parameters in steps:
+            self.history_manager.write_to_history(tablename, tablename, parameters['attribute'],
+                                                  *self.__fused_history_entry(transformation, parameters))
+
+    def __fused_expression(self, tablename, transformation, parameters, current):
+        """Method that returns the SQL expression that applies a fusable step to the current value of the attribute."""
+        attr_type, full_type = self.__attribute_types[(tablename, parameters['attribute'])]
+        attr_type_sql = sql.SQL(full_type)
+        replacement = parameters.get('replacement')
+        if transformation in ['find_and_replace', 'regex_find_and_replace', 'delete_outliers']:
+            replacement = sql.SQL('CAST({} AS {})').format(sql.Literal(replacement), attr_type_sql)
+
+        if transformation == 'find_and_replace':
+            value = parameters['value']
+            if parameters.get('exact', True) is True and parameters.get('replace_all', True) is False:
+                return current #find_and_replace doesn't change anything for this combination either
+            if parameters.get('exact', True) is True:
+                condition = sql.SQL('{} = CAST({} AS {})').format(current, sql.Literal(value), attr_type_sql)
+            else:
+                if str(value).isalnum() is not True: #Only alphanumerical substrings are supported
+                    raise self.ValueError("Values not containing alphanumerical characters can not be used for substring matching. "
+                                          "Please use whole-word matching to find and replace the values.")
+                if SQLTypeHandler().is_string(attr_type) is False:
+                    raise self.AttrTypeError("Substring matching is only possible with character strings. "
+                                             "Please convert the attribute to a character string type.")
+                if parameters.get('replace_all', True) is False:
+                    return sql.SQL('replace({}, {}, {})').format(current, sql.Literal(str(value)),
+                                                                 sql.Literal(str(parameters['replacement'])))
+                condition = sql.SQL('{} LIKE {}').format(current, sql.Literal('%{}%'.format(value)))
+
+        elif transformation == 'regex_find_and_replace':
+            if SQLTypeHandler().is_string(attr_type) is False:
+                raise self.AttrTypeError("Find-and-replace using regular epxressions is only possible with character type attributes. "
+                                         "Please convert the needed attribute to VARCHAR or CHAR.")
+            operator = '~' if parameters.get('case_sens', False) is True else '~*'
+            condition = sql.SQL('{} ' + operator + ' {}').format(current, sql.Literal(parameters['regex']))
+
+        elif transformation == 'delete_outliers':
+            if SQLTypeHandler().is_numerical(attr_type) is False:
+                raise self.AttrTypeError("Deleting outliers failed due attribute not being of numeric type (neither integer or float)")
+            comparator = '>' if parameters['larger'] is True else '<'
+            condition = sql.SQL('{} ' + comparator + ' {}').format(current, sql.Literal(parameters['value']))
+
+        else: # fill_nulls_with_custom_value
+            if SQLTypeHandler().is_numerical(attr_type) is False:
+                raise self.AttrTypeError("Filling nulls failed due attribute not being of numeric type (neither integer or float)")
+            return sql.SQL('COALESCE({}, CAST({} AS {}))').format(current, sql.Literal(parameters['value']), attr_type_sql)
+
+        return sql.SQL('CASE WHEN {} THEN {} ELSE {} END').format(condition, replacement, current)
+
+    def __fused_history_entry(self, transformation, parameters):
+        """Method that returns the history parameters and transformation type of a fusable step, these are the same
+        as the ones written by the transformation method itself."""
+        if transformation == 'find_and_replace':
+            return [parameters['value'], parameters['replacement'], parameters.get('exact', True),
+                    parameters.get('replace_all', True)], 8
+        elif transformation == 'regex_find_and_replace':
+            return [parameters['regex'], parameters['replacement'], parameters.get('case_sens', False)], 9
+        elif transformation == 'delete_outliers':
+            return [parameters['larger'], parameters['value'], parameters['replacement']], 3
+        return [parameters['value']], 12
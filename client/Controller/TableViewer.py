@@ -2,6 +2,10 @@ import math
 import re
 import os
 import csv
+import base64
+import time
+import threading
+from collections import OrderedDict
 
 import json
 import pandas as pd
@@ -10,6 +14,8 @@ import psycopg2
 from psycopg2 import sql
 
 from Model.SQLTypeHandler import SQLTypeHandler
+from Model.RowCounter import RowCounter
+from Model.ViewMaterializer import ViewMaterializer
 
 class TableViewer:
     """Class that extracts table information for viewing purposes.
@@ -22,6 +28,10 @@ class TableViewer:
         is_original: Boolean indicating whether we're viewing the original data uploaded by the users.
     """
 
+    # Histograms shared between all viewers, together with the generation of the table they were computed for.
+    __histogram_cache = dict()
+    __histogram_lock = threading.Lock()
+
     def __init__(self, setid, tablename, engine, db_connection=None, is_original=False):
         self.engine = engine
         self.tablename = tablename
@@ -31,15 +41,8 @@ class TableViewer:
             self.schema = 'original_' + str(setid)
         else:
             self.schema = str(setid)
-        self.maxrows = self.__initialize_rowcount()
-        
-    def __initialize_rowcount(self):
-        cur = self.db_connection.cursor()
-        cur.execute(sql.SQL('SELECT COUNT(*) FROM {}.{}').format(sql.Identifier(self.schema),
-                                                                 sql.Identifier(self.tablename)))
-        rowcount = cur.fetchone()[0]
-        return int(rowcount)
         
+
     def get_attributes(self):
         """Method that returns a list of all attributes of the table."""
         cur = self.db_connection.cursor()
@@ -49,8 +52,9 @@ class TableViewer:
         return attributes
 
     def get_rowcount(self):
-        """Simple method to get the number of rows the table viewed by TableViewer has."""
-        return self.maxrows
+        """Simple method to get the number of rows the table viewed by TableViewer has.
+        For large tables this is an estimate."""
+        return RowCounter().get_rowcount(self.db_connection, self.schema, self.tablename)
 
     def render_json(self, offset, limit, order=False, ascending=True, on_column=""):
         cur = self.db_connection.cursor()
@@ -64,7 +68,84 @@ class TableViewer:
         cur.execute(sql.SQL(read_query).format(*identifiers))
         json_string = json.dumps(cur.fetchall(), default=str)
         return json_string
-        
+
+    def render_json_page(self, offset, limit, on_column, ascending=True, cursor=None):
+        """Method that renders a page of the table ordered on a column using keyset (seek) pagination.
+        If a cursor returned by a previous call is provided and it points to the requested offset, the page
+        is looked up by seeking past the last seen sort key and ctid instead of scanning and discarding all
+        the rows before the offset. Otherwise this falls back to a regular OFFSET query.
+        Returns a tuple of the json string containing the rows and the cursor pointing to the next page.
+
+        Parameters:
+            offset: The row number of the first row of the page.
+            limit: The number of rows on the page.
+            on_column: The attribute the table is ordered on.
+            ascending: Boolean indicating whether the ordering is ascending or descending.
+            cursor: The cursor token that was returned together with the previous page.
+        """
+        if ViewMaterializer(self.db_connection).is_view(self.schema, self.tablename):
+            # Lazy copies have no ctid to break ties with, so they are paged using OFFSET
+            return self.render_json(offset, limit, True, ascending, on_column), None
+
+        seek = self.__decode_cursor(cursor, offset, on_column, ascending)
+        ordering = 'ASC' if ascending else 'DESC'
+        comparator = '>' if ascending else '<'
+        query_args = [sql.Identifier(on_column), sql.Identifier(self.schema), sql.Identifier(self.tablename)]
+        read_query = 'SELECT ctid::text, {0}, * FROM {1}.{2}'
+        values = []
+
+        if seek is not None:
+            # The ctid is used as tiebreaker, because the values of the ordered column don't have to be unique.
+            # Postgres puts NULL values last in ascending order and first in descending order.
+            if seek['k'] is None and ascending:
+                read_query += ' WHERE ({0} IS NULL AND ctid > %s::tid)'
+                values = [seek['t']]
+            elif seek['k'] is None:
+                read_query += ' WHERE (({0} IS NULL AND ctid < %s::tid) OR {0} IS NOT NULL)'
+                values = [seek['t']]
+            else:
+                read_query += ' WHERE ({0} cmp %s OR ({0} = %s AND ctid cmp %s::tid)'.replace('cmp', comparator)
+                read_query += ' OR {0} IS NULL)' if ascending else ')'
+                values = [seek['k'], seek['k'], seek['t']]
+
+        read_query += ' ORDER BY {0} ' + ordering + ', ctid ' + ordering + ' LIMIT %s'
+        values.append(limit)
+        if seek is None:
+            read_query += ' OFFSET %s'
+            values.append(offset)
+
+        cur = self.db_connection.cursor()
+        cur.execute(sql.SQL(read_query).format(*query_args), values)
+        rows = cur.fetchall()
+        next_cursor = None
+        if len(rows) > 0:
+            next_cursor = self.__encode_cursor(offset + len(rows), on_column, ascending, rows[-1][1], rows[-1][0])
+
+        json_string = json.dumps([row[2:] for row in rows], default=str)
+        return json_string, next_cursor
+
+    def __encode_cursor(self, offset, on_column, ascending, key, ctid):
+        """Method that packs the position of the last row of a page into an url-safe cursor token."""
+        position = {'o': offset, 'c': on_column, 'a': ascending, 'k': key, 't': ctid}
+        token = json.dumps(position, default=str).encode('utf-8')
+        return base64.urlsafe_b64encode(token).decode('ascii')
+
+    def __decode_cursor(self, cursor, offset, on_column, ascending):
+        """Method that unpacks a cursor token. None is returned if the token is invalid or if it doesn't
+        point to the requested offset using the same ordering, in which case the OFFSET query is used."""
+        if not cursor:
+            return None
+        try:
+            position = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+        except (ValueError, TypeError):
+            return None
+
+        if not isinstance(position, dict) or not re.match(r'^\(\d+,\d+\)$', str(position.get('t'))):
+            return None
+        if position.get('o') != offset or position.get('c') != on_column or position.get('a') != ascending:
+            return None
+        return position
+
     def get_columntype_dict(self):
         """Method that generates all the types of the table attributes."""
         cur = self.db_connection.cursor()
@@ -89,45 +170,71 @@ class TableViewer:
 
         return type_dict
 
-    def get_numerical_histogram(self, columnname, bins=10):
+    def get_numerical_histogram(self, columnname, bins=10, sample_percent=None):
+        """Method that divides the values of a numerical column in bins of equal width and counts the values in each bin.
+        The bins are computed by postgres so only the counts are transferred. Returns a tuple of the list of bin labels,
+        the list of bin sizes and a boolean indicating whether the column is numerical.
+        The results are cached until the table is modified.
+
+        Parameters:
+            columnname: The attribute to make the histogram of.
+            bins: The number of bins.
+            sample_percent: If specified, only a random sample of this percentage of the table's pages is used and
+                            the bin sizes are scaled up accordingly. Meant for very large tables.
+        """
         # first check if the attribute type is numerical
-        self.cur.execute(sql.SQL("SELECT pg_typeof({}) FROM {}.{}").format(sql.Identifier(columnname),
-                                                                                                     sql.Identifier(self.schema),
-                                                                                                     sql.Identifier(self.tablename)))
-        type = self.cur.fetchone()[0]
+        type = self.__get_column_types().get(columnname)
         if not SQLTypeHandler().is_numerical(type):
             return [], [], False
 
-        self.cur.execute(sql.SQL("SELECT {} FROM {}.{} ORDER BY {} ASC").format(sql.Identifier(columnname),
-                                                                                sql.Identifier(self.schema),
-                                                                                sql.Identifier(self.tablename),
-                                                                                sql.Identifier(columnname)))
-        values = [x[0] for x in self.cur.fetchall()]
-        min_val = min(values)
-        max_val = max(values)
-        interval_size = (max_val - min_val) / bins
-        distributed_values = list()
-        current_bin = list()
-        next_interval = min_val + interval_size
-        intervals = [(min_val, next_interval)]
-        for value in values:
-            if value >= next_interval:
-                next_interval += interval_size
-                intervals.append((intervals[-1][1], next_interval))
-                distributed_values.append(current_bin)
-                current_bin = [value]
-            else:
-                current_bin.append(value)
-
-        # if the last bin was not added
-        if len(intervals) != len(distributed_values):
-            distributed_values.append(current_bin)
-
-        sizes = [len(x) for x in distributed_values]
-        # stringify the tuples representing the intervals
-        intervals = [str((math.ceil(x[0]), math.floor(x[1]))) for x in intervals]
-
-        return intervals, sizes, True
+        cache_key = (self.schema, self.tablename, columnname, bins, sample_percent)
+        generation = RowCounter().get_generation(self.schema, self.tablename)
+        with TableViewer.__histogram_lock:
+            cached = TableViewer.__histogram_cache.get(cache_key)
+        if cached is not None and cached[0] == generation and time.monotonic() - cached[1] <= RowCounter().time_to_live:
+            return cached[2]
+
+        sample = sql.SQL('')
+        if sample_percent is not None and ViewMaterializer(self.db_connection).is_view(self.schema, self.tablename):
+            sample_percent = None # views can't be sampled, so lazy copies are always scanned completely
+        if sample_percent is not None:
+            # the fixed seed makes sure both scans of the CTE and the main query see the same sample
+            sample = sql.SQL('TABLESAMPLE SYSTEM ({}) REPEATABLE (0)').format(sql.Literal(float(sample_percent)))
+        query = sql.SQL("WITH bounds AS (SELECT MIN({0})::float8 AS lo, MAX({0})::float8 AS hi FROM {1}.{2} {3})"
+                        " SELECT b.lo, b.hi, CASE WHEN b.lo = b.hi THEN 1"
+                        " ELSE LEAST(width_bucket(x.{0}::float8, b.lo, b.hi, %s), %s) END AS bucket, COUNT(*)"
+                        " FROM {1}.{2} x {3}, bounds b WHERE x.{0} IS NOT NULL"
+                        " GROUP BY b.lo, b.hi, bucket ORDER BY bucket").format(sql.Identifier(columnname),
+                                                                               sql.Identifier(self.schema),
+                                                                               sql.Identifier(self.tablename), sample)
+        self.cur.execute(query, [bins, bins])
+        rows = self.cur.fetchall()
+
+        intervals = []
+        sizes = []
+        if len(rows) > 0:
+            min_val = rows[0][0]
+            max_val = rows[0][1]
+            nr_bins = bins if min_val != max_val else 1
+            interval_size = (max_val - min_val) / nr_bins
+            bucket_sizes = dict((row[2], row[3]) for row in rows)
+            for i in range(1, nr_bins + 1):
+                size = bucket_sizes.get(i, 0)
+                if sample_percent is not None:
+                    size = int(round(size * 100 / float(sample_percent)))
+                sizes.append(size)
+                lower = min_val + (i - 1) * interval_size
+                upper = max_val if i == nr_bins else min_val + i * interval_size
+                # stringify the tuples representing the intervals
+                intervals.append(str((math.ceil(lower), math.floor(upper))))
+
+        result = (intervals, sizes, True)
+        with TableViewer.__histogram_lock:
+            if len(TableViewer.__histogram_cache) >= 256:
+                TableViewer.__histogram_cache.clear()
+            TableViewer.__histogram_cache[cache_key] = (generation, time.monotonic(), result)
+
+        return result
 
     def get_frequency_pie_chart(self, columnname):
         # get the frequency of every value
@@ -191,11 +298,7 @@ class TableViewer:
         """Wrapper that returns result of aggregate function"""
 
         # first check if the attribute type is numerical
-        self.cur.execute(
-            sql.SQL("SELECT pg_typeof({}) FROM {}.{}").format(sql.Identifier(columnname),
-                                                                     sql.Identifier(self.schema),
-                                                                     sql.Identifier(self.tablename)))
-        type = self.cur.fetchone()[0]
+        type = self.__get_column_types().get(columnname)
         if not SQLTypeHandler().is_numerical(type):
             return "N/A"
 
@@ -216,3 +319,174 @@ class TableViewer:
     def get_avg(self, columnname):
         """Return average value of the column"""
         return self.__aggregate_function(columnname, "AVG")
+
+    def profile_columns(self, columns=None, approximate=False):
+        """Method that computes a profile of one or more columns of the table. The profile of a column is a dict
+        containing its type, the number of rows, the number of NULL values, the number of distinct values, the most
+        frequent value, the minimum, the maximum, the average and the (population) standard deviation.
+        All the columns are profiled with two queries that each scan the table once, one for the aggregates and one
+        that finds the most frequent value of every column. Statistics that don't apply to the type of the column
+        are None.
+
+        Parameters:
+            columns: List of the attributes to profile, all attributes are profiled if this is None.
+            approximate: Boolean indicating whether the statistics gathered by postgres (pg_stats) may be used
+                         instead of scanning the table. The average and standard deviation aren't available in
+                         this case. Columns without statistics are still profiled exactly.
+        """
+        column_types = self.__get_column_types()
+        if columns is None:
+            columns = list(column_types.keys())
+
+        profile = dict()
+        if approximate is True:
+            profile = self.__profile_from_statistics(columns, column_types)
+
+        remaining = [x for x in columns if x not in profile]
+        if len(remaining) > 0:
+            profile.update(self.__profile_from_scan(remaining, column_types))
+
+        return profile
+
+    def render_profile_json(self, columns=None, approximate=False):
+        """Method that returns the profile of the columns as a json string."""
+        return json.dumps(self.profile_columns(columns, approximate), default=str)
+
+    def __profile_from_scan(self, columns, column_types):
+        """Method that computes the exact profile of the columns, the aggregates are computed in a single query
+        and the most frequent values in a second one."""
+        type_handler = SQLTypeHandler()
+        aggregates = [sql.SQL('COUNT(*)')]
+        for column in columns:
+            attr_type = column_types[column]
+            identifier = sql.Identifier(column)
+            comparable = self.__is_comparable(attr_type)
+            numerical = type_handler.is_numerical(attr_type)
+            aggregates.append(sql.SQL('COUNT({})').format(identifier))
+            if comparable:
+                aggregates.append(sql.SQL('COUNT(DISTINCT {0})').format(identifier))
+            else:
+                aggregates.append(sql.SQL('NULL'))
+            if comparable and attr_type != 'boolean': # postgres has no MIN and MAX for booleans
+                aggregates.append(sql.SQL('MIN({0})').format(identifier))
+                aggregates.append(sql.SQL('MAX({0})').format(identifier))
+            else:
+                aggregates.extend([sql.SQL('NULL')] * 2)
+            if numerical:
+                aggregates.append(sql.SQL('AVG({0})').format(identifier))
+                aggregates.append(sql.SQL('stddev_pop({0})').format(identifier))
+            else:
+                aggregates.extend([sql.SQL('NULL')] * 2)
+
+        query = sql.SQL('SELECT {} FROM {}.{}').format(sql.SQL(', ').join(aggregates), sql.Identifier(self.schema),
+                                                        sql.Identifier(self.tablename))
+        self.cur.execute(query)
+        row = self.cur.fetchone()
+        rowcount = row[0]
+
+        modes = self.__get_modes([x for x in columns if self.__is_comparable(column_types[x])])
+
+        profile = dict()
+        for i in range(len(columns)):
+            values = row[1 + 6 * i: 7 + 6 * i]
+            profile[columns[i]] = {
+                'type':        column_types[columns[i]],
+                'rows':        rowcount,
+                'nulls':       rowcount - values[0],
+                'distinct':    values[1],
+                'mode':        modes.get(columns[i]),
+                'min':         values[2],
+                'max':         values[3],
+                'avg':         values[4],
+                'stddev':      values[5],
+                'approximate': False
+            }
+
+        return profile
+
+    def __get_modes(self, columns):
+        """Method that returns the most frequent value of every column as a dict, the same value as
+        get_most_frequent_value: NULL counts as a value and ties go to the smallest value. The frequencies of all
+        the columns are counted in a single scan with grouping sets, then the most frequent value of every set is
+        ranked first."""
+        if len(columns) == 0:
+            return dict()
+
+        identifiers = [sql.Identifier(column) for column in columns]
+        values = [sql.Identifier('value_' + str(i)) for i in range(len(columns))]
+        grouped = [sql.Identifier('grouped_' + str(i)) for i in range(len(columns))]
+        counts = sql.SQL('SELECT {}, {}, COUNT(*) AS frequency FROM {}.{} GROUP BY GROUPING SETS ({})').format(
+            sql.SQL(', ').join(sql.SQL('{} AS {}').format(x, y) for x, y in zip(identifiers, values)),
+            sql.SQL(', ').join(sql.SQL('GROUPING({}) AS {}').format(x, y) for x, y in zip(identifiers, grouped)),
+            sql.Identifier(self.schema), sql.Identifier(self.tablename),
+            sql.SQL(', ').join(sql.SQL('({})').format(x) for x in identifiers))
+        # within the set of a column the other columns are all NULL, so ordering by all of them orders by that column
+        query = sql.SQL('SELECT {0}, {1} FROM (SELECT *, ROW_NUMBER() OVER (PARTITION BY {1} ORDER BY frequency DESC, {0})'
+                        ' AS rank FROM ({2}) AS counts) AS ranked WHERE rank = 1').format(
+            sql.SQL(', ').join(values), sql.SQL(', ').join(grouped), counts)
+        self.cur.execute(query)
+
+        modes = dict()
+        for row in self.cur.fetchall():
+            # the column of the set is the one that isn't aggregated away
+            i = list(row[len(columns):]).index(0)
+            modes[columns[i]] = row[i]
+        return modes
+
+    def __profile_from_statistics(self, columns, column_types):
+        """Method that estimates the profile of the columns from the statistics postgres keeps in pg_stats.
+        Columns that have no statistics (e.g. because the table hasn't been analyzed yet) are left out."""
+        query = ('SELECT attname, null_frac, n_distinct, most_common_vals::text::text[], most_common_freqs,'
+                 ' histogram_bounds::text::text[] FROM pg_stats WHERE schemaname = %s AND tablename = %s AND attname = ANY(%s)')
+        self.cur.execute(sql.SQL(query), [self.schema, self.tablename, list(columns)])
+        statistics = self.cur.fetchall()
+        rowcount = self.get_rowcount()
+
+        profile = dict()
+        for column, null_frac, n_distinct, common_values, common_freqs, bounds in statistics:
+            attr_type = column_types[column]
+            # A negative n_distinct is the number of distinct values divided by the number of rows.
+            if n_distinct < 0:
+                n_distinct = -n_distinct * rowcount
+            min_val = None
+            max_val = None
+            if SQLTypeHandler().is_numerical(attr_type):
+                values = [float(x) for x in (common_values or []) + (bounds or [])]
+                if len(values) > 0:
+                    min_val = min(values)
+                    max_val = max(values)
+
+            # the common values never contain NULL, like get_most_frequent_value NULL is the mode if it's
+            # more frequent than any value
+            mode = None
+            if common_values and common_freqs[0] >= null_frac:
+                mode = common_values[0]
+
+            profile[column] = {
+                'type':        attr_type,
+                'rows':        rowcount,
+                'nulls':       int(round(null_frac * rowcount)),
+                'distinct':    int(round(n_distinct)),
+                'mode':        mode,
+                'min':         min_val,
+                'max':         max_val,
+                'avg':         None,
+                'stddev':      None,
+                'approximate': True
+            }
+
+        return profile
+
+    def __is_comparable(self, attr_type):
+        """Method that returns whether the values of a type can be ordered, which is needed for the mode."""
+        type_handler = SQLTypeHandler()
+        return (type_handler.is_numerical(attr_type) or type_handler.is_string(attr_type)
+                or type_handler.is_date_type(attr_type)
+                or attr_type in ['boolean', 'time without time zone', 'time with time zone'])
+
+    def __get_column_types(self):
+        """Method that returns an ordered dict mapping each attribute of the table to its postgres type."""
+        query = ("SELECT column_name, data_type FROM information_schema.columns"
+                 " WHERE table_schema = %s AND table_name = %s ORDER BY ordinal_position")
+        self.cur.execute(sql.SQL(query), [self.schema, self.tablename])
+        return OrderedDict(self.cur.fetchall())
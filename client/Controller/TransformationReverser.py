@@ -6,6 +6,8 @@ import psycopg2
 from Controller.TableTransformer import TableTransformer
 from Controller.QueryExecutor import QueryExecutor
 from Controller.Deduplicator import Deduplicator
+from Model.RowCounter import RowCounter
+from Model.ViewMaterializer import ViewMaterializer
 
 
 
@@ -97,19 +99,19 @@ class TransformationReverser:
         cur = self.db_connection.cursor()
         cur.execute(('DELETE FROM system.dataset_history WHERE transformation_id = %s'), [t_id])
         self.db_connection.commit()
+        RowCounter().invalidate_history(self.setid)
 
     def drop_backup(self, backup_name):
         """Method that drops a backup of a table in our system."""
-        cur = self.db_connection.cursor()
-        cur.execute(('DROP TABLE backup."{}"').format(backup_name))
+        ViewMaterializer(self.db_connection).drop('backup', backup_name)
         self.db_connection.commit()
 
     def drop_table(self, table):
         """Execute query that drops an SQL table of the dataset."""
-        cur = self.db_connection.cursor()
-        query_args = [self.schema, self.table_name]
-        cur.execute(('DROP TABLE IF EXISTS "{}"."{}"').format(*query_args))
+        #Backups and copies that are views over the table are materialized first
+        ViewMaterializer(self.db_connection).drop(self.schema, self.table_name, True)
         self.db_connection.commit()
+        RowCounter().invalidate(self.schema, self.table_name)
 
     def recreate_table_from_backup(self, table_tuple):
         """Execute query that recreates a table using another table as base."""
@@ -117,6 +119,7 @@ class TransformationReverser:
         query_args = [self.schema, self.table_name, table_tuple[0], table_tuple[1]]
         cur.execute(('CREATE TABLE "{}"."{}" AS SELECT * FROM "{}"."{}"').format(*query_args))
         self.db_connection.commit()
+        RowCounter().invalidate(self.schema, self.table_name)
     
     def get_backups(self):
         """Returns the backups (a tuple of the backup name and id) used to perform the undo."""
@@ -0,0 +1,197 @@
+import hashlib
+import io
+import os
+import time
+import uuid
+import zlib
+
+import psycopg2.extras
+
+from Model.TableUploader import FileException
+
+
+class ChunkedUploadManager:
+    """Class that receives uploaded files in chunks, so that an upload that was interrupted can be resumed
+    at the offset where it stopped instead of starting over.
+
+    Every chunk is sent with its offset in the file and a checksum, the checksum is verified before the chunk
+    is written to the staging file of the upload. The state of the uploads is stored in system.chunked_uploads,
+    so that the chunks of an upload can be received by any process. Everything that is written is committed
+    right away.
+
+    Attributes:
+        db_connection: psycopg2 database connection to execute SQL queries.
+        max_chunk_size: The maximum size of a chunk in bytes.
+    """
+
+    # the checksum algorithms that can be used for the chunks, mapped to a function returning the hex digest
+    checksums = {'sha256': lambda data: hashlib.sha256(data).hexdigest(),
+                 'crc32': lambda data: format(zlib.crc32(data) & 0xffffffff, '08x')}
+
+    class ChunkError(Exception):
+        """
+        Base exception for chunks that are refused, the upload itself is left unchanged.
+        """
+
+    class OffsetError(ChunkError):
+        """
+        This exception is raised when a chunk doesn't start where the data that has been received so far ends,
+        for example when a chunk is sent again after the response to the first attempt got lost.
+        The attribute offset is the offset of the next chunk that is expected.
+        """
+
+        def __init__(self, message, offset):
+            super().__init__(message)
+            self.offset = offset
+
+    class ChecksumError(ChunkError):
+        """
+        This exception is raised when the checksum of a chunk doesn't match its contents.
+        """
+
+    class ClosedError(ChunkError):
+        """
+        This exception is raised when a chunk is sent for an upload that doesn't receive data anymore,
+        because it's complete or because it was cancelled.
+        """
+
+    def __init__(self, db_connection, max_chunk_size=16777216):
+        self.db_connection = db_connection
+        self.max_chunk_size = max_chunk_size
+
+    def start(self, setid, userid, filename, size):
+        """Method that registers an upload of a file of size bytes for a dataset, the chunks are written to
+        the staging file filename, which is created empty. Returns the id of the upload."""
+        # the id is used in urls, so it must not be guessable
+        upload_id = uuid.uuid4().hex
+        open(filename, 'wb').close()
+
+        cur = self.db_connection.cursor()
+        cur.execute("INSERT INTO system.chunked_uploads(upload_id, setid, userid, filename, size) VALUES (%s, %s, %s, %s, %s)",
+                    [upload_id, setid, userid, filename, size])
+        self.db_connection.commit()
+        return upload_id
+
+    def get(self, upload_id):
+        """Method that returns an upload as a dict, or None if it doesn't exist."""
+        cur = self.db_connection.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        cur.execute("SELECT * FROM system.chunked_uploads WHERE upload_id = %s", [upload_id])
+        return cur.fetchone()
+
+    def get_status(self, upload_id):
+        """Method that returns the status of an upload, 'receiving', 'complete' or 'cancelled', and the number
+        of bytes that have been received so far."""
+        upload = self.get(upload_id)
+        # the status is polled, so the connection isn't left idle in a transaction between two polls
+        self.db_connection.commit()
+        return ('cancelled', 0) if upload is None else (upload['status'], upload['bytes_received'])
+
+    def append(self, upload_id, offset, data, checksum):
+        """Method that writes a chunk to the staging file of an upload and returns the upload as a dict.
+        The checksum has the form '<algorithm>:<hex digest>', with an algorithm of ChunkedUploadManager.checksums.
+        The upload is complete once all of its bytes have been received."""
+        if len(data) == 0:
+            raise self.ChunkError("The chunk is empty.")
+        if len(data) > self.max_chunk_size:
+            raise self.ChunkError("The chunk is larger than " + str(self.max_chunk_size) + " bytes.")
+        self.__verify(data, checksum)
+
+        # the upload is locked, so that chunks of the same upload can't be written at the same time
+        cur = self.db_connection.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        cur.execute("SELECT * FROM system.chunked_uploads WHERE upload_id = %s FOR UPDATE", [upload_id])
+        upload = cur.fetchone()
+        try:
+            if upload is None or upload['status'] != 'receiving':
+                raise self.ClosedError("The upload doesn't accept chunks anymore.")
+            if offset != upload['bytes_received']:
+                raise self.OffsetError("The chunk should start at offset " + str(upload['bytes_received']) + ".",
+                                       upload['bytes_received'])
+            if offset + len(data) > upload['size']:
+                raise self.ChunkError("The chunk extends past the end of the file.")
+
+            # the chunk is written at its offset, so whatever a failed attempt wrote is overwritten
+            with open(upload['filename'], 'r+b') as staging_file:
+                staging_file.seek(offset)
+                staging_file.write(data)
+                staging_file.flush()
+                os.fsync(staging_file.fileno())
+
+            bytes_received = offset + len(data)
+            status = 'complete' if bytes_received == upload['size'] else 'receiving'
+            cur.execute("UPDATE system.chunked_uploads SET bytes_received = %s, status = %s, updated = now()"
+                        " WHERE upload_id = %s RETURNING *", [bytes_received, status, upload_id])
+            upload = cur.fetchone()
+            self.db_connection.commit()
+            return upload
+        except:
+            self.db_connection.rollback()
+            raise
+
+    def cancel(self, upload_id):
+        """Method that stops an upload from receiving chunks, the staging file is left to the caller."""
+        cur = self.db_connection.cursor()
+        cur.execute("UPDATE system.chunked_uploads SET status = 'cancelled', updated = now()"
+                    " WHERE upload_id = %s AND status = 'receiving'", [upload_id])
+        self.db_connection.commit()
+
+    def __verify(self, data, checksum):
+        algorithm, separator, digest = str(checksum).partition(":")
+        if separator == "" or algorithm.lower() not in ChunkedUploadManager.checksums:
+            raise self.ChecksumError("Invalid checksum, expected '<algorithm>:<digest>' with one of the algorithms "
+                                     + ", ".join(ChunkedUploadManager.checksums) + ".")
+        if ChunkedUploadManager.checksums[algorithm.lower()](data) != digest.strip().lower():
+            raise self.ChecksumError("The checksum of the chunk doesn't match, it was probably damaged in transit.")
+
+
+class StagingFile(io.RawIOBase):
+    """Binary file-like object that reads the staging file of a chunked upload while the chunks are still
+    arriving. Only the bytes of which the upload has been committed are read, reaching the end of them blocks
+    until more data arrives, the file only ends once the upload is complete.
+
+    Attributes:
+        filename: The staging file.
+        get_status: Function that returns the status of the upload and the number of bytes received,
+                    see ChunkedUploadManager.get_status.
+        poll_interval: The number of seconds between two checks for new data.
+        timeout: The number of seconds after which waiting for new data is given up.
+    """
+
+    def __init__(self, filename, get_status, poll_interval=0.5, timeout=3600):
+        super().__init__()
+        self.raw_file = open(filename, 'rb')
+        self.get_status = get_status
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.position = 0
+        self.bytes_received = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        waited = 0
+        while self.position >= self.bytes_received:
+            # a chunk that is being written can already be in the file, it's only read once it's committed
+            status, self.bytes_received = self.get_status()
+            if status == 'cancelled':
+                raise FileException("The upload was cancelled.")
+            if self.position < self.bytes_received:
+                break
+            if status == 'complete':
+                return 0
+
+            if waited >= self.timeout:
+                raise FileException("The upload was interrupted, no data was received for " + str(self.timeout) + " seconds.")
+            time.sleep(self.poll_interval)
+            waited += self.poll_interval
+
+        data = self.raw_file.read(min(len(buffer), self.bytes_received - self.position))
+        if len(data) == 0:
+            raise FileException("The staging file of the upload is incomplete.")
+        self.position += len(data)
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        self.raw_file.close()
+        super().close()
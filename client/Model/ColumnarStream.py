@@ -0,0 +1,147 @@
+import sqlalchemy
+
+from Model.SQLTypeHandler import SQLTypeHandler
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+class ColumnarStream:
+    """Class that writes rows of a table as a Parquet or Arrow IPC file, in the form of an iterator of byte chunks.
+    Every batch of rows becomes a row group (Parquet) or record batch (Arrow), so the file is produced while the
+    rows are being read and never has to be stored as a whole.
+
+    Attributes:
+        file_format: 'parquet' or 'arrow'.
+        col_types: Dict that maps the column names to their postgres types, in the order of the columns.
+        schema: The pyarrow schema of the file.
+    """
+
+    extensions = {'parquet': '.parquet', 'arrow': '.arrow'}
+    mimetypes = {'parquet': 'application/vnd.apache.parquet', 'arrow': 'application/vnd.apache.arrow.file'}
+
+    def __init__(self, file_format, col_types):
+        if not ColumnarStream.is_available():
+            raise RuntimeError("Columnar exports require the pyarrow package.")
+        if file_format not in ColumnarStream.extensions:
+            raise ValueError("Unsupported file format: '" + str(file_format) + "'.")
+        self.file_format = file_format
+        self.col_types = col_types
+        self.schema = pyarrow.schema([(name, ColumnarStream.to_arrow_type(col_types[name])) for name in col_types])
+        self.buffer = bytearray()
+        self.position = 0
+        self.closed = False
+
+    @staticmethod
+    def is_available():
+        """Method that returns whether pyarrow is installed."""
+        return pyarrow is not None
+
+    @staticmethod
+    def to_arrow_type(pg_type):
+        """Method that maps a postgres type to a pyarrow type through the SQLAlchemy type of SQLTypeHandler,
+        types without an equivalent are written as strings."""
+        sqla_type = SQLTypeHandler().to_sqla_object(pg_type)
+        if isinstance(sqla_type, sqlalchemy.types.SmallInteger):
+            return pyarrow.int16()
+        elif isinstance(sqla_type, sqlalchemy.types.BigInteger):
+            return pyarrow.int64()
+        elif isinstance(sqla_type, sqlalchemy.types.Integer):
+            return pyarrow.int32()
+        elif isinstance(sqla_type, sqlalchemy.types.Numeric):
+            return pyarrow.float64()
+        elif isinstance(sqla_type, sqlalchemy.types.Boolean):
+            return pyarrow.bool_()
+        elif isinstance(sqla_type, sqlalchemy.types.DateTime):
+            return pyarrow.timestamp('us', tz='UTC' if sqla_type.timezone else None)
+        elif isinstance(sqla_type, sqlalchemy.types.Date):
+            return pyarrow.date32()
+        elif isinstance(sqla_type, sqlalchemy.types.Time):
+            return pyarrow.time64('us')
+        else:
+            return pyarrow.string()
+
+    @staticmethod
+    def to_postgres_type(arrow_type):
+        """Method that maps a pyarrow type to a postgres type, returns None if there is no equivalent."""
+        if pyarrow.types.is_dictionary(arrow_type):
+            arrow_type = arrow_type.value_type
+
+        if pyarrow.types.is_boolean(arrow_type):
+            return 'boolean'
+        elif arrow_type in [pyarrow.int8(), pyarrow.uint8(), pyarrow.int16()]:
+            return 'smallint'
+        elif arrow_type in [pyarrow.uint16(), pyarrow.int32()]:
+            return 'integer'
+        elif arrow_type in [pyarrow.uint32(), pyarrow.int64()]:
+            return 'bigint'
+        elif arrow_type == pyarrow.uint64() or pyarrow.types.is_decimal(arrow_type):
+            return 'numeric'
+        elif arrow_type in [pyarrow.float16(), pyarrow.float32()]:
+            return 'real'
+        elif arrow_type == pyarrow.float64():
+            return 'double precision'
+        elif pyarrow.types.is_string(arrow_type) or pyarrow.types.is_large_string(arrow_type):
+            return 'varchar'
+        elif pyarrow.types.is_date(arrow_type):
+            return 'date'
+        elif pyarrow.types.is_time(arrow_type):
+            return 'time'
+        elif pyarrow.types.is_timestamp(arrow_type):
+            return 'timestamp' if arrow_type.tz is None else 'timestamptz'
+        else:
+            return None
+
+    def write(self, data):
+        """Method called by pyarrow with every piece of the file."""
+        self.buffer += data
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def stream(self, batches):
+        """Generator of the file containing the rows, batches is an iterable of lists of row tuples."""
+        if self.file_format == 'parquet':
+            writer = pyarrow.parquet.ParquetWriter(self, self.schema)
+        else:
+            writer = pyarrow.ipc.new_file(self, self.schema)
+
+        for rows in batches:
+            batch = self.__to_record_batch(rows)
+            if self.file_format == 'parquet':
+                writer.write_table(pyarrow.Table.from_batches([batch]), row_group_size=len(rows))
+            else:
+                writer.write_batch(batch)
+            yield self.__drain()
+
+        writer.close()
+        yield self.__drain()
+
+    def __to_record_batch(self, rows):
+        arrays = []
+        for i, field in enumerate(self.schema):
+            values = [row[i] for row in rows]
+            if field.type == pyarrow.float64():
+                # numeric columns are returned as Decimal
+                values = [None if value is None else float(value) for value in values]
+            elif field.type == pyarrow.string():
+                values = [None if value is None else str(value) for value in values]
+            arrays.append(pyarrow.array(values, type=field.type))
+        return pyarrow.RecordBatch.from_arrays(arrays, schema=self.schema)
+
+    def __drain(self):
+        data = bytes(self.buffer)
+        self.buffer = bytearray()
+        return data
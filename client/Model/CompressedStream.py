@@ -0,0 +1,51 @@
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class CompressedStream:
+    """Class that compresses an iterator of byte chunks while it's being consumed, so a download can
+    be compressed without storing the uncompressed (or compressed) file as a whole.
+
+    Attributes:
+        method: The compression method, 'gzip' or 'zstd' (only if the zstandard package is installed).
+        level: The compression level, a higher level compresses better but is slower.
+    """
+
+    extensions = {'gzip': '.gz', 'zstd': '.zst'}
+    mimetypes = {'gzip': 'application/gzip', 'zstd': 'application/zstd'}
+
+    def __init__(self, method='gzip', level=None):
+        if method not in CompressedStream.get_methods():
+            raise ValueError("Unsupported compression method: '" + str(method) + "'.")
+        self.method = method
+        self.level = level
+
+    @staticmethod
+    def get_methods():
+        """Method that returns the compression methods that are available."""
+        methods = ['gzip']
+        if zstandard is not None:
+            methods.append('zstd')
+        return methods
+
+    def stream(self, chunks):
+        """Generator of the compressed chunks, empty chunks are left out."""
+        compressor = self.__get_compressor()
+        for chunk in chunks:
+            data = compressor.compress(chunk)
+            if len(data) > 0:
+                yield data
+        yield compressor.flush()
+
+    def __get_compressor(self):
+        if self.method == 'zstd':
+            level = 3 if self.level is None else self.level
+            return zstandard.ZstdCompressor(level=level).compressobj()
+
+        # wbits 16 + MAX_WBITS writes a gzip header and trailer instead of a raw zlib stream
+        level = 6 if self.level is None else self.level
+        return zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
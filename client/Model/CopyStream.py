@@ -0,0 +1,78 @@
+import queue
+import threading
+
+
+class CopyStream:
+    """Class that turns the output of a 'COPY ... TO STDOUT' statement into an iterator of byte chunks.
+
+    The COPY is executed in a separate thread that writes into a bounded queue, so the memory used doesn't
+    depend on the size of the table and the consumer (e.g. a streaming response) receives data while
+    postgres is still producing it. If the consumer stops iterating early, the COPY is cancelled.
+
+    Attributes:
+        db_connection: psycopg2 database connection that executes the COPY, it must not be used by
+                       anything else while the stream is being iterated.
+        query: The COPY statement as a string.
+        chunk_size: The minimum size in bytes of the chunks, except for the last one.
+        max_chunks: The maximum number of chunks that are buffered before the COPY has to wait.
+    """
+
+    __end = object()
+
+    def __init__(self, db_connection, query, chunk_size=65536, max_chunks=8):
+        self.db_connection = db_connection
+        self.query = query
+        self.chunk_size = chunk_size
+        self.chunks = queue.Queue(max_chunks)
+        self.buffer = bytearray()
+        self.closed = False
+
+    def __iter__(self):
+        worker = threading.Thread(target=self.__run, daemon=True)
+        worker.start()
+        finished = False
+        failed = False
+        try:
+            while True:
+                chunk = self.chunks.get()
+                if chunk is CopyStream.__end:
+                    finished = True
+                    break
+                if isinstance(chunk, Exception):
+                    finished = failed = True
+                    raise chunk
+                yield chunk
+        finally:
+            if not finished: # The consumer stopped early, so the COPY is aborted
+                self.closed = True
+                self.db_connection.cancel()
+            worker.join()
+            if not finished or failed:
+                self.db_connection.rollback()
+
+    def write(self, data):
+        """Method called by psycopg2 with every piece of the COPY output."""
+        if self.closed:
+            return
+        self.buffer += data if isinstance(data, bytes) else data.encode('utf-8')
+        if len(self.buffer) >= self.chunk_size:
+            self.__put(bytes(self.buffer))
+            self.buffer = bytearray()
+
+    def __run(self):
+        try:
+            cur = self.db_connection.cursor()
+            cur.copy_expert(self.query, self)
+            if len(self.buffer) > 0:
+                self.__put(bytes(self.buffer))
+            self.__put(CopyStream.__end)
+        except Exception as e:
+            self.__put(e)
+
+    def __put(self, item):
+        while not self.closed:
+            try:
+                self.chunks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
@@ -18,7 +18,7 @@ class _DatabaseLoader:
             self.host = host
             self.password = password
             self.release = release
-            self.connection_pool = psycopg2.pool.SimpleConnectionPool(5, 20, dbname=dbname, user=user, password=password, host=host)
+            self.connection_pool = psycopg2.pool.ThreadedConnectionPool(5, 20, dbname=dbname, user=user, password=password, host=host)
             self.engine = create_engine("postgresql://{}:{}@{}/{}".format(self.user, self.password, self.host, self.dbname),
                                          pool_size=20, max_overflow=0)
 
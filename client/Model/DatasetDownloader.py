@@ -1,18 +1,42 @@
 from psycopg2 import sql
-import csv
+import psycopg2.pool
 import os
-import shutil
+import queue
+import threading
+import functools
+from concurrent.futures import ThreadPoolExecutor
 from Model.QueryManager import QueryManager
+from Model.CopyStream import CopyStream
+from Model.ZipStream import ZipStream
+from Model.CompressedStream import CompressedStream
+from Model.ColumnarStream import ColumnarStream
 
 
 class DatasetDownloader:
-    """Class that reads tables from a schema and puts them into a file"""
-
-    def __init__(self, setid, db_connection):
+    """Class that reads tables from a schema and puts them into a file
+
+    Attributes:
+        db_connection: psycopg2 database connection to execute SQL queries.
+        db_config: DatabaseConfiguration (or TestConnection) whose connection pool is used to export the tables
+                   of a dataset in parallel, the tables are exported one after another if this is None.
+        max_workers: The maximum number of connections used for a parallel export.
+        max_chunks: The maximum number of chunks a worker of a parallel export can produce ahead of the download.
+    """
+
+    class ExportError(Exception):
+        """
+        This exception is raised by the tasks of a parallel export that are skipped because another
+        task failed or because the export was aborted.
+        """
+
+    def __init__(self, setid, db_connection, db_config=None, max_workers=4, max_chunks=8):
         self.db_connection = db_connection
         self.cur = self.db_connection.cursor()
         self.schema = str(setid)
         self.query_man = QueryManager(self.db_connection, None)
+        self.db_config = db_config
+        self.max_workers = max_workers
+        self.max_chunks = max_chunks
 
     def get_csv(self, tablename, foldername, delimiter=',', quotechar='"', null="NULL", original=False):
         """Convert a table from the dataset to a CSV file. The csv file will be stored
@@ -21,146 +45,341 @@ class DatasetDownloader:
         filename = os.path.join(foldername, tablename + ".csv")
 
         with open(filename, 'w', encoding="utf-8") as outfile:
-            outcsv = csv.writer(outfile, delimiter=delimiter, quotechar=quotechar)
-
-            schema = self.__get_schema(original)
-
-            self.cur.execute(
-                "SELECT column_name FROM information_schema.columns WHERE table_schema = '{}' AND table_name = '{}'".format(
-                    schema, tablename))
+            self.cur.copy_expert(self.__get_csv_copy_query(tablename, delimiter, quotechar, null, original), outfile)
 
-            # write header
-            outcsv.writerow([x[0] for x in self.cur.fetchall()])
-
-            self.cur.execute(
-                sql.SQL("SELECT * FROM {}.{}").format(sql.Identifier(schema), sql.Identifier(tablename)))
-            rows = self.cur.fetchall()
-
-            # replace NULL values with parameter 'null'
-            for i in range(len(rows)):
-                rows[i] = list(rows[i])
-                for j in range(len(rows[i])):
-                    if rows[i][j] is None: rows[i][j] = null
+        return tablename + ".csv"
 
-            # write rows
-            outcsv.writerows(rows)
+    def stream_csv(self, tablename, delimiter=',', quotechar='"', null="NULL", original=False, chunk_size=65536, compression=None):
+        """Returns an iterator over the CSV representation of a table in chunks of bytes. The data is streamed
+        straight from postgres, so only a few chunks are kept in memory at any time. If compression is
+        'gzip' or 'zstd' the chunks are compressed on the fly."""
 
-        return tablename + ".csv"
+        query = self.__get_csv_copy_query(tablename, delimiter, quotechar, null, original)
+        return self.__compress(iter(CopyStream(self.db_connection, query, chunk_size)), compression)
 
     def get_csv_zip(self, foldername, delimiter=',', quotechar='"', null="NULL", original=False):
         """Converts all tables in a dataset to csv and puts them in a zip file called (setid).zip
         If original is true, the zip will contain folder 'original' and 'edited'"""
-        # create temporary directory to put csv's in
-        csv_temp_folder = os.path.join(foldername, "temp")
-        os.mkdir(csv_temp_folder)
-
-        if not original:
-            self.__create_csvs(csv_temp_folder, delimiter, quotechar, null, original)
-        else:
-            # create the two subfolders
-            edited_folder = os.path.join(csv_temp_folder, "edited")
-            original_folder = os.path.join(csv_temp_folder, "original")
-            os.mkdir(edited_folder)
-            os.mkdir(original_folder)
-
-            self.__create_csvs(edited_folder, delimiter, quotechar, null, False)
-            self.__create_csvs(original_folder, delimiter, quotechar, null, True)
+        with open(os.path.join(foldername, self.schema + ".zip"), 'wb') as archive:
+            archive.writelines(self.stream_csv_zip(delimiter, quotechar, null, original))
 
-        # make a zip of all csv's
-        shutil.make_archive(os.path.join(foldername + "/" + self.schema), 'zip', csv_temp_folder)
-
-        shutil.rmtree(csv_temp_folder)
         return self.schema + ".zip"
 
-    def get_table_dump(self, tablename, foldername, original=False):
-        """Create a dump file with name (tablename).dump and puts it in 'foldername'"""
-
-        schema = self.__get_schema(original)
+    def stream_csv_zip(self, delimiter=',', quotechar='"', null="NULL", original=False):
+        """Returns an iterator over the zip file created by get_csv_zip in chunks of bytes. Every table is
+        compressed into the zip while it's being read from the database."""
+        schemas = [(False, "")]
+        if original:
+            schemas = [(False, "edited/"), (True, "original/")]
+
+        paths = []
+        groups = []
+        for is_original, folder in schemas:
+            if folder != "":
+                paths.append(folder)
+                groups.append([])
+            for table in self.query_man.get_table_names(self.__get_schema(is_original)):
+                query = self.__get_csv_copy_query(table, delimiter, quotechar, null, is_original)
+                paths.append(folder + table + ".csv")
+                groups.append([functools.partial(self.__get_copy_stream, query)])
+
+        entries = zip(paths, self.__export_groups(groups))
+        return ZipStream().stream((path, self.__encode(pieces)) for path, pieces in entries)
+
+    def get_table_dump(self, tablename, foldername, original=False, use_copy=False):
+        """Create a dump file with name (tablename).dump and puts it in 'foldername'. If use_copy is true,
+        the data is written as 'COPY ... FROM stdin' blocks instead of INSERT statements."""
 
         filename = os.path.join(foldername, tablename + ".dump")
-        with open(filename, 'w') as dumpfile:
-            self.__create_table(dumpfile, schema, tablename)
-            self.__insert_values(dumpfile, schema, tablename)
+        with open(filename, 'wb') as dumpfile:
+            dumpfile.writelines(self.stream_table_dump(tablename, original, use_copy))
 
         return tablename + ".dump"
 
-    def get_dataset_dump(self, foldername, original=False):
-        """Create a dump file with name (setid).dump and puts it in 'foldername'"""
+    def get_dataset_dump(self, foldername, original=False, use_copy=False):
+        """Create a dump file with name (setid).dump and puts it in 'foldername'. If original is true,
+        a zip file (setid).zip is created containing the dump of the original tables as well."""
 
-        # fetch all tablenames
-        table_names = self.query_man.get_table_names(self.schema)
+        if not original:
+            with open(os.path.join(foldername, self.schema + ".dump"), 'wb') as dumpfile:
+                dumpfile.writelines(self.stream_dataset_dump(False, use_copy))
+            return self.schema + ".dump"
 
-        dumpfolder = foldername
-        # only used if original == True
-        og_schema = self.__get_schema(original)
+        with open(os.path.join(foldername, self.schema + ".zip"), 'wb') as archive:
+            archive.writelines(self.stream_dataset_dump_zip(use_copy))
+        return self.schema + ".zip"
 
-        if original:
-            og_table_names = self.query_man.get_table_names(og_schema)
-            dumpfolder = os.path.join(foldername, "temp_folder")
-            os.mkdir(dumpfolder)
+    def stream_table_dump(self, tablename, original=False, use_copy=False, compression=None):
+        """Returns an iterator over the dump of a table in chunks of bytes, compressed on the fly
+        if compression is 'gzip' or 'zstd'."""
 
-        with open(os.path.join(dumpfolder, self.schema + ".dump"), 'w') as dumpfile:
-            for table in table_names:
-                self.__create_table(dumpfile, self.schema, table)
+        schema = self.__get_schema(original)
+        parts = self.__get_dump_parts(schema, [tablename], use_copy)
+        return self.__compress(self.__encode(self.__export_parts(parts, self.db_connection)), compression)
 
-            for table in table_names:
-                self.__insert_values(dumpfile, self.schema, table)
+    def stream_dataset_dump(self, original=False, use_copy=False):
+        """Returns an iterator over the dump of all the tables of the dataset (or of the original
+        tables if original is True) in chunks of bytes."""
 
-        if not original:
-            return self.schema + ".dump"
-        else:
-            with open(os.path.join(dumpfolder, og_schema + ".dump"), 'w') as dumpfile:
-                for table in og_table_names:
-                    self.__create_table(dumpfile, og_schema, table)
+        schema = self.__get_schema(original)
+        parts = self.__get_dump_parts(schema, self.query_man.get_table_names(schema), use_copy)
+        return self.__encode(piece for pieces in self.__export_groups([parts]) for piece in pieces)
+
+    def stream_dataset_dump_zip(self, use_copy=False):
+        """Returns an iterator over a zip file containing the dump of the tables of the dataset,
+        (setid).dump, and the dump of the original tables, original_(setid).dump."""
+        paths = []
+        groups = []
+        for original in [False, True]:
+            schema = self.__get_schema(original)
+            paths.append(schema + ".dump")
+            groups.append(self.__get_dump_parts(schema, self.query_man.get_table_names(schema), use_copy))
 
-                for table in og_table_names:
-                    self.__insert_values(dumpfile, og_schema, table)
+        entries = zip(paths, self.__export_groups(groups))
+        return ZipStream().stream((path, self.__encode(pieces)) for path, pieces in entries)
 
-            # make a zip of the two dump files
-            shutil.make_archive(os.path.join(foldername + "/" + self.schema), 'zip', dumpfolder)
+    def __get_csv_copy_query(self, tablename, delimiter, quotechar, null, original):
+        """Returns the COPY statement that writes a table as CSV (with header) to STDOUT."""
+        schema = self.__get_schema(original)
+        # a query is copied instead of the table itself, because COPY doesn't accept views
+        query = sql.SQL("COPY (SELECT * FROM {}.{}) TO STDOUT WITH (FORMAT csv, HEADER, DELIMITER {}, QUOTE {}, NULL {})")
+        query = query.format(sql.Identifier(schema), sql.Identifier(tablename),
+                             sql.Literal(delimiter), sql.Literal(quotechar), sql.Literal(null))
+        return query.as_string(self.db_connection)
 
-            shutil.rmtree(dumpfolder)
-            return self.schema + ".zip"
+    def stream_columnar(self, tablename, file_format, original=False, batch_size=10000):
+        """Returns an iterator over a Parquet or Arrow IPC file (file_format 'parquet' or 'arrow') containing
+        the table in chunks of bytes. The rows are read in batches of batch_size, which become the row groups."""
 
-    def __create_csvs(self, foldername, delimiter=',', quotechar='"', null="NULL", original=False):
-        """Converts all tables in a dataset to csv and puts them in (foldername)"""
         schema = self.__get_schema(original)
+        col_types = self.query_man.get_col_types(schema, tablename)
+        writer = ColumnarStream(file_format, col_types)
+        return writer.stream(self.__get_row_batches(schema, tablename, list(col_types), batch_size))
+
+    def __export_groups(self, groups):
+        """Generator that returns an iterator over the pieces of every group of parts, in order. A part is either a
+        string or a function that, given a database connection, returns an iterator over the pieces of the data of
+        a table. If a connection pool is available, the function that is being read is streamed directly while the
+        next ones are executed by workers, which share a snapshot of the database so that all tables are consistent
+        with each other. Only one task per worker is executed ahead and it can only produce a few chunks more than
+        have been read, so the amount of data buffered in memory is bounded and nothing is written to disk.
+        If a task fails the whole export fails, its connection has left the snapshot."""
+        tasks = [part for group in groups for part in group if callable(part)]
+        connections = self.__get_worker_connections(min(self.max_workers, len(tasks)))
+        if len(connections) == 0:
+            for group in groups:
+                yield self.__export_parts(group, self.db_connection)
+            return
+
+        executor = None
+        results = dict()
+        failed = threading.Event()
+        try:
+            self.__share_snapshot(connections)
+            # the first connection streams the task that is being read, the other ones execute the next tasks
+            free_connections = queue.Queue()
+            for connection in connections[1:]:
+                free_connections.put(connection)
+            executor = ThreadPoolExecutor(len(connections) - 1)
+            positions = {id(task): i for i, task in enumerate(tasks)}
+
+            def prefetch(task):
+                first = positions[id(task)] + 1
+                for next_task in tasks[first:first + len(connections) - 1]:
+                    if id(next_task) not in results:
+                        chunks = queue.Queue(self.max_chunks)
+                        result = executor.submit(self.__prefetch_task, next_task, chunks, free_connections, failed)
+                        results[id(next_task)] = (result, chunks)
+
+            for group in groups:
+                yield self.__read_results(group, results, prefetch, connections[0])
+        finally:
+            failed.set()
+            if executor is not None:
+                # stop the tasks that are still running if the export was aborted
+                for result, chunks in results.values():
+                    result.cancel()
+                if not all(result.done() for result, chunks in results.values()):
+                    for connection in connections:
+                        connection.cancel()
+                executor.shutdown(wait=True)
+            for connection in connections:
+                connection.rollback()
+                self.db_config.close_connection(connection)
+
+    def __get_worker_connections(self, count):
+        """Take up to count connections from the pool, less if the pool is running out of connections."""
+        connections = []
+        if self.db_config is None or count < 2:
+            return connections
+        for i in range(count):
+            try:
+                connections.append(self.db_config.get_db())
+            except psycopg2.pool.PoolError:
+                break
+        if len(connections) < 2: # not worth it, just use the connection of this downloader
+            for connection in connections:
+                self.db_config.close_connection(connection)
+            connections = []
+        return connections
+
+    def __share_snapshot(self, connections):
+        """Start a repeatable read transaction on the first connection and let the other ones use its snapshot."""
+        cur = connections[0].cursor()
+        cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+        cur.execute("SELECT pg_export_snapshot()")
+        snapshot = cur.fetchone()[0]
+        for connection in connections[1:]:
+            cur = connection.cursor()
+            cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+            cur.execute("SET TRANSACTION SNAPSHOT %s", [snapshot])
+
+    def __prefetch_task(self, task, chunks, free_connections, failed):
+        """Execute a task on a free connection and put its output into the bounded queue chunks, followed by None.
+        The task waits while the queue is full and stops once any task has failed or the export was stopped."""
+        connection = free_connections.get()
+        try:
+            if failed.is_set():
+                raise self.ExportError("The export was stopped.")
+            pieces = task(connection)
+            try:
+                for piece in self.__encode(pieces):
+                    self.__put_chunk(chunks, piece, failed)
+            finally:
+                pieces.close()
+            self.__put_chunk(chunks, None, failed)
+        except:
+            failed.set()
+            raise
+        finally:
+            free_connections.put(connection)
+
+    def __put_chunk(self, chunks, chunk, failed):
+        while True:
+            try:
+                chunks.put(chunk, timeout=0.1)
+                return
+            except queue.Full:
+                if failed.is_set():
+                    raise self.ExportError("The export was stopped.")
+
+    def __read_results(self, group, results, prefetch, db_connection):
+        for part in group:
+            if not callable(part):
+                yield part
+                continue
+            prefetch(part)
+            if id(part) not in results:
+                yield from self.__encode(part(db_connection))
+                continue
+            result, chunks = results.pop(id(part))
+            while True:
+                try:
+                    chunk = chunks.get(timeout=0.1)
+                except queue.Empty:
+                    # raises the error of the task if it failed, otherwise it's still running
+                    if result.done():
+                        result.result()
+                    continue
+                if chunk is None:
+                    break
+                yield chunk
+
+    def __export_parts(self, parts, db_connection):
+        for part in parts:
+            if callable(part):
+                yield from part(db_connection)
+            else:
+                yield part
+
+    def __get_dump_parts(self, schema, table_names, use_copy=False):
+        """Returns the parts of a dump: the CREATE TABLE statements followed by the data of the tables,
+        either as INSERT statements or as COPY blocks."""
+        parts = []
+        columns = dict()
+        for table in table_names:
+            type_dict = self.query_man.get_col_types(schema, table)
+            columns[table] = list(type_dict)
+            parts.append(self.__get_create_table(tablename=table, type_dict=type_dict))
 
-        # fetch all tablenames
-        self.cur.execute("SELECT table_name FROM information_schema.tables WHERE table_schema = %s;",
-                         [schema])
-        result = self.cur.fetchall()
-        table_names = [t[0] for t in result]
-
-        # create all csv's
         for table in table_names:
-            self.get_csv(table, foldername, delimiter, quotechar, null)
+            if use_copy:
+                parts.append(functools.partial(self.__get_copy_block, schema, table, columns[table]))
+            else:
+                parts.append(functools.partial(self.__get_insert_values, schema, table, columns[table]))
+        return parts
 
-    def __create_table(self, dumpfile, schema, tablename):
+    def __get_create_table(self, tablename, type_dict):
         create_table_str = "CREATE TABLE \"{}\" (\n".format(tablename)
-        type_dict = self.query_man.get_col_types(schema, tablename)
         for col in type_dict:
             create_table_str += "\"{}\" {},\n".format(col, type_dict[col])
-        create_table_str = create_table_str[:-2] + "\n);\n\n"
-        dumpfile.write(create_table_str)
-
-    def __insert_values(self, dumpfile, schema, tablename):
-        """write all insert statements for a table"""
-        # fetch data
-        self.cur.execute(sql.SQL("SELECT * FROM {}.{}").format(sql.Identifier(schema), sql.Identifier(tablename)))
-        # insert row statements
-        dumpfile.write("INSERT INTO \"{}\" VALUES\n".format(tablename))
-        rows = str()
-        for row in self.cur:
-            # turn every attribute into a string and escape single quotes the postgres way
-            row_str = tuple([str(x).replace("'", "''") for x in row])
-            # replace double quotes to single quotes for postgres compatibility
-            row_str = str(row_str).replace('"', "'")
-            rows += str(row_str) + ",\n"
-        # replace last comma with a semicolon
-        rows = rows[:-2] + ";\n"
-        dumpfile.write(rows)
-
+        return create_table_str[:-2] + "\n);\n\n"
+
+    def __get_insert_values(self, schema, tablename, columns, db_connection, batch_size=1000):
+        """Generator of the insert statement for all rows of a table, the rows are fetched and
+        returned in batches so the table doesn't have to fit in memory. Empty tables are skipped."""
+        # a server side cursor, otherwise psycopg2 fetches the whole result at once
+        cur = db_connection.cursor(name="dump_cursor")
+        try:
+            cur.execute(self.__get_select_query(schema, tablename, columns))
+            prefix = "INSERT INTO \"{}\" VALUES\n".format(tablename)
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if len(rows) == 0:
+                    break
+                # turn every attribute into a string literal and escape single quotes the postgres way
+                values = ["(" + ", ".join(self.__to_literal(x) for x in row) + ")" for row in rows]
+                yield prefix + ",\n".join(values)
+                prefix = ",\n"
+            if prefix == ",\n":
+                yield ";\n"
+        finally:
+            cur.close()
+
+    def __get_row_batches(self, schema, tablename, columns, batch_size):
+        cur = self.db_connection.cursor(name="columnar_cursor")
+        try:
+            cur.execute(self.__get_select_query(schema, tablename, columns))
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if len(rows) == 0:
+                    break
+                yield rows
+        finally:
+            cur.close()
+
+    def __get_copy_block(self, schema, tablename, columns, db_connection):
+        """Generator of a 'COPY ... FROM stdin' block like the ones written by pg_dump, the rows are
+        streamed in postgres' text format straight from 'COPY ... TO STDOUT'."""
+        column_list = sql.SQL(", ").join(sql.Identifier(col) for col in columns)
+        header = sql.SQL("COPY {} ({}) FROM stdin;\n").format(sql.Identifier(tablename), column_list)
+        yield header.as_string(self.db_connection)
+
+        query = sql.SQL("COPY ({}) TO STDOUT").format(self.__get_select_query(schema, tablename, columns))
+        yield from CopyStream(db_connection, query.as_string(self.db_connection))
+        yield "\\.\n\n"
+
+    def __get_copy_stream(self, query, db_connection):
+        return iter(CopyStream(db_connection, query))
+
+    def __get_select_query(self, schema, tablename, columns):
+        """Select the columns explicitly, so the data has the same order as in the CREATE TABLE statement."""
+        column_list = sql.SQL(", ").join(sql.Identifier(col) for col in columns)
+        return sql.SQL("SELECT {} FROM {}.{}").format(column_list, sql.Identifier(schema), sql.Identifier(tablename))
+
+    def __to_literal(self, value):
+        if value is None:
+            return "NULL"
+        return "'" + str(value).replace("'", "''") + "'"
+
+    def __encode(self, pieces):
+        for piece in pieces:
+            yield piece if isinstance(piece, bytes) else piece.encode("utf-8")
+
+    def __compress(self, chunks, compression):
+        if compression is None:
+            return chunks
+        return CompressedStream(compression).stream(chunks)
 
     def __get_schema(self, original):
         return original * "original_" + self.schema
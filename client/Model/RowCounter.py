@@ -0,0 +1,110 @@
+import time
+import threading
+
+from psycopg2 import sql
+
+
+class RowCounter:
+    """Helper class following the singleton pattern that caches the number of rows of the tables
+    in the database and the number of history entries of the datasets.
+
+    Small tables are counted exactly, for large tables the estimate kept by postgres in pg_class
+    is used so that the table doesn't have to be scanned. Cached counts are kept per (schema, table)
+    and have to be invalidated by every class that writes to a table. Because every process has its
+    own cache, the cached counts also expire after a short amount of time.
+
+    Every invalidation also increases the generation of the table, which other caches of data derived
+    from a table can use to find out whether that data is still up to date.
+    """
+
+    __instance = None
+
+    class __InnerClass:
+
+        def __init__(self, estimate_threshold, time_to_live):
+            self.estimate_threshold = estimate_threshold
+            self.time_to_live = time_to_live
+            self.table_counts = dict()
+            self.history_counts = dict()
+            self.generations = dict()
+            self.lock = threading.Lock()
+
+        def get_rowcount(self, db_connection, schema, tablename):
+            """Method that returns the (estimated) number of rows of a table."""
+            key = (str(schema), tablename)
+            count = self.__get_cached(self.table_counts, key)
+            if count is not None:
+                return count
+
+            cur = db_connection.cursor()
+            query = ('SELECT c.reltuples::bigint FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace'
+                     ' WHERE n.nspname = %s AND c.relname = %s')
+            cur.execute(sql.SQL(query), [str(schema), tablename])
+            row = cur.fetchone()
+            if row is not None and row[0] >= self.estimate_threshold:
+                count = int(row[0])
+            else: # The table is small or hasn't been analyzed yet, so an exact count is cheap enough.
+                cur.execute(sql.SQL('SELECT COUNT(*) FROM {}.{}').format(sql.Identifier(str(schema)),
+                                                                         sql.Identifier(tablename)))
+                count = int(cur.fetchone()[0])
+
+            self.__set_cached(self.table_counts, key, count)
+            return count
+
+        def get_history_count(self, db_connection, setid):
+            """Method that returns the number of entries in the history of a dataset."""
+            key = str(setid)
+            count = self.__get_cached(self.history_counts, key)
+            if count is not None:
+                return count
+
+            cur = db_connection.cursor()
+            query = "SELECT COUNT(*) FROM system.dataset_history WHERE setid = %s"
+            cur.execute(sql.SQL(query), [setid])
+            count = int(cur.fetchone()[0])
+            self.__set_cached(self.history_counts, key, count)
+            return count
+
+        def invalidate(self, schema, tablename=None):
+            """Method that removes the cached count of a table, or of all the tables in the schema if
+            no table is specified."""
+            schema = str(schema)
+            with self.lock:
+                self.generations[(schema, tablename)] = self.generations.get((schema, tablename), 0) + 1
+                if tablename is not None:
+                    self.table_counts.pop((schema, tablename), None)
+                    return
+                for key in [x for x in self.table_counts if x[0] == schema]:
+                    del self.table_counts[key]
+
+        def get_generation(self, schema, tablename):
+            """Method that returns the generation of a table, which changes every time the table is invalidated."""
+            schema = str(schema)
+            with self.lock:
+                return (self.generations.get((schema, None), 0), self.generations.get((schema, tablename), 0))
+
+        def invalidate_history(self, setid):
+            """Method that removes the cached number of history entries of a dataset."""
+            with self.lock:
+                self.history_counts.pop(str(setid), None)
+
+        def __get_cached(self, cache, key):
+            with self.lock:
+                entry = cache.get(key)
+                if entry is None:
+                    return None
+                if time.monotonic() - entry[1] > self.time_to_live:
+                    del cache[key]
+                    return None
+                return entry[0]
+
+        def __set_cached(self, cache, key, count):
+            with self.lock:
+                cache[key] = (count, time.monotonic())
+
+    def __init__(self, estimate_threshold=100000, time_to_live=60):
+        if RowCounter.__instance is None:
+            RowCounter.__instance = self.__InnerClass(estimate_threshold, time_to_live)
+
+    def __getattr__(self, name):
+        return getattr(self.__instance, name)
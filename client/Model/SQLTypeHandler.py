@@ -14,6 +14,8 @@ class SQLTypeHandler:
         def __init__(self):
             self.type_dict = self.initialize_type_dict()
             self.sqla_dict = self.initialize_sqla_dict()
+            #Postgres silently cuts identifiers to 63 bytes
+            self.max_identifier_length = 63
     
         def initialize_type_dict(self):
             type_dict = {
@@ -41,7 +43,14 @@ class SQLTypeHandler:
                 'date'    : sqlalchemy.types.Date(),
                 'double precision' : sqlalchemy.types.Float(precision=25, asdecimal=True),
                 'time without time zone' : sqlalchemy.types.TIME(),
-                'timestamp without time zone' : sqlalchemy.types.DateTime()
+                'timestamp without time zone' : sqlalchemy.types.DateTime(),
+                'timestamp with time zone' : sqlalchemy.types.DateTime(timezone=True),
+                'smallint' : sqlalchemy.types.SMALLINT(),
+                'bigint'   : sqlalchemy.types.BIGINT(),
+                'real'     : sqlalchemy.types.REAL(),
+                'numeric'  : sqlalchemy.types.NUMERIC(),
+                'boolean'  : sqlalchemy.types.BOOLEAN(),
+                'text'     : sqlalchemy.types.TEXT()
                 }
 
             return sqla_dict
@@ -94,6 +103,12 @@ class SQLTypeHandler:
             p_type = self.sqla_dict.get(p_type, None)
             return p_type
 
+        def truncate_identifier(self, name, max_length=None):
+            """Method that cuts a name to the number of bytes postgres keeps of an identifier."""
+            if max_length is None:
+                max_length = self.max_identifier_length
+            return name.encode('utf-8')[:max_length].decode('utf-8', errors='ignore')
+
         def sql_time_to_dict(self, sql_date_string):
             """Given a string of the format "YYYY:MM:DD HH:MM:SS.SSSSSS" this
             returns a dict containing the same data under the keys 'Y', 'M', 'D', 'hr', 'min', 'sec', 'sec_full'.
@@ -1,11 +1,27 @@
 import zipfile
 import os
-import shutil
 import psycopg2
+import psycopg2.pool
+import queue
+from concurrent.futures import ThreadPoolExecutor
 import re
-import pandas as pd
+import io
+import codecs
+import csv
+import itertools
+import datetime
+import math
 from psycopg2 import sql
-from Model.QueryManager import QueryManager
+from Model.RowCounter import RowCounter
+from Model.ColumnarStream import ColumnarStream
+
+try:
+    import pyarrow
+    import pyarrow.csv
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
 
 
 class FileException(Exception):
@@ -37,31 +53,107 @@ class DumpInconsistencyException(FileException):
         super().__init__("Queries in dump/sql file are inconsistent")
 
 
+class ColumnTypeException(FileException):
+    # exception thrown if a column of a parquet/arrow file has a type that can't be stored in postgres
+    def __init__(self):
+        super().__init__("File contains columns of an unsupported type")
+
+
 class EODException(FileException):
     # exception thrown if there were no CREATE TABLE queries
     def __init__(self):
         super().__init__("End of dump reached without create table statements")
 
 
+# the input syntax of postgres for the inferred types, python's own parsers also accept things like '1_000',
+# surrounding whitespace and non-ascii digits
+_integer_pattern = re.compile(r"[+-]?[0-9]+")
+_double_pattern = re.compile(r"[+-]?([0-9]+\.?[0-9]*|\.[0-9]+)([eE][+-]?[0-9]+)?|[+-]?(inf|infinity)|nan", re.IGNORECASE)
+_date_pattern = re.compile(r"[0-9]{4}-[0-9]{2}-[0-9]{2}")
+_timestamp_pattern = re.compile(r"[0-9]{4}-[0-9]{2}-[0-9]{2}[T ][0-9]{2}:[0-9]{2}(:[0-9]{2}(\.[0-9]{1,6})?)?")
+
+
+def _to_integer(value):
+    if _integer_pattern.fullmatch(value) is None:
+        return None
+    return int(value) if -2 ** 31 <= int(value) < 2 ** 31 else None
+
+
+def _to_bigint(value):
+    if _integer_pattern.fullmatch(value) is None:
+        return None
+    return int(value) if -2 ** 63 <= int(value) < 2 ** 63 else None
+
+
+def _to_numeric(value):
+    # integers that are too large for a bigint, numeric keeps all of their digits unlike a double
+    if _integer_pattern.fullmatch(value) is None or len(value.lstrip("+-")) > 131072:
+        return None
+    return value
+
+
+def _to_double(value):
+    if _double_pattern.fullmatch(value) is None:
+        return None
+    # postgres refuses numbers that don't fit in a double, python turns them into infinity
+    return None if math.isinf(float(value)) and "inf" not in value.lower() else value
+
+
+def _to_date(value):
+    if _date_pattern.fullmatch(value) is None:
+        return None
+    return datetime.date.fromisoformat(value).isoformat()
+
+
+def _to_timestamp(value):
+    if _timestamp_pattern.fullmatch(value) is None:
+        return None
+    # older versions of python only accept 3 or 6 digits for the fraction of a second
+    value, dot, fraction = value.partition(".")
+    return datetime.datetime.fromisoformat(value + dot + fraction.ljust(6, "0") * (dot != "")).isoformat(' ')
+
+
 class TableUploader:
     """Class that is responsible for reading files and loading the tables into the postgresql database"""
 
-    def __init__(self, setid, db_connection=None, engine=None):
+    def __init__(self, setid, db_connection=None, engine=None, db_config=None, max_workers=4):
         self.db_conn = db_connection
         self.engine = engine
         self.cur = self.db_conn.cursor()
         self.setid = setid
+        # pool (DatabaseConfiguration or TestConnection) to load the files of a zip in parallel
+        self.db_config = db_config
+        self.max_workers = max_workers
 
-        # predefine attribute
+        # the tables loaded from a zip and the files of it that failed, with their error message
+        self.loaded_tables = []
+        self.failed_files = dict()
+
+        # predefine attributes
         self.header = None
+        self.delimiter = ','
+        self.quotechar = '"'
+        self.encoding = "utf-8"
+        self.progress = None
 
-    def read_file(self, filename, header=True, automatic_type_conversion=False):
+    def read_file(self, filename, header=True, automatic_type_conversion=False, delimiter=',', quotechar='"', encoding="utf-8",
+                  progress=None, opener=None):
         """
         :param header: True if the first line in the csv file contains the column names
-        :param automatic_type_conversion: True if csv file should be read with pandas, so that types are automatically converted.
-        if it's False, it will be read with psycopg2's function copy_from() which is much faster than pandas' read_csv()
+        :param automatic_type_conversion: True if the types of the columns of a csv file should be inferred from a sample of
+        the rows, rows that don't match these types are put in a '<table>_rejected' table. If it's False, all columns are VARCHAR.
+        :param delimiter: The character that separates the fields of csv files
+        :param quotechar: The character used to quote fields of csv files
+        :param encoding: The encoding of csv files, a byte order mark at the start of a utf-8 file is ignored
+        :param progress: Optional UploadProgress that is told how many bytes and rows have been processed
+        :param opener: Optional function that opens a csv file in binary mode, instead of opening filename. This is used
+        for files that are still being uploaded (see StagingFile), other types of files have to be complete.
         """
         self.header = header
+        self.delimiter = delimiter
+        self.quotechar = quotechar
+        self.encoding = encoding
+        self.progress = progress
 
         """
         Each function that reads a file does not commit by itself, this is so that if an error were to occur,
@@ -69,202 +161,719 @@ class TableUploader:
         If the commit is reached at the end of this function, all went well and the tables are committed.
         """
 
-        # check if file is empty
-        if os.stat(filename).st_size == 0:
-            raise EmptyFileException
+        # check if file is empty, a file that is still being uploaded can't be checked yet
+        if opener is None:
+            if os.stat(filename).st_size == 0:
+                raise EmptyFileException
+            opener = lambda: open(filename, 'rb')
 
         if filename.endswith(".csv"):
-            if automatic_type_conversion:
-                self.__csv_pandas(filename)
-            else:
-                self.__csv_psycopg2(filename)
+            tablename = self.__get_csv_table_name(filename)
+            self.__load_csv(opener, tablename, automatic_type_conversion)
 
         elif filename.endswith(".zip"):
-            self.__unzip(filename)
+            self.__unzip(filename, automatic_type_conversion)
 
         elif filename.endswith(".dump") or filename.endswith(".sql"):
             self.__dump(filename)
 
+        elif (filename.endswith(".parquet") or filename.endswith(".arrow")) and ColumnarStream.is_available():
+            self.__columnar(filename)
+
         else:
             raise InvalidFileExtention
 
         # only commit when no errors occurred
         self.db_conn.commit()
+        RowCounter().invalidate(self.setid)
+        RowCounter().invalidate("original_" + str(self.setid))
 
-    def __csv_pandas(self, filename):
-        """Read a csv file using Pandas to take advantage of the automatic type conversion (slow)"""
-        dataframe = pd.read_csv(filename)
-        # convert column to datetime type
-        for column in dataframe.columns:
-            # only convert text to datetime
-            if pd.api.types.is_string_dtype(dataframe[column]):
-                dataframe[column] = pd.to_datetime(dataframe[column], errors="ignore")
-
+    def __get_csv_table_name(self, filename, reserved_names=()):
+        """Returns the name of the table for a csv file, which is not in use and not one of the reserved names."""
         tablename = os.path.basename(filename.replace(".csv", ""))
-        tablename = self.__get_valid_name(tablename)
         # raise error if the table name is not alphanumeric, this is to not cause problems with url's
         if not self.__check_alnum(tablename):
             raise ValueError("Table names should be alphanumeric")
 
-        dataframe.to_sql(tablename, self.engine, index=False, schema=str(self.setid))
-
-        # convert types to the ones used in this application
-        query_man = QueryManager(self.db_conn, None)
-        type_dict = query_man.get_col_types(str(self.setid), tablename)
-        for col in type_dict:
-            if type_dict[col] == "timestamp without time zone":
-                self.__convert_column_type(tablename, col, "date")
-            elif type_dict[col] == "bigint":
-                self.__convert_column_type(tablename, col, "integer")
-            elif type_dict[col] == "text":
-                self.__convert_column_type(tablename, col, "varchar")
-
-        self.__make_backup(tablename)
-
-    def __csv_psycopg2(self, filename):
-        """Read a csv file using psycopg2 if no automatic type conversion is needed (really fast)"""
-        # list of sql.Identifiers for the column names
-        column_names = []
+        # get a name that is not in use
+        return self.__get_valid_name(tablename, reserved_names)
+
+    def __load_csv(self, opener, tablename, automatic_type_conversion, rejected_name=None):
+        """Load a csv file into a new table, opener is a function that opens the file in binary mode.
+        rejected_name is the name of the table for the rows that don't fit the inferred types, if it's None
+        a name is chosen once such a row is found."""
+        if automatic_type_conversion:
+            self.__csv_typed(opener, tablename, rejected_name)
+        else:
+            self.__csv_psycopg2(opener, tablename)
+
+    def __open_text(self, opener, report_progress=False):
+        csv_file = opener()
+        if report_progress:
+            csv_file = io.BufferedReader(self.__ProgressFile(csv_file, lambda size: self.__report(bytes_done=size)))
+        return io.TextIOWrapper(csv_file, encoding=self.__get_text_encoding(), newline='')
+
+    def __report(self, bytes_done=0, rows_done=0):
+        """Tell the progress object of the upload how many bytes and rows were processed."""
+        if self.progress is not None:
+            self.progress.add(bytes_done, rows_done)
+
+    class __ProgressFile(io.RawIOBase):
+        """Binary file-like object that calls on_read with the number of bytes of every read of a file."""
+
+        def __init__(self, raw_file, on_read):
+            super().__init__()
+            self.raw_file = raw_file
+            self.on_read = on_read
+
+        def readable(self):
+            return True
+
+        def readinto(self, buffer):
+            data = self.raw_file.read(len(buffer))
+            buffer[:len(data)] = data
+            self.on_read(len(data))
+            return len(data)
+
+        def close(self):
+            self.raw_file.close()
+            super().close()
+
+    def __csv_typed(self, opener, tablename, rejected_name=None, sample_size=1000, chunk_size=1048576):
+        """Read a csv file with column types that are inferred from the first sample_size rows. The table is
+        created with these types and loaded with COPY, rows that don't fit the types or don't have a field for
+        every column (like blank lines) are put in a separate '<table>_rejected' table with all columns as VARCHAR."""
+        with self.__open_text(opener, True) as csv_file:
+            reader = csv.reader(csv_file, delimiter=self.delimiter, quotechar=self.quotechar)
+            first_row = next(reader, None)
+            if first_row is None:
+                raise EmptyFileException
+
+            if self.header:
+                column_names = [x.strip().replace(" ", "_") for x in first_row]
+                sample = list(itertools.islice(reader, sample_size))
+            else:
+                column_names = ["column_" + str(i) for i in range(len(first_row))]
+                sample = [first_row] + list(itertools.islice(reader, sample_size - 1))
 
-        # read first line for table info
-        with open(filename, encoding="utf-8") as csv:
-            header = csv.readline()
+            col_types = []
+            for i in range(len(column_names)):
+                col_types.append(self.__infer_type([row[i] for row in sample if len(row) == len(column_names)]))
+            self.__create_table(tablename, column_names, col_types)
+
+            rejected_created = False
+            accepted = io.StringIO()
+            rejected = io.StringIO()
+            # empty fields are written as None, which the csv writer leaves unquoted so COPY reads them as NULL
+            accepted_writer = csv.writer(accepted)
+            rejected_writer = csv.writer(rejected)
+            for row_number, row in enumerate(itertools.chain(sample, reader), 1):
+                values = None
+                if len(row) == len(column_names):
+                    values = self.__convert_row(row, col_types)
+                if values is not None:
+                    accepted_writer.writerow(values)
+                else:
+                    rejected_writer.writerow([row_number] + [x if x != "" else None for x in self.__fit_row(row, len(column_names))])
+                    if not rejected_created:
+                        if rejected_name is None:
+                            rejected_name = self.__get_valid_name(tablename + "_rejected")
+                        rejected_created = True
+                        self.__create_table(rejected_name, ["row_number"] + column_names,
+                                            ["integer"] + ["varchar"] * len(column_names))
+
+                if accepted.tell() >= chunk_size:
+                    self.__copy_csv_buffer(tablename, accepted)
+                if rejected.tell() >= chunk_size:
+                    self.__copy_csv_buffer(rejected_name, rejected)
+
+        self.__copy_csv_buffer(tablename, accepted)
+        if rejected_created:
+            self.__copy_csv_buffer(rejected_name, rejected)
+
+    # converters from a csv field to the value that is loaded, in the order in which the types are tried
+    __converters = {
+        "integer": lambda value: _to_integer(value),
+        "bigint": lambda value: _to_bigint(value),
+        "numeric": lambda value: _to_numeric(value),
+        "double precision": lambda value: _to_double(value),
+        "date": lambda value: _to_date(value),
+        "timestamp": lambda value: _to_timestamp(value),
+        "varchar": str
+    }
+
+    def __convert_value(self, value, converter):
+        """Convert a non empty csv field with a converter, None if it isn't a valid value of the type."""
+        try:
+            return converter(value)
+        except (ValueError, OverflowError):
+            return None
+
+    def __infer_type(self, values):
+        """Return the first type of which all non empty values are valid values, varchar if there are none."""
+        values = [x for x in values if x != ""]
+        if len(values) == 0:
+            return "varchar"
+        for col_type, converter in self.__converters.items():
+            if all(self.__convert_value(x, converter) is not None for x in values):
+                return col_type
+
+    def __fit_row(self, row, length):
+        """Give a rejected row with the wrong number of fields the number of columns of the table, missing fields
+        are empty and the fields that don't have a column are joined with the delimiter into the last one."""
+        if len(row) <= length:
+            return row + [""] * (length - len(row))
+        return row[:length - 1] + [self.delimiter.join(row[length - 1:])]
+
+    def __convert_row(self, row, col_types):
+        """Convert the fields of a csv row to the values that are loaded, None if a field doesn't fit its type."""
+        values = []
+        for value, col_type in zip(row, col_types):
+            if value == "":
+                values.append(None)
+                continue
+            converted = self.__convert_value(value, self.__converters[col_type])
+            if converted is None:
+                return None
+            values.append(converted)
+        return values
+
+    def __create_table(self, tablename, column_names, col_types):
+        """Create a table and its original, which is filled with the same data while the file is loaded."""
+        columns = [sql.SQL("{} {}").format(sql.Identifier(name), sql.SQL(col_type))
+                   for name, col_type in zip(column_names, col_types)]
+        self.cur.execute(sql.SQL("CREATE TABLE {}.{} ({})").format(sql.Identifier(str(self.setid)),
+                                                                  sql.Identifier(tablename),
+                                                                  sql.SQL(", ").join(columns)))
+        self.__create_original(tablename)
+
+    def __create_original(self, tablename):
+        """Create the original of an uploaded table as an empty table with the same columns. It's a real table,
+        so that it doesn't change along with the uploaded table."""
+        self.cur.execute("CREATE SCHEMA IF NOT EXISTS original_{}".format(self.setid))
+        query_args = [sql.Identifier("original_" + str(self.setid)), sql.Identifier(tablename), sql.Identifier(str(self.setid))]
+        self.cur.execute(sql.SQL("CREATE TABLE {0}.{1} (LIKE {2}.{1})").format(*query_args))
+
+    def __copy_piece(self, tablename, data, options=sql.SQL(""), columns=None, original=True):
+        """Load a piece of a file (bytes or a string) into a table with COPY and into its original as well, so the
+        file is read only once and the original doesn't have to be copied from the table afterwards. Returns the
+        number of rows of the piece."""
+        schemas = [str(self.setid)] + ["original_" + str(self.setid)] * original
+        row_count = None
+        for schema in schemas:
+            query = sql.SQL("COPY {}.{}").format(sql.Identifier(schema), sql.Identifier(tablename))
+            if columns is not None:
+                query += sql.SQL(" ({})").format(sql.SQL(", ").join(sql.Identifier(x) for x in columns))
+            query += sql.SQL(" FROM STDIN") + options
+            piece = io.BytesIO(data) if isinstance(data, bytes) else io.StringIO(data)
+            self.cur.copy_expert(query.as_string(self.db_conn), piece)
+            if row_count is None:
+                row_count = self.cur.rowcount
+        return row_count
+
+    def __copy_csv_buffer(self, tablename, buffer):
+        """Load the rows written to a buffer into a table and its original with COPY and empty the buffer."""
+        if buffer.tell() == 0:
+            return
+        try:
+            row_count = self.__copy_piece(tablename, buffer.getvalue(), sql.SQL(" WITH (FORMAT csv)"))
+        except psycopg2.DataError:
+            raise ColumnInconsistencyException
+        self.__report(rows_done=row_count)
+        buffer.seek(0)
+        buffer.truncate()
+
+    def __csv_psycopg2(self, opener, tablename, chunk_size=1048576):
+        """Read a csv file with COPY if no automatic type conversion is needed (really fast), postgres parses
+        the quoted fields and skips the header, the file is sent in chunks of chunk_size bytes."""
+        # read the first record for table info, it can span multiple lines if it contains quoted newlines
+        with self.__open_text(opener) as csv_file:
+            first_row = next(csv.reader(csv_file, delimiter=self.delimiter, quotechar=self.quotechar), None)
+        if first_row is None:
+            raise EmptyFileException
 
         # if the first line in the file contains the column names
         if self.header:
-            column_names = [x.strip() for x in header.split(',')]
             # replace spaces with underscores
-            for i in range(len(column_names)):
-                # make all column names sql.Identifiers while we're at it
-                column_names[i] = sql.Identifier(column_names[i].replace(" ", "_"))
+            column_names = [x.strip().replace(" ", "_") for x in first_row]
         else:
-            for i in range(header.count(',') + 1):
-                column_names.append(sql.Identifier("column_" + str(i)))
-
-        # extract table name
-        tablename = os.path.basename(filename.replace(".csv", ""))
-
+            column_names = ["column_" + str(i) for i in range(len(first_row))]
+
+        self.__create_table(tablename, column_names, ["varchar"] * len(column_names))
+
+        # the file is sent as bytes, postgres decodes it with the given encoding
+        csv_file = opener()
+        if self.__get_text_encoding() == "utf-8-sig" and csv_file.read(3) != codecs.BOM_UTF8:
+            # no byte order mark, start over
+            csv_file.close()
+            csv_file = opener()
+        with csv_file:
+            # only the first piece contains the header
+            header = self.header
+            progress_file = self.__ProgressFile(csv_file, lambda size: self.__report(bytes_done=size))
+            for piece in self.__read_records(progress_file, chunk_size):
+                options = sql.SQL(" WITH (FORMAT csv, HEADER {}, DELIMITER {}, QUOTE {}, ENCODING {})").format(
+                    sql.SQL("true" if header else "false"), sql.Literal(self.delimiter), sql.Literal(self.quotechar),
+                    sql.Literal(self.encoding))
+                header = False
+                try:
+                    self.__report(rows_done=self.__copy_piece(tablename, piece, options))
+                except psycopg2.DataError:
+                    raise ColumnInconsistencyException
+
+    def __read_records(self, csv_file, chunk_size):
+        """Generator of the pieces of a csv file in binary mode that end at the end of a record, so that every piece
+        can be loaded with a separate COPY. The file is read in chunks of chunk_size bytes, a record that doesn't end
+        in a chunk is moved to the next piece.
+        A newline ends a record if it follows an even number of quote characters, since a quote character
+        inside a quoted field is written twice. The encodings postgres accepts all write newlines and quote
+        characters as single bytes that don't occur inside other characters."""
+        quote = self.quotechar.encode(self.encoding)
+        rest = b""
+        while True:
+            data = csv_file.read(chunk_size)
+            if len(data) == 0:
+                break
+            data = rest + data
+            # look for the last newline that isn't inside a quoted field, the data starts at the start of a record
+            end = data.rfind(b"\n")
+            quotes_before = data.count(quote, 0, max(end, 0))
+            while end >= 0 and quotes_before % 2 == 1:
+                previous = data.rfind(b"\n", 0, end)
+                quotes_before -= data.count(quote, max(previous, 0), end)
+                end = previous
+            if end < 0:
+                rest = data
+                continue
+            rest = data[end + 1:]
+            yield data[:end + 1]
+
+        if len(rest) > 0:
+            yield rest
+
+    def __get_text_encoding(self):
+        """Returns the python encoding to read csv files with, which strips the byte order mark of utf-8 files."""
+        if self.encoding.lower().replace("-", "").replace("_", "") == "utf8":
+            return "utf-8-sig"
+        return self.encoding
+
+    def __columnar(self, filename):
+        """Read a parquet or arrow IPC file one row group (or record batch) at a time and load it with COPY,
+        the column types are taken from the schema of the file."""
+        if filename.endswith(".parquet"):
+            parquet_file = pyarrow.parquet.ParquetFile(filename)
+            schema = parquet_file.schema_arrow
+            batches = (parquet_file.read_row_group(i) for i in range(parquet_file.num_row_groups))
+        else:
+            try:
+                reader = pyarrow.ipc.open_file(filename)
+                batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+            except pyarrow.ArrowInvalid:
+                # not the random access format, but the streaming format
+                reader = pyarrow.ipc.open_stream(filename)
+                batches = iter(reader)
+            schema = reader.schema
+
+        col_types = [ColumnarStream.to_postgres_type(field.type) for field in schema]
+        if None in col_types:
+            raise ColumnTypeException
+
+        # dictionary encoded columns are decoded before they are written as csv
+        plain_schema = pyarrow.schema([(field.name, field.type.value_type if pyarrow.types.is_dictionary(field.type)
+                                        else field.type) for field in schema])
+
+        tablename = os.path.basename(filename).rsplit(".", 1)[0]
         # raise error if the table name is not alphanumeric, this is to not cause problems with url's
         if not self.__check_alnum(tablename):
             raise ValueError("Table names should be alphanumeric")
-
-        # get a name that is not in use
         tablename = self.__get_valid_name(tablename)
 
-        # Create table query
-        query = sql.SQL("CREATE TABLE {} (").format(sql.Identifier(tablename))
-        query += sql.SQL(" VARCHAR, ").join(column_names)
-        query += sql.SQL(" VARCHAR);")
+        self.__create_table(tablename, [field.name for field in schema], col_types)
 
-        # insert everything into the database
-        self.cur.execute("SET search_path TO {};".format(self.setid))
-        self.cur.execute(query)
-        with open(filename, 'r', encoding="utf-8") as csv:
+        # pyarrow writes nulls as unquoted empty fields and quotes all strings, which is how COPY tells them apart
+        options = pyarrow.csv.WriteOptions(include_header=False)
+        for batch in batches:
+            if isinstance(batch, pyarrow.RecordBatch):
+                batch = pyarrow.Table.from_batches([batch])
+            buffer = io.BytesIO()
+            pyarrow.csv.write_csv(batch.cast(plain_schema), buffer, options)
             try:
-                # tablename has to be wrapped in quotes for this function to work
-                self.cur.copy_from(csv, "\"" + tablename + "\"", sep=',')
+                self.__copy_piece(tablename, buffer.getvalue(), sql.SQL(" WITH (FORMAT csv)"))
             except psycopg2.DataError:
                 raise ColumnInconsistencyException
+            self.__report(rows_done=batch.num_rows)
 
-        # if the first line in the csv contained the names of the columns, that row has to be deleted from the table
-        if self.header:
-            self.cur.execute(sql.SQL("DELETE FROM {} WHERE ctid IN (SELECT ctid FROM {} LIMIT 1);").format(
-                sql.Identifier(tablename), sql.Identifier(tablename)))
-
-        # make backup
-        self.__make_backup(tablename)
-
-    def __dump(self, filename):
-        """Read a dump file and execute all create tables and insert values"""
+    def __dump(self, filename, batch_size=1000):
+        """Read a dump file and execute all create tables and insert values. The data of a table can also be
+        given as a 'COPY ... FROM stdin' block (like pg_dump writes them), which is loaded with COPY directly.
+        The file is read one statement at a time and consecutive inserts are sent to postgres in batches."""
         # keep track of tables created for backups
         table_names = []
+        # consecutive insert statements that haven't been executed yet
+        inserts = []
+        # the data of COPY blocks is loaded into the originals right away, insert statements can't be executed
+        # on the originals without knowing their table, so once there is one the originals are copied at the end
+        has_inserts = False
 
+        self.cur.execute("SET search_path TO {};".format(self.setid))
         with open(filename, 'r', encoding="utf-8") as dump:
-            for command in dump.read().strip().split(';'):
-                # execute create table statement
-                if re.search("CREATE TABLE.*\(.*\)", command, re.DOTALL | re.IGNORECASE):
-                    # extract tablename
-                    tablename = command.split()[2]
-                    # remove bracket in tablename if there is no whitespace in between
-                    tablename = tablename.split("(", 1)[0]
-                    # remove quotes
-                    tablename = tablename.replace('"', '')
-
-                    # raise error if the table name is not alphanumeric, this is to not cause problems with url's
-                    if not self.__check_alnum(tablename):
-                        raise ValueError("Table names should be alphanumeric")
-
-                    self.cur.execute("SET search_path TO {};".format(self.setid))
-                    try:
-                        self.cur.execute(command.replace("\n", ""))
-                    except psycopg2.ProgrammingError:
-                        raise DumpInconsistencyException
-
-                    table_names.append(tablename)
-
-                # execute insert
-                elif re.search("INSERT INTO.*", command, re.DOTALL | re.IGNORECASE):
-                    self.cur.execute("SET search_path TO {};".format(self.setid))
-                    try:
-                        self.cur.execute(command.replace("\n", ""))
-                    except psycopg2.ProgrammingError:
-                        raise
-                        raise DumpInconsistencyException
+            reader = self.__StatementReader(dump, on_read=lambda size: self.__report(bytes_done=size))
+            while True:
+                statement = reader.next_statement()
+                if statement is None:
+                    break
+                statement = self.__strip_comments(statement)
+                if statement == "":
+                    continue
+                keyword = statement.split(None, 1)[0].upper()
+
+                if keyword == "INSERT":
+                    has_inserts = True
+                    inserts.append(statement)
+                    if len(inserts) >= batch_size:
+                        self.__execute_dump_statements(inserts)
+                        inserts = []
+                    continue
+
+                self.__execute_dump_statements(inserts)
+                inserts = []
+                if keyword == "CREATE":
+                    self.__dump_create_table(statement, table_names)
+                elif keyword == "COPY" and self.__copy_header.match(statement + ";"):
+                    # the data starts on the line after the statement
+                    reader.readline()
+                    self.__copy_block(statement + ";", reader, table_names, not has_inserts)
+
+            self.__execute_dump_statements(inserts)
 
         # if no tables were created, raise error
         if len(table_names) == 0:
             raise EODException
-        else:
+        elif has_inserts:
             for tablename in table_names:
-                self.__make_backup(tablename)
-
-    def __unzip(self, filename):
-        """Unzip a zip with csv's and load them into the database"""
-        # unzip the file
-        zip = zipfile.ZipFile(filename, 'r')
-        # each dataset gets an unzip folder, so that no data can overlap
-        unzip_folder = ".unzip_temp_" + str(self.setid)
-        unzip_folder_complete = os.path.dirname(os.path.abspath(__file__)) + "/" + unzip_folder
-        zip.extractall(unzip_folder_complete)
-        zip.close()
-
-        # load all files that were extracted
-        directory = os.fsencode(unzip_folder_complete)
-        for sub_file in os.listdir(directory):
-            sub_filename = unzip_folder_complete + "/" + os.fsdecode(sub_file)
-            # files other than csv's are ignored
-            if sub_filename.endswith(".csv"):
-                try:
-                    self.__csv_psycopg2(sub_filename)
-                except psycopg2.ProgrammingError:
-                    self.db_conn.rollback()
+                self.__fill_original(tablename)
+
+    def __strip_comments(self, statement):
+        """Remove the whitespace and comments in front of a statement."""
+        while True:
+            statement = statement.lstrip()
+            if statement.startswith("--"):
+                end = statement.find("\n")
+                statement = "" if end < 0 else statement[end + 1:]
+            elif statement.startswith("/*"):
+                end = statement.find("*/")
+                statement = "" if end < 0 else statement[end + 2:]
+            else:
+                return statement
 
-        # delete the temporary folder
-        shutil.rmtree(unzip_folder_complete)
+    def __dump_create_table(self, command, table_names):
+        """Execute a create table command from a dump file"""
+        if not re.match("CREATE TABLE.*\(.*\)", command, re.DOTALL | re.IGNORECASE):
+            return
 
-    def __make_backup(self, tablename):
-        """Make a backup copy for the table"""
-        self.cur.execute("CREATE SCHEMA IF NOT EXISTS original_{}".format(self.setid))
-        self.cur.execute("SET search_path TO original_{};".format(self.setid))
+        # extract tablename
+        tablename = command.split()[2]
+        # remove bracket in tablename if there is no whitespace in between
+        tablename = tablename.split("(", 1)[0]
+        # remove quotes
+        tablename = tablename.replace('"', '')
+
+        # raise error if the table name is not alphanumeric, this is to not cause problems with url's
+        if not self.__check_alnum(tablename):
+            raise ValueError("Table names should be alphanumeric")
 
-        # copy table into the backup schema
-        self.cur.execute(sql.SQL("SELECT * INTO {} FROM {}.{}").format(sql.Identifier(tablename),
-                                                                                    sql.Identifier(str(self.setid)),
-                                                                                    sql.Identifier(tablename)))
+        self.__execute_dump_statements([command])
+        self.__create_original(tablename)
+        table_names.append(tablename)
+
+    def __execute_dump_statements(self, statements):
+        """Execute statements of a dump file in a single round trip"""
+        if len(statements) == 0:
+            return
+        try:
+            self.cur.execute(";\n".join(statements))
+        except psycopg2.ProgrammingError:
+            raise DumpInconsistencyException
+
+    class __StatementReader:
+        """Reads the statements of a SQL file one at a time, the file is read in chunks of chunk_size characters.
+        Semicolons in string literals, quoted identifiers, dollar quoted strings and comments don't end a statement."""
+
+        __special = re.compile(r"[;'\"]|--|/\*|(?<![A-Za-z0-9_])\$[A-Za-z_]?[A-Za-z_0-9]*\$")
+        __string_end = re.compile(r"[^']*(?:''[^']*)*'")
+        __escape_string_end = re.compile(r"[^'\\]*(?:(?:\\.|'')[^'\\]*)*'", re.DOTALL)
+        __identifier_end = re.compile(r'[^"]*(?:""[^"]*)*"')
+
+        def __init__(self, dump, chunk_size=1048576, on_read=None):
+            self.dump = dump
+            self.chunk_size = chunk_size
+            # called with the number of characters of every chunk that is read
+            self.on_read = on_read
+            self.buffer = ""
+            # the position in the buffer where the next statement starts
+            self.start = 0
+            self.eof = False
+
+        def next_statement(self):
+            """Returns the next statement without its semicolon, or None at the end of the file."""
+            pos = self.start
+            while True:
+                match = self.__special.search(self.buffer, pos)
+                if match is None:
+                    # a token can be split over two chunks, so the end of the buffer is searched again
+                    pos = max(pos, len(self.buffer) - 64)
+                    shift = self.__fill()
+                    if shift is None:
+                        return self.__take(len(self.buffer), len(self.buffer))
+                    pos -= shift
+                    continue
+
+                if match.group() == ";":
+                    return self.__take(match.start(), match.end())
+
+                end = self.__skip(match)
+                if end is None:
+                    # unterminated literal or comment at the end of the file
+                    return self.__take(len(self.buffer), len(self.buffer))
+                pos = end
+
+        def readline(self):
+            """Returns the next line of the file, '' at the end of the file."""
+            while self.buffer.find("\n", self.start) < 0 and self.__fill() is not None:
+                pass
+            end = self.buffer.find("\n", self.start)
+            end = len(self.buffer) if end < 0 else end + 1
+            line = self.buffer[self.start:end]
+            self.start = end
+            return line
+
+        def __take(self, end, next_start):
+            statement = self.buffer[self.start:end]
+            self.start = next_start
+            if self.eof and next_start == len(self.buffer) and statement.strip() == "":
+                return None
+            return statement
+
+        def __skip(self, match):
+            """Returns the position after the literal or comment that starts with the match, None if it doesn't end."""
+            token = match.group()
+            pos = match.end()
+            pattern = None
+            if token == "'":
+                # E'...' strings can contain backslash escapes
+                prefix = self.buffer[max(match.start() - 2, 0):match.start()]
+                escaped = re.fullmatch(r"(^|.*[^A-Za-z0-9_])[eE]", prefix, re.DOTALL) is not None
+                pattern = self.__escape_string_end if escaped else self.__string_end
+            elif token == '"':
+                pattern = self.__identifier_end
+            else:
+                terminator = {"--": "\n", "/*": "*/"}.get(token, token)
+
+            while True:
+                if pattern is not None:
+                    end_match = pattern.match(self.buffer, pos)
+                    # a quote at the end of the buffer could be the first half of an escaped quote
+                    if end_match is not None and (end_match.end() < len(self.buffer) or self.eof):
+                        return end_match.end()
+                else:
+                    end = self.buffer.find(terminator, pos)
+                    if end >= 0:
+                        return end + len(terminator)
+                    pos = max(pos, len(self.buffer) - len(terminator) + 1)
+
+                shift = self.__fill()
+                if shift is None:
+                    return len(self.buffer) if token == "--" else None
+                pos -= shift
+
+        def __fill(self):
+            """Read the next chunk into the buffer and drop what was already read, returns how much the positions
+            in the buffer shifted or None at the end of the file."""
+            chunk = self.dump.read(self.chunk_size)
+            if chunk == "":
+                self.eof = True
+                return None
+            if self.on_read is not None:
+                self.on_read(len(chunk))
+            shift = self.start
+            self.buffer = self.buffer[self.start:] + chunk
+            self.start = 0
+            return shift
+
+    __copy_header = re.compile(r'^\s*COPY\s+("(?:[^"]|"")+"|[^\s(]+)\s*(?:\((.*)\))?\s+FROM\s+stdin\s*;\s*$', re.IGNORECASE)
+
+    def __copy_block(self, header, dump, table_names, original=True, chunk_size=1048576):
+        """Load the data of a 'COPY ... FROM stdin' block of a dump file into a table created by the dump,
+        and into its original if original is True."""
+        match = self.__copy_header.match(header)
+        tablename = match.group(1)
+        if tablename.startswith('"'):
+            tablename = tablename[1:-1].replace('""', '"')
+
+        # data can only be copied into the tables of this dump
+        if tablename not in table_names:
+            raise DumpInconsistencyException
+
+        columns = None
+        if match.group(2) is not None:
+            columns = [x.strip().strip('"') for x in match.group(2).split(",")]
+
+        # the block is loaded a number of lines at a time, every line is a row
+        block = self.__CopyBlockReader(dump)
+        try:
+            while True:
+                piece = block.read(chunk_size)
+                if piece == "":
+                    break
+                self.__report(rows_done=self.__copy_piece(tablename, piece, columns=columns, original=original))
+        except (psycopg2.DataError, psycopg2.ProgrammingError):
+            raise DumpInconsistencyException
+
+    class __CopyBlockReader:
+        """File-like object that reads the data lines of a copy block, up to the line containing only '\\.'"""
+
+        def __init__(self, dump):
+            self.dump = dump
+            self.finished = False
+
+        def read(self, size=-1):
+            lines = []
+            length = 0
+            while not self.finished and (size < 0 or length < size):
+                line = self.dump.readline()
+                if line == "":
+                    # end of the file without end of data marker
+                    raise DumpInconsistencyException
+                if line.rstrip("\r\n") == "\\.":
+                    self.finished = True
+                    break
+                lines.append(line)
+                length += len(line)
+            return "".join(lines)
+
+    def __unzip(self, filename, automatic_type_conversion):
+        """Load the csv files of a zip into the database, the files are read straight from the archive. Every file
+        is loaded in its own transaction, in parallel on connections of the pool if there is one. A file that
+        can't be loaded doesn't stop the others, the errors are kept in failed_files."""
+        with zipfile.ZipFile(filename, 'r') as archive:
+            # files other than csv's are ignored
+            members = [name for name in archive.namelist() if name.endswith(".csv")]
+            # the progress is measured in uncompressed bytes
+            if self.progress is not None:
+                self.progress.set_total(sum(archive.getinfo(name).file_size for name in members))
+
+        # the table names are chosen up front, so that files with the same name get different tables,
+        # this includes the names of the tables for the rows that don't fit the inferred types
+        jobs = []
+        reserved_names = []
+        for member in members:
+            try:
+                tablename = self.__get_csv_table_name(member, reserved_names)
+                reserved_names.append(tablename)
+                rejected_name = None
+                if automatic_type_conversion:
+                    rejected_name = self.__get_valid_name(tablename + "_rejected", reserved_names)
+                    reserved_names.append(rejected_name)
+                jobs.append((member, tablename, rejected_name))
+            except ValueError as e:
+                self.failed_files[member] = str(e)
+
+        connections = self.__get_worker_connections(min(self.max_workers, len(jobs)))
+        if len(connections) == 0:
+            for member, tablename, rejected_name in jobs:
+                self.cur.execute("SAVEPOINT zip_member")
+                try:
+                    with zipfile.ZipFile(filename, 'r') as archive:
+                        self.__load_csv(lambda: archive.open(member), tablename, automatic_type_conversion, rejected_name)
+                    self.cur.execute("RELEASE SAVEPOINT zip_member")
+                    self.loaded_tables.append(tablename)
+                except (FileException, ValueError, psycopg2.Error) as e:
+                    self.cur.execute("ROLLBACK TO SAVEPOINT zip_member")
+                    self.failed_files[member] = str(e)
+        else:
+            try:
+                # the backup schema is created first, so the workers don't try to create it at the same time
+                cur = connections[0].cursor()
+                cur.execute("CREATE SCHEMA IF NOT EXISTS original_{}".format(self.setid))
+                connections[0].commit()
+
+                free_connections = queue.Queue()
+                for connection in connections:
+                    free_connections.put(connection)
+                with ThreadPoolExecutor(len(connections)) as executor:
+                    results = [executor.submit(self.__load_member, filename, member, tablename, rejected_name,
+                                               automatic_type_conversion, free_connections)
+                               for member, tablename, rejected_name in jobs]
+                    for (member, tablename, _), result in zip(jobs, results):
+                        error = result.result()
+                        if error is None:
+                            self.loaded_tables.append(tablename)
+                        else:
+                            self.failed_files[member] = error
+            finally:
+                for connection in connections:
+                    self.db_config.close_connection(connection)
+
+        if len(self.loaded_tables) == 0 and len(self.failed_files) > 0:
+            raise FileException("None of the files in the zip could be loaded")
+
+    def __load_member(self, filename, member, tablename, rejected_name, automatic_type_conversion, free_connections):
+        """Load a csv file of a zip on a free connection of the pool and commit it, returns the error message
+        if it failed."""
+        connection = free_connections.get()
+        uploader = TableUploader(self.setid, connection)
+        uploader.header = self.header
+        uploader.delimiter = self.delimiter
+        uploader.quotechar = self.quotechar
+        uploader.encoding = self.encoding
+        uploader.progress = self.progress
+        try:
+            # every worker reads from its own handle of the archive
+            with zipfile.ZipFile(filename, 'r') as archive:
+                uploader.__load_csv(lambda: archive.open(member), tablename, automatic_type_conversion, rejected_name)
+            connection.commit()
+            return None
+        except (FileException, ValueError, psycopg2.Error) as e:
+            connection.rollback()
+            return str(e)
+        finally:
+            free_connections.put(connection)
+
+    def __get_worker_connections(self, count):
+        """Take up to count connections from the pool, less if the pool is running out of connections."""
+        connections = []
+        if self.db_config is None or count < 2:
+            return connections
+        for i in range(count):
+            try:
+                connections.append(self.db_config.get_db())
+            except psycopg2.pool.PoolError:
+                break
+        if len(connections) < 2: # not worth it, just use the connection of this uploader
+            for connection in connections:
+                self.db_config.close_connection(connection)
+            connections = []
+        return connections
+
+    def __fill_original(self, tablename):
+        """Replace the contents of the original of a table by the rows of the table."""
+        query_args = [sql.Identifier("original_" + str(self.setid)), sql.Identifier(tablename), sql.Identifier(str(self.setid))]
+        self.cur.execute(sql.SQL("TRUNCATE {0}.{1}").format(*query_args))
+        self.cur.execute(sql.SQL("INSERT INTO {0}.{1} SELECT * FROM {2}.{1}").format(*query_args))
 
     def __check_alnum(self, tablename):
         """Check if the table name is alphanumeric (underscores are also allowed)"""
         temp_name = tablename.replace('_', 'a')
         return temp_name.isalnum()
 
-    def __get_valid_name(self, tablename):
+    def __get_valid_name(self, tablename, reserved_names=()):
         """Generate a valid tablename if the tablename is already in use"""
         # create a new tablename if the current one is already in use
 
         self.cur.execute("SELECT table_name FROM information_schema.tables WHERE table_schema = %s;",
                                       [str(self.setid)])
         result = self.cur.fetchall()
-        table_names = [t[0] for t in result]
+        table_names = [t[0] for t in result] + list(reserved_names)
         new_name = tablename
 
         # if there is at least one table in the dataset
@@ -286,10 +895,3 @@ class TableUploader:
                     new_name = tablename + '_' + str(name_count)
 
         return new_name
-
-    def __convert_column_type(self, tablename, col, type):
-        """Alter the type of the specified column"""
-        self.cur.execute(sql.SQL("ALTER TABLE {}.{} ALTER COLUMN {} TYPE {}").format(sql.Identifier(str(self.setid)),
-                                                                                     sql.Identifier(tablename),
-                                                                                     sql.Identifier(col),
-                                                                                     sql.SQL(type)))
\ No newline at end of file
@@ -0,0 +1,315 @@
+import io
+import os
+import shutil
+import threading
+import time
+
+import psycopg2
+import psycopg2.extras
+import psycopg2.pool
+
+from Model.TableUploader import TableUploader, FileException
+from Model.ChunkedUploadManager import ChunkedUploadManager, StagingFile
+
+
+class UploadProgress:
+    """Class that keeps track of the progress of an upload job and writes it to system.upload_jobs. The methods
+    can be called from multiple threads, the progress is written at most once every interval seconds. Every write
+    also updates the heartbeat of the job. The progress is only informative, so errors writing it are ignored.
+
+    Attributes:
+        db_connection: psycopg2 database connection that is only used for the progress, so that the
+                       progress is visible while the upload itself hasn't been committed yet.
+        job_id: The id of the job.
+        interval: The minimum number of seconds between two writes.
+    """
+
+    def __init__(self, db_connection, job_id, interval=0.5):
+        self.db_connection = db_connection
+        self.job_id = job_id
+        self.interval = interval
+        self.bytes_total = None
+        self.bytes_done = 0
+        self.rows_done = 0
+        self.last_write = 0
+        self.lock = threading.Lock()
+
+    def set_total(self, bytes_total):
+        """Method that sets the number of bytes that have to be processed."""
+        with self.lock:
+            self.bytes_total = bytes_total
+            self.__write(True)
+
+    def add(self, bytes_done=0, rows_done=0):
+        """Method that adds to the number of bytes and rows that have been processed."""
+        with self.lock:
+            self.bytes_done += bytes_done
+            self.rows_done += rows_done
+            self.__write(False)
+
+    def flush(self):
+        """Method that writes the progress, regardless of when it was written last."""
+        with self.lock:
+            self.__write(True)
+
+    def __write(self, force):
+        if not force and time.monotonic() - self.last_write < self.interval:
+            return
+        try:
+            cur = self.db_connection.cursor()
+            cur.execute("UPDATE system.upload_jobs SET bytes_total = %s, bytes_done = %s, rows_done = %s, heartbeat = now()"
+                        " WHERE job_id = %s", [self.bytes_total, self.bytes_done, self.rows_done, self.job_id])
+            self.db_connection.commit()
+        except psycopg2.Error:
+            self.db_connection.rollback()
+        self.last_write = time.monotonic()
+
+
+class UploadJobQueue:
+    """Helper class following the singleton pattern that loads uploaded files in the background.
+
+    Jobs are stored in system.upload_jobs, so that the web request can return as soon as the file is saved and
+    the progress can be polled. The jobs are executed by worker threads, which claim queued jobs with
+    'FOR UPDATE SKIP LOCKED' so that the workers of multiple processes never execute the same job.
+
+    A job can also load a file that is uploaded in chunks (see ChunkedUploadManager). A csv file is loaded while
+    its chunks are arriving, other files have to be complete, so their job waits in the 'receiving' status until
+    release is called. Chunked uploads that don't receive data for upload_timeout seconds are given up. Loading a
+    file that is still arriving takes as long as the upload itself, so these jobs are only claimed by their own
+    stream_worker_count workers and can't keep the other uploads waiting. Once the upload is complete, any
+    worker can claim the job.
+
+    A running job writes a heartbeat every poll_interval seconds, a job of which the heartbeat is older than
+    heartbeat_timeout seconds belongs to a process that died, so it's marked as failed. The workers check out
+    database connections for every job, so that they don't hold on to connections of the pool while idle.
+    """
+
+    __instance = None
+
+    class __InnerClass:
+
+        def __init__(self, db_config, worker_count, stream_worker_count, poll_interval, upload_timeout, heartbeat_timeout):
+            self.db_config = db_config
+            self.worker_count = worker_count
+            self.stream_worker_count = stream_worker_count
+            self.poll_interval = poll_interval
+            self.upload_timeout = upload_timeout
+            self.heartbeat_timeout = heartbeat_timeout
+            self.workers = []
+            self.wakeup = threading.Event()
+            self.lock = threading.Lock()
+
+        def start(self):
+            """Method that starts the worker threads if they aren't running yet."""
+            with self.lock:
+                if len(self.workers) > 0:
+                    return
+                for streaming in [False] * self.worker_count + [True] * self.stream_worker_count:
+                    worker = threading.Thread(target=self.__work, args=(streaming,), daemon=True)
+                    worker.start()
+                    self.workers.append(worker)
+
+        def enqueue(self, db_connection, setid, userid, filename, header=True, automatic_types=False,
+                    delimiter=',', quotechar='"', encoding="utf-8", upload_id=None, bytes_total=None):
+            """Method that adds a job to load a file into a dataset and returns its id. The folder of the
+            file is removed when the job is finished. The job is committed, so that workers can see it.
+            If upload_id is given, the file is the staging file of that chunked upload and bytes_total its size."""
+            # the workers don't necessarily share the working directory of the web server
+            filename = os.path.abspath(filename)
+            if bytes_total is None:
+                bytes_total = os.path.getsize(filename)
+            # only csv files can be loaded before they are complete
+            status = 'receiving' if upload_id is not None and not filename.endswith(".csv") else 'queued'
+
+            cur = db_connection.cursor()
+            cur.execute("INSERT INTO system.upload_jobs(setid, userid, filename, header, automatic_types, delimiter,"
+                        " quotechar, encoding, bytes_total, upload_id, status)"
+                        " VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s) RETURNING job_id",
+                        [setid, userid, filename, header, automatic_types, delimiter, quotechar, encoding,
+                         bytes_total, upload_id, status])
+            job_id = cur.fetchone()[0]
+            db_connection.commit()
+
+            self.start()
+            self.wakeup.set()
+            return job_id
+
+        def release(self, db_connection, upload_id):
+            """Method that queues the job waiting for a chunked upload that is complete. Releasing
+            a job more than once has no effect."""
+            cur = db_connection.cursor()
+            cur.execute("UPDATE system.upload_jobs SET status = 'queued' WHERE upload_id = %s AND status = 'receiving'",
+                        [upload_id])
+            db_connection.commit()
+            self.wakeup.set()
+
+        def get_job(self, db_connection, job_id):
+            """Method that returns the job with the specified id as a dict, or None if it doesn't exist."""
+            cur = db_connection.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+            cur.execute("SELECT * FROM system.upload_jobs WHERE job_id = %s", [job_id])
+            return cur.fetchone()
+
+        def get_jobs(self, db_connection, setid, max_age=3600):
+            """Method that returns the jobs of a dataset that are unfinished or that finished less than
+            max_age seconds ago as a list of dicts, oldest first."""
+            cur = db_connection.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+            cur.execute("SELECT * FROM system.upload_jobs WHERE setid = %s AND"
+                        " (finished IS NULL OR finished > now() - %s * INTERVAL '1 second') ORDER BY job_id",
+                        [setid, max_age])
+            return cur.fetchall()
+
+        def __work(self, streaming):
+            while True:
+                try:
+                    found = self.__work_once(streaming)
+                except Exception:
+                    # the worker keeps running whatever goes wrong, a job that couldn't be finished
+                    # is given up once its heartbeat stops
+                    found = False
+
+                if not found:
+                    # jobs of other processes are only noticed when polling
+                    self.wakeup.wait(self.poll_interval)
+                    self.wakeup.clear()
+
+        def __work_once(self, streaming):
+            """Claim a queued job and execute it, the connections are taken from the pool for this job only.
+            Returns False if there was no queued job."""
+            db_connection = self.db_config.get_db()
+            try:
+                job = self.__claim(db_connection, streaming)
+                if job is None:
+                    self.__expire(db_connection)
+                    return False
+
+                # the connection for the progress is only needed once there is a job
+                try:
+                    progress_connection = self.db_config.get_db()
+                except psycopg2.pool.PoolError:
+                    # the pool ran out of connections, the job is left to the next poll
+                    self.__unclaim(db_connection, job)
+                    raise
+                try:
+                    self.__run(job, db_connection, progress_connection)
+                    return True
+                finally:
+                    self.db_config.close_connection(progress_connection)
+            finally:
+                self.db_config.close_connection(db_connection)
+
+        def __claim(self, db_connection, streaming):
+            """Mark the oldest queued job as running and return it, None if there is no queued job. If streaming
+            is True only the jobs of which the file is still arriving are claimed, otherwise only the other ones."""
+            cur = db_connection.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+            cur.execute("UPDATE system.upload_jobs SET status = 'running', started = now(), heartbeat = now() WHERE job_id ="
+                        " (SELECT job_id FROM system.upload_jobs AS j WHERE status = 'queued' AND %s = EXISTS"
+                        "  (SELECT 1 FROM system.chunked_uploads AS u WHERE u.upload_id = j.upload_id AND u.status = 'receiving')"
+                        "  ORDER BY job_id FOR UPDATE OF j SKIP LOCKED LIMIT 1) RETURNING *", [streaming])
+            job = cur.fetchone()
+            db_connection.commit()
+            return job
+
+        def __unclaim(self, db_connection, job):
+            """Put a claimed job that couldn't be started back in the queue."""
+            cur = db_connection.cursor()
+            cur.execute("UPDATE system.upload_jobs SET status = 'queued', started = NULL, heartbeat = NULL"
+                        " WHERE job_id = %s AND status = 'running'", [job['job_id']])
+            db_connection.commit()
+
+        def __expire(self, db_connection):
+            """Give up the jobs of chunked uploads that haven't received data for upload_timeout seconds,
+            and the running jobs of which the heartbeat is older than heartbeat_timeout seconds."""
+            cur = db_connection.cursor()
+            # in case the upload was completed but the request didn't get to release its job
+            cur.execute("UPDATE system.upload_jobs SET status = 'queued' WHERE status = 'receiving' AND upload_id IN"
+                        " (SELECT upload_id FROM system.chunked_uploads WHERE status = 'complete')")
+            cur.execute("UPDATE system.chunked_uploads SET status = 'cancelled', updated = now()"
+                        " WHERE status = 'receiving' AND updated < now() - %s * INTERVAL '1 second' AND upload_id IN"
+                        " (SELECT upload_id FROM system.upload_jobs WHERE status = 'receiving') RETURNING upload_id, filename",
+                        [self.upload_timeout])
+            expired = cur.fetchall()
+            for upload_id, filename in expired:
+                cur.execute("UPDATE system.upload_jobs SET status = 'failed', message = %s, finished = now()"
+                            " WHERE upload_id = %s", ["The upload was not completed.", upload_id])
+
+            # running jobs of which the process died, the transaction loading the file died with it
+            cur.execute("UPDATE system.upload_jobs SET status = 'failed', message = %s, finished = now()"
+                        " WHERE status = 'running' AND heartbeat < now() - %s * INTERVAL '1 second'"
+                        " RETURNING upload_id, filename", ["The upload was interrupted.", self.heartbeat_timeout])
+            stale = cur.fetchall()
+            for upload_id, filename in stale:
+                if upload_id is not None:
+                    cur.execute("UPDATE system.chunked_uploads SET status = 'cancelled', updated = now()"
+                                " WHERE upload_id = %s AND status = 'receiving'", [upload_id])
+            db_connection.commit()
+
+            for upload_id, filename in expired + stale:
+                shutil.rmtree(os.path.dirname(filename), ignore_errors=True)
+
+        def __run(self, job, db_connection, progress_connection):
+            """Execute a job and record whether it succeeded."""
+            progress = UploadProgress(progress_connection, job['job_id'])
+            status = 'done'
+            message = None
+
+            opener = None
+            if job['upload_id'] is not None:
+                # the csv file is read while its chunks are still arriving
+                uploads = ChunkedUploadManager(progress_connection)
+                opener = lambda: io.BufferedReader(StagingFile(job['filename'], lambda: uploads.get_status(job['upload_id']),
+                                                               timeout=self.upload_timeout))
+
+            stopped = threading.Event()
+            heartbeat = threading.Thread(target=self.__beat, args=(progress, stopped), daemon=True)
+            heartbeat.start()
+            try:
+                progress.set_total(job['bytes_total'])
+                uploader = TableUploader(job['setid'], db_connection=db_connection,
+                                         engine=self.db_config.get_engine(), db_config=self.db_config)
+                uploader.read_file(job['filename'], header=job['header'], automatic_type_conversion=job['automatic_types'],
+                                   delimiter=job['delimiter'], quotechar=job['quotechar'], encoding=job['encoding'],
+                                   progress=progress, opener=opener)
+
+                # files of a zip that couldn't be loaded
+                if len(uploader.failed_files) > 0:
+                    message = "; ".join("Could not load '" + member + "': " + error
+                                        for member, error in uploader.failed_files.items())
+            except (FileException, ValueError) as e:
+                db_connection.rollback()
+                status = 'failed'
+                message = str(e)
+            except Exception as e:
+                db_connection.rollback()
+                status = 'failed'
+                message = "Internal error: " + str(e)
+            finally:
+                stopped.set()
+                heartbeat.join()
+                try:
+                    if job['upload_id'] is not None:
+                        # chunks that are still arriving are refused, the staging file is removed below
+                        ChunkedUploadManager(progress_connection).cancel(job['upload_id'])
+                except psycopg2.Error:
+                    progress_connection.rollback()
+                shutil.rmtree(os.path.dirname(job['filename']), ignore_errors=True)
+
+            progress.flush()
+            # if the job was given up in the meantime, it stays that way
+            cur = progress_connection.cursor()
+            cur.execute("UPDATE system.upload_jobs SET status = %s, message = %s, finished = now()"
+                        " WHERE job_id = %s AND status = 'running'", [status, message, job['job_id']])
+            progress_connection.commit()
+
+        def __beat(self, progress, stopped):
+            """Write the progress of a running job every poll_interval seconds, this is its heartbeat."""
+            while not stopped.wait(self.poll_interval):
+                progress.flush()
+
+    def __init__(self, db_config=None, worker_count=2, stream_worker_count=2, poll_interval=2, upload_timeout=3600,
+                 heartbeat_timeout=60):
+        if UploadJobQueue.__instance is None:
+            UploadJobQueue.__instance = self.__InnerClass(db_config, worker_count, stream_worker_count, poll_interval,
+                                                          upload_timeout, heartbeat_timeout)
+
+    def __getattr__(self, name):
+        return getattr(self.__instance, name)
@@ -0,0 +1,144 @@
+from psycopg2 import sql
+
+from Model.SQLTypeHandler import SQLTypeHandler
+
+
+class ViewMaterializer:
+    """Class that manages tables that are stored lazily as views over another table.
+
+    A lazy copy of a table is a view 'SELECT * FROM source', so creating it doesn't copy any data.
+    Copies of lazy copies result in a chain of views, which is cut off by creating a real table
+    once the chain gets deeper than max_depth. Before a table is written to, prepare_for_write has
+    to be called: it materializes the views that depend on the table (so that they keep showing the
+    old data) and the table itself if it's a view. None of the methods commit, this is left to the caller.
+
+    Attributes:
+        db_connection: psycopg2 database connection to execute SQL queries.
+        max_depth: The maximum length of a chain of views before a copy is materialized.
+    """
+
+    def __init__(self, db_connection, max_depth=5):
+        self.db_connection = db_connection
+        self.max_depth = max_depth
+
+    def is_view(self, schema, tablename):
+        """Method that returns whether a table of a schema is stored as a view."""
+        cur = self.db_connection.cursor()
+        query = ('SELECT c.relkind FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace'
+                 ' WHERE n.nspname = %s AND c.relname = %s')
+        cur.execute(query, [str(schema), tablename])
+        row = cur.fetchone()
+        return row is not None and row[0] == 'v'
+
+    def get_depth(self, schema, tablename):
+        """Method that returns the number of views between a table and the real table holding its data."""
+        cur = self.db_connection.cursor()
+        query = ("WITH RECURSIVE chain(oid, depth) AS ("
+                 " SELECT c.oid, 0 FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace"
+                 " WHERE n.nspname = %s AND c.relname = %s AND c.relkind = 'v'"
+                 " UNION"
+                 " SELECT d.refobjid, chain.depth + 1 FROM chain"
+                 " JOIN pg_rewrite r ON r.ev_class = chain.oid"
+                 " JOIN pg_depend d ON d.classid = 'pg_rewrite'::regclass AND d.objid = r.oid"
+                 " JOIN pg_class c ON c.oid = d.refobjid AND c.relkind = 'v'"
+                 " WHERE d.refobjid <> chain.oid AND chain.depth < %s)"
+                 " SELECT COALESCE(MAX(depth) + 1, 0) FROM chain")
+        cur.execute(query, [str(schema), tablename, self.max_depth])
+        return int(cur.fetchone()[0])
+
+    def get_dependent_views(self, schema, tablename):
+        """Method that returns all the views that (indirectly) select from a table as a list of
+        (schema, name, definition) tuples, the views closest to the table come first."""
+        cur = self.db_connection.cursor()
+        query = ("WITH RECURSIVE dependent(oid, depth) AS ("
+                 " SELECT c.oid, 0 FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace"
+                 " WHERE n.nspname = %s AND c.relname = %s"
+                 " UNION"
+                 " SELECT r.ev_class, dependent.depth + 1 FROM dependent"
+                 " JOIN pg_depend d ON d.refobjid = dependent.oid AND d.classid = 'pg_rewrite'::regclass"
+                 " JOIN pg_rewrite r ON r.oid = d.objid"
+                 " JOIN pg_class c ON c.oid = r.ev_class AND c.relkind = 'v'"
+                 " WHERE r.ev_class <> dependent.oid)"
+                 " SELECT n.nspname, c.relname, pg_get_viewdef(c.oid) FROM dependent"
+                 " JOIN pg_class c ON c.oid = dependent.oid JOIN pg_namespace n ON n.oid = c.relnamespace"
+                 " WHERE dependent.depth > 0 GROUP BY n.nspname, c.relname, c.oid ORDER BY MAX(dependent.depth)")
+        cur.execute(query, [str(schema), tablename])
+        return cur.fetchall()
+
+    def create_lazy_copy(self, schema1, tablename1, schema2, tablename2):
+        """Method that creates tablename2 as a view over tablename1, unless the chain of views would
+        become too deep in which case a real copy is made. Returns whether the copy is lazy."""
+        cur = self.db_connection.cursor()
+        query_args = [sql.Identifier(str(schema2)), sql.Identifier(tablename2),
+                      sql.Identifier(str(schema1)), sql.Identifier(tablename1)]
+        if self.get_depth(schema1, tablename1) + 1 > self.max_depth:
+            cur.execute(sql.SQL('CREATE TABLE {}.{} AS SELECT * FROM {}.{}').format(*query_args))
+            return False
+
+        cur.execute(sql.SQL('CREATE VIEW {}.{} AS SELECT * FROM {}.{}').format(*query_args))
+        return True
+
+    def materialize(self, schema, tablename):
+        """Method that replaces a view by a table containing its data. Views that select from
+        the view are recreated on top of the new table. Returns False if it wasn't a view."""
+        if self.is_view(schema, tablename) is False:
+            return False
+
+        dependents = self.get_dependent_views(schema, tablename)
+        cur = self.db_connection.cursor()
+        temp_name = self.__get_unused_name(schema, '_materialize_' + tablename)
+        query_args = [sql.Identifier(str(schema)), sql.Identifier(temp_name), sql.Identifier(tablename)]
+        cur.execute(sql.SQL('CREATE TABLE {0}.{1} AS SELECT * FROM {0}.{2}').format(*query_args))
+        cur.execute(sql.SQL('DROP VIEW {0}.{2} CASCADE').format(*query_args))
+        cur.execute(sql.SQL('ALTER TABLE {0}.{1} RENAME TO {2}').format(*query_args))
+        for view_schema, view_name, definition in dependents:
+            view_args = [sql.Identifier(view_schema), sql.Identifier(view_name), sql.SQL(definition)]
+            cur.execute(sql.SQL('CREATE VIEW {}.{} AS {}').format(*view_args))
+
+        return True
+
+    def prepare_for_write(self, schema, tablename):
+        """Method that makes sure a table can be modified without changing the contents of other tables.
+        The views that directly select from the table are materialized, followed by the table itself."""
+        self.__materialize_dependents(schema, tablename)
+        return self.materialize(schema, tablename)
+
+    def drop(self, schema, tablename, if_exists=False):
+        """Method that drops a table or view without dropping the views that select from it."""
+        if if_exists is True and self.__exists(schema, tablename) is False:
+            return
+
+        self.__materialize_dependents(schema, tablename)
+        cur = self.db_connection.cursor()
+        query = 'DROP VIEW {}.{}' if self.is_view(schema, tablename) else 'DROP TABLE {}.{}'
+        cur.execute(sql.SQL(query).format(sql.Identifier(str(schema)), sql.Identifier(tablename)))
+
+    def __materialize_dependents(self, schema, tablename):
+        cur = self.db_connection.cursor()
+        query = ("SELECT DISTINCT vn.nspname, v.relname FROM pg_class c"
+                 " JOIN pg_namespace n ON n.oid = c.relnamespace"
+                 " JOIN pg_depend d ON d.refobjid = c.oid AND d.classid = 'pg_rewrite'::regclass"
+                 " JOIN pg_rewrite r ON r.oid = d.objid"
+                 " JOIN pg_class v ON v.oid = r.ev_class AND v.relkind = 'v' AND v.oid <> c.oid"
+                 " JOIN pg_namespace vn ON vn.oid = v.relnamespace"
+                 " WHERE n.nspname = %s AND c.relname = %s")
+        cur.execute(query, [str(schema), tablename])
+        for view_schema, view_name in cur.fetchall():
+            self.materialize(view_schema, view_name)
+
+    def __get_unused_name(self, schema, name):
+        type_handler = SQLTypeHandler()
+        unused_name = type_handler.truncate_identifier(name)
+        number = 1
+        while self.__exists(schema, unused_name):
+            suffix = "_" + str(number)
+            unused_name = type_handler.truncate_identifier(name, type_handler.max_identifier_length - len(suffix)) + suffix
+            number += 1
+        return unused_name
+
+    def __exists(self, schema, tablename):
+        cur = self.db_connection.cursor()
+        query = ('SELECT 1 FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace'
+                 ' WHERE n.nspname = %s AND c.relname = %s')
+        cur.execute(query, [str(schema), tablename])
+        return cur.fetchone() is not None
@@ -0,0 +1,47 @@
+import zipfile
+
+
+class ZipStream:
+    """Class that writes a zip archive as an iterator of byte chunks, the archive is built while it's being
+    consumed so it never has to be stored in memory or on disk as a whole.
+
+    Attributes:
+        chunk_size: The minimum size in bytes of the chunks, except for the last one.
+        compression: The zipfile compression method of the entries.
+    """
+
+    def __init__(self, chunk_size=65536, compression=zipfile.ZIP_DEFLATED):
+        self.chunk_size = chunk_size
+        self.compression = compression
+        self.buffer = bytearray()
+
+    def write(self, data):
+        """Method called by zipfile with every piece of the archive."""
+        self.buffer += data
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def stream(self, entries):
+        """Generator of the archive containing the entries. An entry is a tuple of the path inside
+        the archive and an iterable of the byte chunks of the file, a path ending in '/' is a folder."""
+        with zipfile.ZipFile(self, 'w', self.compression) as archive:
+            for path, chunks in entries:
+                if path.endswith('/'):
+                    archive.writestr(zipfile.ZipInfo(path), b'')
+                    continue
+
+                # the size isn't known in advance, so zip64 is needed in case the file is larger than 2 GiB
+                with archive.open(path, 'w', force_zip64=True) as entry:
+                    for chunk in chunks:
+                        entry.write(chunk)
+                        if len(self.buffer) >= self.chunk_size:
+                            yield self.__drain()
+
+        yield self.__drain()
+
+    def __drain(self):
+        data = bytes(self.buffer)
+        self.buffer = bytearray()
+        return data
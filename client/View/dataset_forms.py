@@ -2,8 +2,9 @@ from flask_wtf import FlaskForm
 from flask_wtf.file import FileField as FWFileField, FileRequired as FWFileRequired
 from wtforms import StringField, PasswordField, TextAreaField, SelectField, HiddenField, FileField, BooleanField, IntegerField
 from wtforms.widgets import HiddenInput, TextArea
-from wtforms.validators import Length, InputRequired, Email, EqualTo, Regexp
+from wtforms.validators import Length, InputRequired, Email, EqualTo, Regexp, NumberRange
 from View.form_utils import EnumCheck, FilenameCheck
+from Model.CompressedStream import CompressedStream
 
 class DatasetForm(FlaskForm):
     """Form that queries the user for the metadata of a dataset."""
@@ -47,9 +48,23 @@ class LeaveForm(FlaskForm):
 
 class TableUploadForm(FlaskForm):
     """Form to upload tables."""
-    data_file = FWFileField('File', [FWFileRequired("No file selected."), FilenameCheck("Invalid filename. Only alphanumeric characters and underscore allowed. Only csv, zip, sql and dump files allowed.", "[A-Za-z0-9][A-Za-z0-9_]+\\.(sql|csv|zip|dump)")])
+    data_file = FWFileField('File', [FWFileRequired("No file selected."), FilenameCheck("Invalid filename. Only alphanumeric characters and underscore allowed. Only csv, zip, sql, dump, parquet and arrow files allowed.", "[A-Za-z0-9][A-Za-z0-9_]+\\.(sql|csv|zip|dump|parquet|arrow)")])
     columnnames_included = BooleanField('Column names included in files?', default = True)
     automatic_types = BooleanField('Automatic type detection', default=False)
+    delimiter = StringField('Delimiter', [InputRequired('Delimiter is required.'), Length(min=1, max=1)], default=",")
+    quotechar = StringField('Quote character', [InputRequired('Quote character is required.'), Length(min=1, max=1)], default='"')
+    encoding = SelectField('Encoding', choices = [('utf-8', 'UTF-8'), ('latin-1', 'Latin-1'), ('windows-1252', 'Windows-1252')], default = 'utf-8')
+# ENDCLASS
+
+class ChunkedUploadForm(FlaskForm):
+    """Form to start an upload of a table file that is sent in chunks."""
+    filename = StringField('Filename', [InputRequired("No file selected."), Regexp("^[A-Za-z0-9][A-Za-z0-9_]+\\.(sql|csv|zip|dump|parquet|arrow)$", message="Invalid filename. Only alphanumeric characters and underscore allowed. Only csv, zip, sql, dump, parquet and arrow files allowed.")])
+    size = IntegerField('Size', [InputRequired("The size of the file is required."), NumberRange(min=1, message="Given file is empty")])
+    columnnames_included = BooleanField('Column names included in files?', default = True)
+    automatic_types = BooleanField('Automatic type detection', default=False)
+    delimiter = StringField('Delimiter', [InputRequired('Delimiter is required.'), Length(min=1, max=1)], default=",")
+    quotechar = StringField('Quote character', [InputRequired('Quote character is required.'), Length(min=1, max=1)], default='"')
+    encoding = SelectField('Encoding', choices = [('utf-8', 'UTF-8'), ('latin-1', 'Latin-1'), ('windows-1252', 'Windows-1252')], default = 'utf-8')
 # ENDCLASS
 
 class ChangeAttributeForm(FlaskForm):
@@ -70,6 +85,7 @@ class DownloadDatasetSQLForm(FlaskForm):
     """Form to download dataset as SQL."""
 
     original_check = BooleanField('Include original tables', default = False)
+    copy_check = BooleanField('Use COPY statements (faster)', default = False)
 # ENDCLASS
 
 class DownloadTableCSVForm(FlaskForm):
@@ -78,10 +94,17 @@ class DownloadTableCSVForm(FlaskForm):
     quotechar = StringField('Qoute character', [InputRequired('Qoute character is required.'), Length(min=1, max=1)], default='"')
     nullrep = StringField('NULL representation', [InputRequired('NULL representation is required.'), Length(min=1, max=10)], default="NULL")
     original_check = BooleanField('Include original tables', default = False)
+    compression = SelectField('Compression', choices = [('none', 'None')] + [(method, method) for method in CompressedStream.get_methods()], default = 'none')
 # ENDCLASS
 
 class DownloadTableSQLForm(FlaskForm):
     """Form to download table as SQL."""
+    copy_check = BooleanField('Use COPY statements (faster)', default = False)
+    compression = SelectField('Compression', choices = [('none', 'None')] + [(method, method) for method in CompressedStream.get_methods()], default = 'none')
+# ENDCLASS
+
+class DownloadTableColumnarForm(FlaskForm):
+    """Form to download table as Parquet or Arrow."""
     pass
 # ENDCLASS
 
@@ -1,4 +1,4 @@
-from flask import Blueprint, render_template, request, url_for, redirect, session, flash, abort, send_from_directory, jsonify
+from flask import Blueprint, render_template, request, url_for, redirect, session, flash, abort, jsonify, stream_with_context
 from flask import current_app as app
 
 from Controller.AccessController import require_login, require_admin
@@ -8,11 +8,15 @@ from Controller.UserManager import UserManager
 from Controller.DatasetPermissionsManager import DatasetPermissionsManager
 from Controller.TableViewer import TableViewer
 
-from Model.TableUploader import FileException as DLFileExcept
+from Model.SQLTypeHandler import SQLTypeHandler
+from Model.CompressedStream import CompressedStream
+from Model.ColumnarStream import ColumnarStream
+from Model.ChunkedUploadManager import ChunkedUploadManager
 from Controller.TableJoiner import JoinException
 
 from View.dataset_forms import DatasetForm, AddUserForm, RemoveUserForm, LeaveForm, TableUploadForm, TableJoinForm, AttributeForm, HistoryForm, AddUserForm, RemoveUserForm
 from View.dataset_forms import DownloadDatasetCSVForm, DownloadDatasetSQLForm, DownloadTableCSVForm, DownloadTableSQLForm, CustomQueryForm, CopyTableForm, ChangeAttributeForm
+from View.dataset_forms import DownloadTableColumnarForm, ChunkedUploadForm
 from View.transf_forms import FindReplaceForm, DataTypeTransform, NormalizeZScore, OneHotEncoding, RegexFindReplace, DiscretizeEqualWidth, ExtractDateTimeForm
 from View.transf_forms import DiscretizeEqualFreq, DiscretizeCustomRange, DeleteOutlier, FillNullsMean, FillNullsMedian, FillNullsCustomValue, DedupForm
 from View.transf_forms import PredicateFormOne, PredicateFormTwo, PredicateFormThree
@@ -20,8 +24,8 @@ from View.form_utils import flash_errors
 
 from werkzeug.utils import secure_filename
 import os
-import shutil
 import json
+import tempfile
 
 dataset_pages = Blueprint('dataset_pages', __name__)
 
@@ -180,8 +184,9 @@ def table(dataset_id, tablename):
                                                 predicateone_form     = predicateone_form,
                                                 predicatetwo_form     = predicatetwo_form,
                                                 predicatethree_form   = predicatethree_form,
-                                                download_csv_form     = DownloadDatasetCSVForm(),
+                                                download_csv_form     = DownloadTableCSVForm(),
                                                 download_sql_form     = DownloadTableSQLForm(),
+                                                download_columnar_form = DownloadTableColumnarForm() if ColumnarStream.is_available() else None,
                                                 original              = False,
                                                 row_count             = row_count,
                                                 attribute_list        = attribute_list,
@@ -189,7 +194,8 @@ def table(dataset_id, tablename):
                                                 copyform              = CopyTableForm(),
                                                 dedup_form            = dedup_form,
                                                 change_attr_form      = change_attr_form,
-                                                can_undo              = can_undo)
+                                                can_undo              = can_undo,
+                                                is_lazy_copy          = dataset.isLazyCopy(tablename))
 # ENDFUNCTION
 
 @dataset_pages.route('/dataset/<int:dataset_id>/original_table/<string:tablename>')
@@ -228,8 +234,9 @@ def table_original(dataset_id, tablename):
                                                 dataset_info      = dataset_info,
                                                 original          = True,
                                                 row_count         = row_count,
-                                                download_csv_form = DownloadDatasetCSVForm(),
+                                                download_csv_form = DownloadTableCSVForm(),
                                                 download_sql_form = DownloadTableSQLForm(),
+                                                download_columnar_form = DownloadTableColumnarForm() if ColumnarStream.is_available() else None,
                                                 attribute_list    = attribute_list)
 # ENDFUNCTION
 
@@ -659,6 +666,27 @@ def copy_table(dataset_id, tablename):
     return redirect(url_for('dataset_pages.table', dataset_id=dataset_id, tablename=newname))
 # ENDFUNCTION
 
+@dataset_pages.route('/dataset/<int:dataset_id>/table/<string:tablename>/materialize', methods=['POST'])
+@require_login
+@require_writeperm
+def materialize_table(dataset_id, tablename):
+    """Callback to store a lazily copied table as a real table."""
+
+    if not DatasetManager.existsID(dataset_id):
+        abort(404)
+
+    dataset = DatasetManager.getDataset(dataset_id)
+
+    if not tablename in dataset.getTableNames():
+        abort(404)
+
+    tt = dataset.getTableTransformer(tablename)
+    tt.materialize_table(tablename)
+
+    flash(message="Table has been materialized.", category="success")
+    return redirect(url_for('dataset_pages.table', dataset_id=dataset_id, tablename=tablename))
+# ENDFUNCTION
+
 
 @dataset_pages.route('/dataset/<int:dataset_id>/upload', methods=['POST'])
 @require_login
@@ -678,59 +706,134 @@ def upload(dataset_id):
         file = form.data_file.data
         columnnames_included = form.columnnames_included.data
         automatic_types      = form.automatic_types.data
+        delimiter            = str(form.delimiter.data)
+        quotechar            = str(form.quotechar.data)
+        encoding             = form.encoding.data
 
         if file:
             sec_filename = secure_filename(file.filename)
 
-            real_upload_folder = None
-
-            # create upload folder
-            # format: <UPLOAD_FOLDER>/<USER_ID>_<X>/<FILENAME>.<EXT>
-            for i in range(100):
-                temp_dir = os.path.join(app.config['UPLOAD_FOLDER'], str(session['userdata']['userid']) + "_" + str(i))
-
-                if not os.path.exists(temp_dir):
-                    os.makedirs(temp_dir)
-                    real_upload_folder = temp_dir
-                    break
-
-            if real_upload_folder is None:
-                abort(500)
+            real_upload_folder = __make_upload_folder()
 
             # SAVE FILE
             real_filename = os.path.join(real_upload_folder, sec_filename)
             file.save(real_filename)
 
-            # HANDLE FILE WITH DATALOADER
-            tu = dataset.getUploader()
-            
-            try:
-                tu.read_file(filename=real_filename, header=columnnames_included, automatic_type_conversion=automatic_types)
-            except DLFileExcept as e: # DLFileExcept = FileException
-                flash(message=str(e), category="error")
-                # TODO print error message
-                # delete file + folder
-                shutil.rmtree(real_upload_folder, ignore_errors=True)
-                return redirect(url_for('dataset_pages.home', dataset_id=dataset_id))
-            # ENDTRY
+            # HANDLE FILE WITH DATALOADER, IN THE BACKGROUND
+            # the job deletes the file + folder when it's done
+            dataset.queueUpload(filename=real_filename, userid=session['userdata']['userid'], header=columnnames_included,
+                                automatic_types=automatic_types, delimiter=delimiter, quotechar=quotechar, encoding=encoding)
 
-            # delete file + folder
-            shutil.rmtree(real_upload_folder, ignore_errors=True)
-
-            flash(message="Tables added.", category="success")
+            flash(message="File uploaded, the tables will be added in the background.", category="success")
 
     elif len(form.errors) > 0:
         # print errors
-        for error_msg in form.errors['data_file']:
-            flash(message=error_msg, category="error")
+        flash_errors(form)
 
     return redirect(url_for('dataset_pages.home', dataset_id=dataset_id))
 # ENDFUNCTION
 
+@dataset_pages.route('/dataset/<int:dataset_id>/upload/chunked', methods=['POST'])
+@require_login
+@require_writeperm
+def upload_chunked(dataset_id):
+    """Callback to start an upload that is sent in chunks, returns the upload as JSON."""
+    if not DatasetManager.existsID(dataset_id):
+        abort(404)
+
+    dataset = DatasetManager.getDataset(dataset_id)
+
+    form = ChunkedUploadForm()
+    if not form.validate():
+        return jsonify({"errors": [error for errors in form.errors.values() for error in errors]}), 400
+
+    real_upload_folder = __make_upload_folder()
+    real_filename = os.path.join(real_upload_folder, secure_filename(form.filename.data))
+
+    # the job that loads the file is queued right away, csv files are loaded while the chunks arrive
+    upload = dataset.startChunkedUpload(filename=real_filename, userid=session['userdata']['userid'], size=form.size.data,
+                                        header=form.columnnames_included.data, automatic_types=form.automatic_types.data,
+                                        delimiter=str(form.delimiter.data), quotechar=str(form.quotechar.data),
+                                        encoding=form.encoding.data)
+
+    return jsonify(__chunked_upload_dict(upload))
+# ENDFUNCTION
+
+@dataset_pages.route('/dataset/<int:dataset_id>/upload/chunked/<string:upload_id>', methods=['GET', 'PUT'])
+@require_login
+@require_writeperm
+def upload_chunk(dataset_id, upload_id):
+    """Callback to send a chunk of an upload (PUT) or to retrieve the offset at which
+    an interrupted upload has to be resumed (GET). A chunk is sent as the body of the request,
+    with its offset and checksum ('<algorithm>:<hex digest>') as arguments."""
+    if not DatasetManager.existsID(dataset_id):
+        abort(404)
+
+    dataset = DatasetManager.getDataset(dataset_id)
+
+    upload = dataset.getChunkedUpload(upload_id)
+    if upload is None or upload['userid'] != session['userdata']['userid']:
+        abort(404)
+
+    if request.method == 'GET':
+        return jsonify(__chunked_upload_dict(upload))
+
+    offset = request.args.get('offset', type=int)
+    checksum = request.args.get('checksum', "")
+    if offset is None:
+        return jsonify({"errors": ["The offset of the chunk is required."]}), 400
+
+    # the chunk is refused before it's read if it's too large
+    max_chunk_size = ChunkedUploadManager(None).max_chunk_size
+    if request.content_length is not None and request.content_length > max_chunk_size:
+        return jsonify({"errors": ["The chunk is larger than " + str(max_chunk_size) + " bytes."]}), 413
+
+    try:
+        upload = dataset.appendChunk(upload_id, offset, request.get_data(cache=False), checksum)
+    except ChunkedUploadManager.OffsetError as e:
+        # the client continues from the offset the server expects
+        return jsonify({"errors": [str(e)], "offset": e.offset}), 409
+    except ChunkedUploadManager.ClosedError as e:
+        return jsonify({"errors": [str(e)]}), 410
+    except ChunkedUploadManager.ChunkError as e:
+        return jsonify({"errors": [str(e)]}), 400
+
+    return jsonify(__chunked_upload_dict(upload))
+# ENDFUNCTION
+
+@dataset_pages.route('/dataset/<int:dataset_id>/_get_upload_jobs')
+@require_login
+@require_readperm
+def _get_upload_jobs(dataset_id):
+    """Callback to poll the progress of the uploads of the dataset."""
+    if not DatasetManager.existsID(dataset_id):
+        abort(404)
+
+    dataset = DatasetManager.getDataset(dataset_id)
+
+    retval = []
+    for job in dataset.getUploadJobs():
+        retval.append({
+            "job_id": job['job_id'],
+            "filename": os.path.basename(job['filename']),
+            "status": job['status'],
+            "bytes_total": job['bytes_total'],
+            "bytes_done": job['bytes_done'],
+            "rows_done": job['rows_done'],
+            "message": job['message']
+        })
+
+    return jsonify(retval)
+# ENDFUNCTION
+
 @dataset_pages.route('/dataset/<int:dataset_id>/table/<string:tablename>/download/CSV',          defaults = {'original': False, 'fileformat': 'CSV'})
 @dataset_pages.route('/dataset/<int:dataset_id>/table/<string:tablename>/download/SQL',          defaults = {'original': False, 'fileformat': 'SQL'})
 @dataset_pages.route('/dataset/<int:dataset_id>/original_table/<string:tablename>/download/CSV', defaults = {'original': True,  'fileformat': 'CSV'})
 @dataset_pages.route('/dataset/<int:dataset_id>/original_table/<string:tablename>/download/SQL', defaults = {'original': True,  'fileformat': 'SQL'})
+@dataset_pages.route('/dataset/<int:dataset_id>/table/<string:tablename>/download/PARQUET',          defaults = {'original': False, 'fileformat': 'PARQUET'})
+@dataset_pages.route('/dataset/<int:dataset_id>/table/<string:tablename>/download/ARROW',            defaults = {'original': False, 'fileformat': 'ARROW'})
+@dataset_pages.route('/dataset/<int:dataset_id>/original_table/<string:tablename>/download/PARQUET', defaults = {'original': True,  'fileformat': 'PARQUET'})
+@dataset_pages.route('/dataset/<int:dataset_id>/original_table/<string:tablename>/download/ARROW',   defaults = {'original': True,  'fileformat': 'ARROW'})
 @require_login
 @require_readperm
 def download_table(dataset_id, tablename, original, fileformat):
@@ -767,6 +870,10 @@ def __download_helper(dataset_id, mode, fileformat, tablename = None):
         form = DownloadTableCSVForm(request.args)
     elif mode in ["TABLE", "ORIGINAL"] and fileformat == "SQL":
         form = DownloadTableSQLForm(request.args)
+    elif mode in ["TABLE", "ORIGINAL"] and fileformat in ["PARQUET", "ARROW"]:
+        if not ColumnarStream.is_available():
+            abort(404)
+        form = DownloadTableColumnarForm(request.args)
 
     if not form.validate():
         flash_errors(form)
@@ -782,21 +889,7 @@ def __download_helper(dataset_id, mode, fileformat, tablename = None):
         if not tablename in dataset.getOriginalTableNames():
             abort(404)
 
-    real_download_dir = None
-
-    # create download folder
-    # format: <DOWNLOAD_FOLDER>/<USER_ID>_<X>/
-    for i in range(100):
-        temp_dir = os.path.join(app.config['DOWNLOAD_FOLDER'], str(session['userdata']['userid']) + "_" + str(i))
-
-        if not os.path.exists(temp_dir):
-            os.makedirs(temp_dir)
-            real_download_dir = temp_dir
-            break
-    # ENDFOR
-
-    if real_download_dir is None:
-        abort(500)
+    dd = dataset.getDownloader()
 
     if fileformat == 'CSV':
         # GET PARAMETERS
@@ -804,33 +897,73 @@ def __download_helper(dataset_id, mode, fileformat, tablename = None):
         nullrep = str(form.nullrep.data)
         quotechar = str(form.quotechar.data)
 
-        # PREPARE FILE FOR DOWNLOAD
-        dd = dataset.getDownloader()
+        # STREAM DATA TO USER
         if mode == "DATASET":
-            filename = dd.get_csv_zip(foldername=real_download_dir, delimiter=delimiter, null=nullrep, quotechar=quotechar, original=form.original_check.data)
-        elif mode == "TABLE":
-            filename = dd.get_csv(tablename=tablename, foldername=real_download_dir, delimiter=delimiter, null=nullrep, quotechar=quotechar, original = False)
-        elif mode == "ORIGINAL":
-            filename = dd.get_csv(tablename=tablename, foldername=real_download_dir, delimiter=delimiter, null=nullrep, quotechar=quotechar, original = True)
-        
+            chunks = dd.stream_csv_zip(delimiter=delimiter, null=nullrep, quotechar=quotechar, original=form.original_check.data)
+            return __streaming_response(chunks, str(dataset_id) + ".zip", "application/zip")
+
+        compression = __get_compression(form)
+        chunks = dd.stream_csv(tablename=tablename, delimiter=delimiter, null=nullrep, quotechar=quotechar, original = (mode == "ORIGINAL"), compression=compression)
+        return __compressed_response(chunks, tablename + ".csv", "text/csv", compression)
+
     elif fileformat == 'SQL':
-        dd = dataset.getDownloader()
-        if mode == "DATASET":
-            filename = dd.get_dataset_dump(foldername=real_download_dir, original=form.original_check.data)
-        elif mode == "TABLE":
-            filename = dd.get_table_dump(tablename=tablename, foldername=real_download_dir, original=False)
-        elif mode == "ORIGINAL":
-            filename = dd.get_table_dump(tablename=tablename, foldername=real_download_dir, original=True)
+        if mode == "DATASET" and form.original_check.data:
+            chunks = dd.stream_dataset_dump_zip(use_copy=form.copy_check.data)
+            return __streaming_response(chunks, str(dataset_id) + ".zip", "application/zip")
+        elif mode == "DATASET":
+            chunks = dd.stream_dataset_dump(use_copy=form.copy_check.data)
+            return __streaming_response(chunks, str(dataset_id) + ".dump", "application/sql")
+
+        compression = __get_compression(form)
+        chunks = dd.stream_table_dump(tablename=tablename, original = (mode == "ORIGINAL"), use_copy=form.copy_check.data, compression=compression)
+        return __compressed_response(chunks, tablename + ".dump", "application/sql", compression)
+
+    elif fileformat in ['PARQUET', 'ARROW']:
+        file_format = fileformat.lower()
+        chunks = dd.stream_columnar(tablename=tablename, file_format=file_format, original = (mode == "ORIGINAL"))
+        return __streaming_response(chunks, tablename + ColumnarStream.extensions[file_format], ColumnarStream.mimetypes[file_format])
     else:
         raise RuntimeError("Invalid file format: '" + fileformat + "'.")
+# ENDFUNCTION
+
+def __make_upload_folder():
+    """Creates a new folder for an uploaded file and returns its path."""
+    # format: <UPLOAD_FOLDER>/<USER_ID>_<RANDOM>/<FILENAME>.<EXT>
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    return tempfile.mkdtemp(prefix=str(session['userdata']['userid']) + "_", dir=app.config['UPLOAD_FOLDER'])
+# ENDFUNCTION
+
+def __chunked_upload_dict(upload):
+    """Returns the information a client needs to continue a chunked upload."""
+    return {
+        "upload_id": upload['upload_id'],
+        "offset": upload['bytes_received'],
+        "size": upload['size'],
+        "status": upload['status'],
+        "max_chunk_size": ChunkedUploadManager(None).max_chunk_size
+    }
+# ENDFUNCTION
 
-    # SEND TO USER
-    send_file = send_from_directory(real_download_dir, filename, mimetype="text/csv", attachment_filename=filename, as_attachment = True)
+def __streaming_response(chunks, filename, mimetype):
+    """Returns a response that sends the chunks to the user as an attachment while they are being generated."""
+    response = app.response_class(stream_with_context(chunks), mimetype=mimetype)
+    response.headers.add('Content-Disposition', 'attachment', filename=filename)
+    return response
+# ENDFUNCTION
 
-    # DELETE FILE
-    shutil.rmtree(real_download_dir, ignore_errors=True)
+def __get_compression(form):
+    """Returns the compression method selected in a download form, or None for an uncompressed download."""
+    if form.compression.data == 'none':
+        return None
+    return form.compression.data
+# ENDFUNCTION
 
-    return send_file
+def __compressed_response(chunks, filename, mimetype, compression):
+    """Returns a streaming response for a download that may be compressed."""
+    if compression is None:
+        return __streaming_response(chunks, filename, mimetype)
+    filename += CompressedStream.extensions[compression]
+    return __streaming_response(chunks, filename, CompressedStream.mimetypes[compression])
 # ENDFUNCTION
 
 ############################################################# DYNAMIC CALLBACKS #############################################################
@@ -908,8 +1041,12 @@ def _get_hist_num(dataset_id, tablename, attr_name):
         abort(404)
 
     bins = 10
+    # percentage of the table to sample, only meant for very large tables
+    sample = request.args.get('sample', None, type=float)
+    if sample is not None and not 0 < sample <= 100:
+        abort(400)
 
-    hist_num = tv.get_numerical_histogram(attr_name, bins)
+    hist_num = tv.get_numerical_histogram(attr_name, bins, sample_percent = sample)
 
     retval = {
         "labels": hist_num[0],
@@ -970,11 +1107,15 @@ def _get_colstats(dataset_id, tablename):
     if not attr_name in tv.get_attributes():
         abort(404)
 
-    colstats = [tv.get_avg(attr_name),
-                tv.get_min(attr_name),
-                tv.get_max(attr_name),
-                tv.get_null_frequency(attr_name),
-                tv.get_most_frequent_value(attr_name)]
+    # all the statistics are computed in a single scan of the table
+    profile = tv.profile_columns([attr_name])[attr_name]
+    numerical = SQLTypeHandler().is_numerical(profile['type'])
+
+    colstats = [profile['avg'] if numerical else "N/A",
+                profile['min'] if numerical else "N/A",
+                profile['max'] if numerical else "N/A",
+                profile['nulls'],
+                profile['mode']]
 
     colstats_string = "<table><tr><th>Average</th><th>Minimum</th><th>Maximum</th><th>Null Frequency</th><th>Most Frequent</th></tr>"
 
@@ -986,6 +1127,38 @@ def _get_colstats(dataset_id, tablename):
     return colstats_string
 # ENDFUNCTION
 
+@dataset_pages.route('/dataset/<int:dataset_id>/table/<string:tablename>/_get_profile', defaults = {'original': False})
+@dataset_pages.route('/dataset/<int:dataset_id>/original_table/<string:tablename>/_get_profile', defaults = {'original': True})
+@require_login
+@require_readperm
+def _get_profile(dataset_id, tablename, original):
+    """Callback to retrieve the profile of one or all attributes of a table in JSON format."""
+    attr_name   = request.args.get('view_attr',   None,    type=str)
+    approximate = request.args.get('approximate', 'false', type=str).lower() == 'true'
+
+    if not DatasetManager.existsID(dataset_id):
+        abort(404)
+
+    dataset = DatasetManager.getDataset(dataset_id)
+
+    if original:
+        if not tablename in dataset.getOriginalTableNames():
+            abort(404)
+    else:
+        if not tablename in dataset.getTableNames():
+            abort(404)
+
+    tv = dataset.getTableViewer(tablename, original = original)
+
+    columns = None
+    if attr_name is not None:
+        if not attr_name in tv.get_attributes():
+            abort(404)
+        columns = [attr_name]
+
+    return app.response_class(tv.render_profile_json(columns, approximate), mimetype='application/json')
+# ENDFUNCTION
+
 @dataset_pages.route('/dataset/<int:dataset_id>/_get_attr1_options')
 @require_login
 @require_writeperm
@@ -1039,6 +1212,7 @@ def _get_table(dataset_id, tablename, original):
     row_count  = request.args.get('length',           type=int)
     col_nr     = request.args.get('order[0][column]', type=int)
     sort_order = request.args.get('order[0][dir]',    type=str)
+    cursor     = request.args.get('cursor',           type=str)
 
     # set current session row_count to the specified count
     session['rowcount'] = row_count
@@ -1061,12 +1235,14 @@ def _get_table(dataset_id, tablename, original):
 
     col_name = tv.get_attributes()[col_nr]
 
-    data = tv.render_json(offset = start_nr, limit = row_count, order = True, ascending = (sort_order == 'asc'), on_column=col_name)
+    data, next_cursor = tv.render_json_page(offset = start_nr, limit = row_count, on_column = col_name,
+                                            ascending = (sort_order == 'asc'), cursor = cursor)
 
     retval = {
         'recordsTotal':    int(tv.get_rowcount()),
         'recordsFiltered': int(tv.get_rowcount()),
-        'data':            json.loads(data)
+        'data':            json.loads(data),
+        'cursor':          next_cursor
     }
 
     return jsonify(retval)
@@ -6,6 +6,7 @@ from View.admin_pages import admin_pages
 from View.dataset_pages import dataset_pages
 from View.transf_callbacks import transf_callbacks
 from Model.DatabaseConfiguration import DatabaseConfiguration
+from Model.UploadJobQueue import UploadJobQueue
 
 app = Flask(__name__, template_folder="./View/templates/")
 app.config.update(dict(
@@ -21,6 +22,9 @@ app.register_blueprint(admin_pages)
 app.register_blueprint(dataset_pages)
 app.register_blueprint(transf_callbacks)
 
+# workers that load uploaded files in the background
+UploadJobQueue(DatabaseConfiguration()).start()
+
 @app.before_request
 def before_request():
     """Prepare request."""
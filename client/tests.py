@@ -13,6 +13,9 @@ from unit_tests.test_TableTransformerCopy import TestTransformerCopy
 from unit_tests.test_TableViewer import TestTableViewer
 
 from unit_tests.test_TableUploader import TestTableUploader
+from unit_tests.test_DatasetDownloader import TestDatasetDownloader
+from unit_tests.test_UploadJobQueue import TestUploadJobQueue
+from unit_tests.test_ChunkedUploadManager import TestChunkedUploadManager
 
 if __name__ == "__main__":
     tests = []
@@ -26,6 +29,9 @@ if __name__ == "__main__":
     #tests.append(TestTransformerCopy)
     #tests.append(TestTableViewer)
     #tests.append(TestTableUploader)
+    #tests.append(TestDatasetDownloader)
+    #tests.append(TestUploadJobQueue)
+    #tests.append(TestChunkedUploadManager)
 
     tester = ProjectTester(tests)
     
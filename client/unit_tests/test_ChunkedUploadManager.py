@@ -0,0 +1,109 @@
+import unittest
+import os
+import shutil
+import tempfile
+import hashlib
+import zlib
+from Model.DatabaseConfiguration import TestConnection
+from Model.ChunkedUploadManager import ChunkedUploadManager
+
+
+class TestChunkedUploadManager(unittest.TestCase):
+    db_connection = None
+    test_object = None
+
+    def setUp(self):
+        self.db_connection = TestConnection().get_db()
+        self.test_object = ChunkedUploadManager(self.db_connection, max_chunk_size=64)
+        self.cur = self.db_connection.cursor()
+        self.cur.execute("INSERT INTO SYSTEM.datasets VALUES(0, 0, 0)")
+        self.db_connection.commit()
+
+        self.folder = tempfile.mkdtemp()
+        self.filename = os.path.join(self.folder, "upload.csv")
+        self.data = b"id,name\n1,one\n2,two\n3,three\n"
+        self.upload_id = self.test_object.start(0, None, self.filename, len(self.data))
+
+    def tearDown(self):
+        self.db_connection.rollback()
+        self.cur.execute("DELETE FROM SYSTEM.chunked_uploads WHERE setid = 0")
+        self.cur.execute("DELETE FROM SYSTEM.datasets AS ds WHERE ds.setid = 0")
+        self.db_connection.commit()
+        TestConnection().close_connection(self.db_connection)
+        shutil.rmtree(self.folder)
+
+    def __checksum(self, data, algorithm='crc32'):
+        if algorithm == 'sha256':
+            return 'sha256:' + hashlib.sha256(data).hexdigest()
+        return 'crc32:' + format(zlib.crc32(data) & 0xffffffff, '08x')
+
+    def __assert_unchanged(self, bytes_received):
+        """Test whether the upload still has the status receiving and bytes_received bytes."""
+        self.assertEqual(self.test_object.get_status(self.upload_id), ('receiving', bytes_received))
+        with open(self.filename, 'rb') as staging_file:
+            self.assertEqual(staging_file.read(), self.data[:bytes_received])
+
+    def test_append(self):
+        # the chunks are written to the staging file, the upload is complete once all bytes are received
+        self.assertEqual(self.test_object.get_status(self.upload_id), ('receiving', 0))
+        upload = self.test_object.append(self.upload_id, 0, self.data[:10], self.__checksum(self.data[:10]))
+        self.assertEqual((upload['status'], upload['bytes_received']), ('receiving', 10))
+        upload = self.test_object.append(self.upload_id, 10, self.data[10:], self.__checksum(self.data[10:], 'sha256'))
+        self.assertEqual((upload['status'], upload['bytes_received']), ('complete', len(self.data)))
+        with open(self.filename, 'rb') as staging_file:
+            self.assertEqual(staging_file.read(), self.data)
+
+    def test_wrong_offset(self):
+        # a chunk that doesn't start at the end of the data received so far tells where it should start
+        self.test_object.append(self.upload_id, 0, self.data[:10], self.__checksum(self.data[:10]))
+        for offset in [0, 5, 11]:
+            with self.assertRaises(ChunkedUploadManager.OffsetError) as context:
+                self.test_object.append(self.upload_id, offset, self.data[offset:offset + 5],
+                                        self.__checksum(self.data[offset:offset + 5]))
+            self.assertEqual(context.exception.offset, 10)
+        self.__assert_unchanged(10)
+
+    def test_bad_checksum(self):
+        # a damaged chunk or a checksum of an unknown algorithm is refused, nothing is written
+        self.test_object.append(self.upload_id, 0, self.data[:10], self.__checksum(self.data[:10]))
+        chunk = self.data[10:20]
+        for checksum in [self.__checksum(b"damaged"), 'md5:' + hashlib.md5(chunk).hexdigest(),
+                         zlib.crc32(chunk), '', None]:
+            with self.assertRaises(ChunkedUploadManager.ChecksumError):
+                self.test_object.append(self.upload_id, 10, chunk, checksum)
+        self.__assert_unchanged(10)
+
+    def test_chunk_size(self):
+        # a chunk can't extend past the size of the file, and it can't be empty or too large
+        with self.assertRaises(ChunkedUploadManager.ChunkError):
+            self.test_object.append(self.upload_id, 0, self.data + b"4", self.__checksum(self.data + b"4"))
+        with self.assertRaises(ChunkedUploadManager.ChunkError):
+            self.test_object.append(self.upload_id, 0, b"", self.__checksum(b""))
+        with self.assertRaises(ChunkedUploadManager.ChunkError):
+            self.test_object.append(self.upload_id, 0, b"x" * 65, self.__checksum(b"x" * 65))
+        self.__assert_unchanged(0)
+
+    def test_cancel(self):
+        # a cancelled upload doesn't accept chunks anymore, neither does a complete one
+        self.test_object.append(self.upload_id, 0, self.data[:10], self.__checksum(self.data[:10]))
+        self.test_object.cancel(self.upload_id)
+        with self.assertRaises(ChunkedUploadManager.ClosedError):
+            self.test_object.append(self.upload_id, 10, self.data[10:], self.__checksum(self.data[10:]))
+        self.assertEqual(self.test_object.get_status(self.upload_id), ('cancelled', 10))
+
+        upload_id = self.test_object.start(0, None, os.path.join(self.folder, "complete.csv"), 4)
+        self.test_object.append(upload_id, 0, b"abcd", self.__checksum(b"abcd"))
+        with self.assertRaises(ChunkedUploadManager.ClosedError):
+            self.test_object.append(upload_id, 4, b"e", self.__checksum(b"e"))
+        # cancelling a complete upload has no effect
+        self.test_object.cancel(upload_id)
+        self.assertEqual(self.test_object.get_status(upload_id), ('complete', 4))
+
+        # an upload that doesn't exist is treated as cancelled
+        self.assertEqual(self.test_object.get_status("missing"), ('cancelled', 0))
+        with self.assertRaises(ChunkedUploadManager.ClosedError):
+            self.test_object.append("missing", 0, b"abcd", self.__checksum(b"abcd"))
+
+
+if __name__ == '__main__':
+    unittest.main()
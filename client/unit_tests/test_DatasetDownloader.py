@@ -0,0 +1,280 @@
+import unittest
+import csv
+import io
+import threading
+import struct
+import zipfile
+import gzip
+import psycopg2
+import psycopg2.extensions
+from Model.DatabaseConfiguration import TestConnection
+from Model.DatasetDownloader import DatasetDownloader
+from Model.CompressedStream import CompressedStream
+from Model.ColumnarStream import ColumnarStream
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+class CountingConfiguration:
+    """Gives out the connections of the pool of the test database and counts the ones that weren't given back."""
+
+    def __init__(self):
+        self.taken = 0
+
+    def get_db(self):
+        connection = TestConnection().get_db()
+        self.taken += 1
+        return connection
+
+    def close_connection(self, db_conn):
+        self.taken -= 1
+        TestConnection().close_connection(db_conn)
+
+
+class TestDatasetDownloader(unittest.TestCase):
+    db_connection = None
+    test_object = None
+
+    def setUp(self):
+        self.db_connection = TestConnection().get_db()
+        self.test_object = DatasetDownloader(0, self.db_connection)
+        self.cur = self.db_connection.cursor()
+        self.cur.execute('DROP SCHEMA IF EXISTS "0" CASCADE')
+        self.cur.execute('DROP SCHEMA IF EXISTS "original_0" CASCADE')
+        self.cur.execute('CREATE SCHEMA "0"')
+        self.cur.execute('CREATE SCHEMA "original_0"')
+        self.cur.execute('CREATE TABLE "0".test_table (number INTEGER, string VARCHAR(255), amount DOUBLE PRECISION)')
+        values = [(1, 'C-Corp', 1.5), (2, 'Quote "this", please', -2.25), (3, 'Two\nlines', 0.0),
+                  (4, None, None), (5, 'Ünïcödé', 1e10)]
+        for v in values:
+            self.cur.execute('INSERT INTO "0".test_table VALUES(%s, %s, %s)', v)
+        self.cur.execute('CREATE TABLE "original_0".test_table AS TABLE "0".test_table')
+        self.db_connection.commit()
+
+    def tearDown(self):
+        self.db_connection.rollback()
+        self.cur.execute('DROP SCHEMA "0" CASCADE')
+        self.cur.execute('DROP SCHEMA "original_0" CASCADE')
+        self.db_connection.commit()
+        TestConnection().close_connection(self.db_connection)
+
+    def __get_rows(self, schema="0"):
+        """Returns the rows of the test table as the strings they're written as in a csv export."""
+        self.cur.execute('SELECT number::text, string, amount::text FROM "{}".test_table ORDER BY number'.format(schema))
+        return [['NULL' if value is None else str(value) for value in row] for row in self.cur.fetchall()]
+
+    def __parse_csv(self, data):
+        rows = list(csv.reader(io.StringIO(data.decode('utf-8'), newline='')))
+        return rows[0], sorted(rows[1:], key=lambda row: int(row[0]))
+
+    def test_stream_csv(self):
+        """Test whether a table streamed as csv through COPY contains the same data as the table."""
+        data = b"".join(self.test_object.stream_csv('test_table', chunk_size=16))
+        header, rows = self.__parse_csv(data)
+        self.assertEqual(header, ['number', 'string', 'amount'])
+        self.assertEqual(rows, self.__get_rows())
+
+        #The chunks are at least chunk_size bytes, except for the last one
+        chunks = list(self.test_object.stream_csv('test_table', chunk_size=16))
+        self.assertTrue(all(len(chunk) >= 16 for chunk in chunks[:-1]))
+        self.assertEqual(b"".join(chunks), data)
+
+    def test_stream_csv_options(self):
+        """Test whether the csv options and the original table are used by a streamed export."""
+        self.cur.execute('UPDATE "0".test_table SET string = \'Edited\'')
+        self.db_connection.commit()
+        data = b"".join(self.test_object.stream_csv('test_table', delimiter=';', null='', original=True))
+        rows = list(csv.reader(io.StringIO(data.decode('utf-8'), newline=''), delimiter=';'))
+        self.assertEqual(len(rows), 6)
+        self.assertIn(['4', '', ''], rows)
+        self.assertNotIn('Edited', [row[1] for row in rows])
+
+    def test_stream_csv_missing_table(self):
+        """Test whether streaming a table that doesn't exist raises the error of postgres."""
+        with self.assertRaises(psycopg2.Error):
+            b"".join(self.test_object.stream_csv('missing_table'))
+        #The connection is rolled back, so it can still be used
+        self.cur.execute('SELECT COUNT(*) FROM "0".test_table')
+        self.assertEqual(self.cur.fetchone()[0], 5)
+
+    def test_stream_csv_closed_early(self):
+        """Test whether a download that is stopped early cancels the COPY and leaves the connection usable."""
+        self.cur.execute('INSERT INTO "0".test_table SELECT i, md5(i::text), i FROM generate_series(6, 200000) AS i')
+        self.db_connection.commit()
+        thread_count = threading.active_count()
+
+        stream = self.test_object.stream_csv('test_table', chunk_size=1024)
+        first_chunk = next(stream)
+        self.assertTrue(first_chunk.startswith(b'number,string,amount'))
+        stream.close()
+
+        self.assertEqual(threading.active_count(), thread_count)
+        self.assertEqual(self.db_connection.get_transaction_status(), psycopg2.extensions.TRANSACTION_STATUS_IDLE)
+        self.cur.execute('SELECT COUNT(*) FROM "0".test_table')
+        self.assertEqual(self.cur.fetchone()[0], 200000)
+
+    def test_stream_csv_zip(self):
+        """Test whether a zip built on the fly contains a csv file with the data of every table."""
+        self.cur.execute('CREATE TABLE "0".test_table1 AS SELECT * FROM "0".test_table WHERE number < 3')
+        self.db_connection.commit()
+        data = b"".join(self.test_object.stream_csv_zip())
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            self.assertIsNone(archive.testzip())
+            self.assertEqual(sorted(archive.namelist()), ['test_table.csv', 'test_table1.csv'])
+            header, rows = self.__parse_csv(archive.read('test_table.csv'))
+            self.assertEqual(header, ['number', 'string', 'amount'])
+            self.assertEqual(rows, self.__get_rows())
+            header, rows = self.__parse_csv(archive.read('test_table1.csv'))
+            self.assertEqual(rows, self.__get_rows()[:2])
+
+    def test_stream_csv_zip_original(self):
+        """Test whether a zip with the original tables puts the tables in the folders 'edited' and 'original'."""
+        self.cur.execute('DELETE FROM "0".test_table WHERE number > 1')
+        self.db_connection.commit()
+        data = b"".join(self.test_object.stream_csv_zip(original=True))
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            self.assertEqual(archive.namelist(), ['edited/', 'edited/test_table.csv', 'original/', 'original/test_table.csv'])
+            self.assertEqual(self.__parse_csv(archive.read('edited/test_table.csv'))[1], self.__get_rows())
+            self.assertEqual(self.__parse_csv(archive.read('original/test_table.csv'))[1], self.__get_rows("original_0"))
+
+    def test_stream_csv_zip64(self):
+        """Test whether the files of a streamed zip have ZIP64 headers, as their size isn't known in advance."""
+        data = b"".join(self.test_object.stream_csv_zip())
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            info = archive.getinfo('test_table.csv')
+
+        #The local file header: signature, version needed, flags, ..., file name length and extra field length
+        header = struct.unpack('<4sHH18xHH', data[info.header_offset:info.header_offset + 30])
+        signature, version, flags, name_length, extra_length = header
+        self.assertEqual(signature, b'PK\x03\x04')
+        self.assertGreaterEqual(version, zipfile.ZIP64_VERSION)
+        #The sizes follow the data in a data descriptor
+        self.assertTrue(flags & 0x08)
+        extra_start = info.header_offset + 30 + name_length
+        extra = data[extra_start:extra_start + extra_length]
+        header_ids = []
+        while len(extra) >= 4:
+            header_id, size = struct.unpack('<HH', extra[:4])
+            header_ids.append(header_id)
+            extra = extra[4 + size:]
+        self.assertIn(0x0001, header_ids)
+
+    def __create_tables(self, count):
+        for i in range(count):
+            self.cur.execute('CREATE TABLE "0".parallel_table{0} AS SELECT {0} * 1000 + i AS number,'
+                             ' md5(i::text) AS string FROM generate_series(1, 500) AS i'.format(i))
+        self.db_connection.commit()
+
+    def test_stream_csv_zip_parallel(self):
+        """Test whether the tables exported in parallel are put into the zip in the same order and with the same data."""
+        self.__create_tables(6)
+        config = CountingConfiguration()
+        parallel_object = DatasetDownloader(0, self.db_connection, config, max_workers=3, max_chunks=2)
+        data = b"".join(parallel_object.stream_csv_zip())
+        self.assertEqual(config.taken, 0)
+
+        expected = b"".join(self.test_object.stream_csv_zip())
+        with zipfile.ZipFile(io.BytesIO(data)) as archive, zipfile.ZipFile(io.BytesIO(expected)) as expected_archive:
+            self.assertEqual(archive.namelist(), expected_archive.namelist())
+            for name in expected_archive.namelist():
+                self.assertEqual(archive.read(name), expected_archive.read(name))
+
+    def test_parallel_export_snapshot(self):
+        """Test whether all the tables of a parallel export are read from the snapshot taken when it started."""
+        self.__create_tables(4)
+        config = CountingConfiguration()
+        parallel_object = DatasetDownloader(0, self.db_connection, config, max_workers=3)
+        stream = parallel_object.stream_dataset_dump(use_copy=True)
+        pieces = [next(stream)]
+
+        other_connection = TestConnection().get_db()
+        try:
+            other_cur = other_connection.cursor()
+            for i in range(4):
+                other_cur.execute('INSERT INTO "0".parallel_table{} VALUES (-1, \'Late\')'.format(i))
+            other_connection.commit()
+        finally:
+            TestConnection().close_connection(other_connection)
+
+        data = b"".join(pieces + list(stream))
+        self.assertEqual(config.taken, 0)
+        self.assertNotIn(b'Late', data)
+        self.assertEqual(data.count(b'\\.\n'), 5)
+
+    def test_parallel_export_failure(self):
+        """Test whether a parallel export fails if one of its workers fails, and gives back all its connections."""
+        self.__create_tables(6)
+        config = CountingConfiguration()
+        parallel_object = DatasetDownloader(0, self.db_connection, config, max_workers=3, max_chunks=2)
+        stream = parallel_object.stream_csv_zip()
+
+        #The table disappears after the export has been planned, so the worker that exports it fails
+        table_names = parallel_object.query_man.get_table_names("0")
+        self.db_connection.commit()
+        other_connection = TestConnection().get_db()
+        try:
+            other_connection.cursor().execute('DROP TABLE "0".{}'.format(table_names[3]))
+            other_connection.commit()
+        finally:
+            TestConnection().close_connection(other_connection)
+
+        with self.assertRaises((psycopg2.Error, DatasetDownloader.ExportError)):
+            b"".join(stream)
+        self.assertEqual(config.taken, 0)
+        self.cur.execute('SELECT COUNT(*) FROM "0".test_table')
+        self.assertEqual(self.cur.fetchone()[0], 5)
+
+    def test_stream_csv_gzip(self):
+        """Test whether a csv export compressed with gzip decompresses to the uncompressed export."""
+        expected = b"".join(self.test_object.stream_csv('test_table'))
+        data = b"".join(self.test_object.stream_csv('test_table', compression='gzip'))
+        self.assertEqual(gzip.decompress(data), expected)
+
+        expected = b"".join(self.test_object.stream_table_dump('test_table', use_copy=True))
+        data = b"".join(self.test_object.stream_table_dump('test_table', use_copy=True, compression='gzip'))
+        self.assertEqual(gzip.decompress(data), expected)
+
+    @unittest.skipUnless('zstd' in CompressedStream.get_methods(), "zstandard isn't installed")
+    def test_stream_csv_zstd(self):
+        """Test whether a csv export compressed with zstd decompresses to the uncompressed export."""
+        expected = b"".join(self.test_object.stream_csv('test_table'))
+        data = b"".join(self.test_object.stream_csv('test_table', compression='zstd'))
+        self.assertEqual(zstandard.ZstdDecompressor().decompressobj().decompress(data), expected)
+
+    def test_unknown_compression(self):
+        """Test whether an unknown compression method is refused."""
+        with self.assertRaises(ValueError):
+            CompressedStream('rar')
+
+    @unittest.skipUnless(ColumnarStream.is_available(), "pyarrow isn't installed")
+    def test_stream_parquet(self):
+        """Test whether a table exported as Parquet has the types and data of the table, with a row group per batch."""
+        data = b"".join(self.test_object.stream_columnar('test_table', 'parquet', batch_size=2))
+        parquet_file = pyarrow.parquet.ParquetFile(io.BytesIO(data))
+        self.assertEqual(parquet_file.metadata.num_row_groups, 3)
+        table = parquet_file.read()
+        self.assertEqual(table.schema.field('number').type, pyarrow.int32())
+        self.assertEqual(table.schema.field('string').type, pyarrow.string())
+        self.assertEqual(table.schema.field('amount').type, pyarrow.float64())
+
+        self.cur.execute('SELECT * FROM "0".test_table ORDER BY number')
+        rows = sorted((row['number'], row['string'], row['amount']) for row in table.to_pylist())
+        self.assertEqual(rows, self.cur.fetchall())
+
+    @unittest.skipUnless(ColumnarStream.is_available(), "pyarrow isn't installed")
+    def test_stream_arrow(self):
+        """Test whether a table exported as an Arrow IPC file contains the data of the table."""
+        data = b"".join(self.test_object.stream_columnar('test_table', 'arrow', batch_size=2, original=True))
+        table = pyarrow.ipc.open_file(pyarrow.BufferReader(data)).read_all()
+        self.assertEqual(table.num_rows, 5)
+        self.assertEqual(sorted(table.column('number').to_pylist()), [1, 2, 3, 4, 5])
@@ -327,6 +327,24 @@ class TestTableTransformer(unittest.TestCase):
         #There should be 35 columns, the previous 22 - 1(date_string) + 14 (16 categeroies - 2 duplicates = 35
         self.assertEqual(len(all_columns), 35)
         self.db_connection.commit()
+
+        #Attributes with more distinct values than allowed should not be encoded
+        self.assertRaises(transformer.TableTransformer.ValueError, self.test_object.one_hot_encode, 'test_table2', 'string',
+                          max_categories=10)
+        cur.execute("SELECT column_name FROM information_schema.columns WHERE table_schema = '0' AND table_name = 'test_table2'"
+                    " AND column_name = 'string'")
+        self.assertIsNotNone(cur.fetchone())
+        self.db_connection.commit()
+
+        #Names of categories that collide with each other or with existing columns, also after being cut to 63 characters
+        cur.execute('CREATE TABLE "0".onehot_names (a VARCHAR(255))')
+        cur.execute('INSERT INTO "0".onehot_names VALUES (%s), (%s), (%s), (%s)', ['a', 'a_1', 'x' * 70 + '1', 'x' * 70 + '2'])
+        self.db_connection.commit()
+        self.test_object.one_hot_encode('onehot_names', 'a')
+        cur.execute("SELECT column_name FROM information_schema.columns WHERE table_schema = '0' AND table_name = 'onehot_names'")
+        self.assertEqual(sorted([x[0] for x in cur.fetchall()]), ['a_1', 'a_1_1', 'x' * 61 + '_1', 'x' * 63])
+        cur.execute('DROP TABLE "0".onehot_names')
+        self.db_connection.commit()
         
     def test_normalize_using_zscore(self):
         """Test the method that normalizes the values of a column by using the z-score."""
@@ -347,7 +365,19 @@ class TestTableTransformer(unittest.TestCase):
         #There are 16 rows, two rows both contain 8 and should be mapped to the same value
         #And 2 extreme values should both be mapped to 1.0 so there should be 14 unqiue values.
         self.assertEqual(unique_nr, 14)
-        self.assertEqual(1, 1)
+
+        #Normalizing into a new column should leave the original column untouched
+        self.test_object.normalize_using_zscore('test_table3', 'number', False)
+        cur.execute('SELECT number, number_normalized FROM "0".test_table3 ORDER BY number')
+        result = cur.fetchall()
+        self.db_connection.commit()
+        self.assertEqual(result[0][0], -17)
+        self.assertEqual(result[0][1], 1.0)
+        self.assertEqual(result[-1][0], 41)
+        self.assertEqual(result[-1][1], 1.0)
+        self.assertEqual(self.test_object.get_attribute_type('test_table3', 'number'), 'integer')
+        self.assertEqual(self.test_object.get_attribute_type('test_table3', 'number_normalized'), 'double precision')
+        self.assertEqual(sorted(set([x[1] for x in result])), sorted(set(all_values)))
 
     def test_equidistant_discretization(self):
         """Test the equidistant discretization method."""
@@ -530,6 +560,59 @@ class TestTableTransformer(unittest.TestCase):
         result = cur.fetchall()
         self.assertIsNotNone(result)
 
+    def test_run_pipeline(self):
+        """Test the method of TableTransformer that performs a series of transformations in one transaction."""
+        cur = self.db_connection.cursor()
+        cur.execute('CREATE TABLE "0".pipeline_table (string VARCHAR(255), number INTEGER)')
+        cur.execute("INSERT INTO \"0\".pipeline_table VALUES ('C-Corp', 1), ('Apple', 22), ('Nokia', NULL), ('Razer', 45)")
+        self.db_connection.commit()
+        steps = [('find_and_replace', {'attribute': 'string', 'value': 'C-Corp', 'replacement': 'Corp'}),
+                 ('regex_find_and_replace', {'attribute': 'string', 'regex': '^a.*', 'replacement': 'Fruit'}),
+                 ('delete_outliers', {'attribute': 'number', 'larger': True, 'value': 40, 'replacement': 40}),
+                 ('fill_nulls_with_custom_value', {'attribute': 'number', 'value': 0}),
+                 ('normalize_using_zscore', {'attribute': 'number', 'overwrite': False})]
+        self.test_object.run_pipeline('pipeline_table', steps)
+        cur.execute('SELECT string, number FROM "0".pipeline_table ORDER BY number')
+        result = cur.fetchall()
+        self.assertEqual(result, [('Nokia', 0), ('Corp', 1), ('Fruit', 22), ('Razer', 40)])
+        cur.execute('SELECT * FROM "0".pipeline_table WHERE number_normalized IS NULL')
+        self.assertIsNone(cur.fetchone())
+        self.db_connection.commit()
+
+        #If one of the steps fails, none of the steps should have been performed
+        steps = [('find_and_replace', {'attribute': 'string', 'value': 'Corp', 'replacement': 'C-Corp'}),
+                 ('delete_outliers', {'attribute': 'string', 'larger': True, 'value': 40, 'replacement': 40})]
+        self.assertRaises(transformer.TableTransformer.AttrTypeError, self.test_object.run_pipeline, 'pipeline_table', steps)
+        cur.execute("SELECT * FROM \"0\".pipeline_table WHERE string = 'Corp'")
+        self.assertIsNotNone(cur.fetchone())
+        self.assertRaises(transformer.TableTransformer.ValueError, self.test_object.run_pipeline, 'pipeline_table',
+                          [('load_table_in_dataframe', {})])
+        self.db_connection.commit()
+
+    def test_run_pipeline_fused(self):
+        """Test whether fusing the steps of a pipeline gives the same result as performing them one by one."""
+        cur = self.db_connection.cursor()
+        for table in ['fused_table', 'unfused_table']:
+            cur.execute('CREATE TABLE "0".{} (string VARCHAR(255), number INTEGER)'.format(table))
+            cur.execute("INSERT INTO \"0\".{} VALUES ('C-Corp', 1), ('Apple', 22), ('Corp', NULL), (NULL, 45)".format(table))
+        self.db_connection.commit()
+        steps = [('find_and_replace', {'attribute': 'string', 'value': 'Corp', 'replacement': 'X', 'exact': True, 'replace_all': False}),
+                 ('find_and_replace', {'attribute': 'string', 'value': 'Corp', 'replacement': 'Y', 'exact': False, 'replace_all': False}),
+                 ('find_and_replace', {'attribute': 'string', 'value': 'ppl', 'replacement': 'Z', 'exact': False, 'replace_all': True}),
+                 ('find_and_replace', {'attribute': 'number', 'value': '22', 'replacement': '23', 'exact': True, 'replace_all': True}),
+                 ('delete_outliers', {'attribute': 'number', 'larger': True, 'value': 40, 'replacement': 40}),
+                 ('fill_nulls_with_custom_value', {'attribute': 'number', 'value': 0})]
+        self.test_object.run_pipeline('fused_table', steps)
+        for transformation, parameters in steps:
+            getattr(self.test_object, transformation)('unfused_table', **parameters)
+
+        cur.execute('SELECT string, number FROM "0".fused_table ORDER BY number')
+        fused = cur.fetchall()
+        cur.execute('SELECT string, number FROM "0".unfused_table ORDER BY number')
+        self.assertEqual(fused, cur.fetchall())
+        self.assertEqual(fused, [('Y', 0), ('C-Y', 1), ('Z', 23), (None, 40)])
+        self.db_connection.commit()
+
     def test_delete_rows_using_conditions(self):
         """Test the method of TableTransformer that deletes rows by using provided predicates."""
         cur = self.db_connection.cursor()
@@ -2,6 +2,7 @@ import unittest
 from Model.DatabaseConfiguration import TestConnection
 import psycopg2
 import Controller.TableTransformer as transformer
+from Controller.QueryExecutor import QueryExecutor
 
 #This file contains tests for TableTransformer that specifically creates new tables when transforming. This tests data manipulation methods of TableTransformer
 #For the tests on data manipulation methods of TableTransformer that don't copy but overwrite the tables refer to "test_TableTransformer.py"
@@ -509,3 +510,71 @@ class TestTransformerCopy(unittest.TestCase):
         result = cur.fetchone()
         self.assertIsNotNone(result)
         self.assertEqual(result[0], 'Nintendo')
+
+    def test_lazy_copy(self):
+        """Test whether a lazy copy is stored as a view that is only materialized once it gets modified."""
+        lazy_object = transformer.TableTransformer(0, self.db_connection, self.engine, True, False, True)
+        lazy_object.copy_table('test_table', 'lazy_table')
+        self.assertTrue(lazy_object.materializer.is_view('0', 'lazy_table'))
+        lazy_object.copy_table('lazy_table', 'lazy_table1')
+        self.assertEqual(lazy_object.materializer.get_depth('0', 'lazy_table1'), 2)
+
+        #Modifying the copy materializes it, the copy of the copy still has to contain the old data
+        lazy_object.find_and_replace('lazy_table', 'string', 'C-Corp', 'Lazy')
+        self.assertFalse(lazy_object.materializer.is_view('0', 'lazy_table'))
+        self.assertFalse(lazy_object.materializer.is_view('0', 'lazy_table1'))
+        cur = self.db_connection.cursor()
+        cur.execute("SELECT COUNT(*) FROM \"0\".lazy_table WHERE string = 'Lazy'")
+        self.assertEqual(cur.fetchone()[0], 1)
+        cur.execute("SELECT COUNT(*) FROM \"0\".test_table WHERE string = 'Lazy'")
+        self.assertEqual(cur.fetchone()[0], 0)
+        cur.execute("SELECT COUNT(*) FROM \"0\".lazy_table1 WHERE string = 'C-Corp'")
+        self.assertEqual(cur.fetchone()[0], 1)
+
+    def test_lazy_copy_query(self):
+        """Test whether a query only modifies the lazy copy it writes to, however the table is written in the query."""
+        lazy_object = transformer.TableTransformer(0, self.db_connection, self.engine, True, False, True)
+        cur = self.db_connection.cursor()
+        cur.execute("DO $$BEGIN IF NOT EXISTS (SELECT 1 FROM pg_roles WHERE rolname = 'user_0') THEN CREATE ROLE user_0; END IF; END$$")
+        cur.execute('GRANT USAGE ON SCHEMA "0" TO user_0')
+        cur.execute('ALTER DEFAULT PRIVILEGES IN SCHEMA "0" GRANT SELECT, INSERT, UPDATE, DELETE ON TABLES TO user_0')
+        cur.execute('GRANT SELECT, INSERT, UPDATE, DELETE ON ALL TABLES IN SCHEMA "0" TO user_0')
+        self.db_connection.commit()
+
+        cur.execute('SELECT COUNT(*) FROM "0".test_table')
+        row_count = cur.fetchone()[0]
+
+        query_executor = QueryExecutor(0, self.db_connection, self.engine, True, False)
+        queries = ['INSERT INTO query_table(string, number, date_time) VALUES (\'Query\', 1, \'01/01/2000\')',
+                   'UPDATE "0".query_table1 SET string = \'Query\' WHERE number = 1',
+                   'WITH x AS (SELECT * FROM test_table) UPDATE query_table2 SET string = \'Query\' WHERE number = 1',
+                   'INSERT INTO query_table3 SELECT * FROM test_table WHERE number = 1',
+                   'WITH x AS (DELETE FROM query_table4 WHERE number = 1 RETURNING *) SELECT * FROM x']
+        for i, query in enumerate(queries):
+            tablename = 'query_table' + (str(i) if i > 0 else '')
+            lazy_object.copy_table('test_table', tablename)
+            query_executor.execute_transaction(query)
+            self.assertFalse(lazy_object.materializer.is_view('0', tablename))
+
+        cur.execute("SELECT COUNT(*) FROM \"0\".test_table WHERE string = 'Query'")
+        self.assertEqual(cur.fetchone()[0], 0)
+        cur.execute("SELECT COUNT(*) FROM \"0\".test_table")
+        self.assertEqual(cur.fetchone()[0], row_count)
+        cur.execute("SELECT COUNT(*) FROM \"0\".query_table4")
+        self.assertEqual(cur.fetchone()[0], row_count - 1)
+
+    def test_lazy_copy_long_name(self):
+        """Test whether a lazy copy with a name of the maximum length can be materialized."""
+        lazy_object = transformer.TableTransformer(0, self.db_connection, self.engine, True, False, True)
+        long_name = 'l' * 63
+        lazy_object.copy_table('test_table', long_name)
+        #A table with the name the temporary table would get when cut short must not get in the way
+        cur = self.db_connection.cursor()
+        cur.execute(('CREATE TABLE "0".{} (x INTEGER)').format(('_materialize_' + long_name)[:63]))
+        self.assertTrue(lazy_object.materializer.materialize('0', long_name))
+        self.assertFalse(lazy_object.materializer.is_view('0', long_name))
+        cur.execute('SELECT COUNT(*) FROM "0".{}'.format(long_name))
+        materialized_count = cur.fetchone()[0]
+        cur.execute('SELECT COUNT(*) FROM "0".test_table')
+        self.assertEqual(materialized_count, cur.fetchone()[0])
+        self.db_connection.commit()
@@ -1,10 +1,26 @@
 import unittest
 import sys, os
+import shutil
+import tempfile
+import threading
+import time
+import io
+import zipfile
+import datetime
 sys.path.append(os.path.join(sys.path[0],'..', 'Controller'))
 sys.path.append(os.path.join(sys.path[0],'..', 'Model'))
 import psycopg2
 import Model.TableUploader as tl
 from Model.DatabaseConfiguration import DatabaseConfiguration
+from Model.ViewMaterializer import ViewMaterializer
+from Model.ChunkedUploadManager import StagingFile
+from Controller.QueryExecutor import QueryExecutor
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
 
 
 class TestTableUploader(unittest.TestCase):
@@ -27,7 +43,7 @@ class TestTableUploader(unittest.TestCase):
 
     def tearDown(self):
         self.cur.execute("DROP SCHEMA \"0\" CASCADE")
-        self.cur.execute("DROP SCHEMA \"original_0\" CASCADE")
+        self.cur.execute("DROP SCHEMA IF EXISTS \"original_0\" CASCADE")
         self.cur.execute("DELETE FROM SYSTEM.datasets AS ds WHERE ds.setid = 0")
         self.db_connection.commit()
         # Close database connection
@@ -52,6 +68,67 @@ class TestTableUploader(unittest.TestCase):
         self.assertEqual(self.cur.fetchone(), ("d005", "Development"))
 
 
+    def test_read_csv_backup(self):
+        # the backup is a real copy, writing to the uploaded table with a query leaves it unchanged
+        self.test_object.read_file(os.path.dirname(os.path.abspath(__file__)) + "/src/departments.csv", True)
+        self.db_connection.commit()
+        self.assertFalse(ViewMaterializer(self.db_connection).is_view('original_0', 'departments'))
+
+        self.cur.execute("DO $$BEGIN IF NOT EXISTS (SELECT 1 FROM pg_roles WHERE rolname = 'user_0') THEN CREATE ROLE user_0; END IF; END$$")
+        self.cur.execute('GRANT USAGE ON SCHEMA "0" TO user_0')
+        self.cur.execute('GRANT SELECT, INSERT, UPDATE, DELETE ON ALL TABLES IN SCHEMA "0" TO user_0')
+        self.db_connection.commit()
+        query_executor = QueryExecutor(0, self.db_connection, None, True, False)
+        query_executor.execute_transaction('UPDATE departments SET dept_name = \'Research\' WHERE dept_no = \'d005\'')
+
+        self.cur.execute('SELECT * FROM "0".departments WHERE dept_no = \'d005\'')
+        self.assertEqual(self.cur.fetchone(), ("d005", "Research"))
+        self.cur.execute('SELECT * FROM "original_0".departments WHERE dept_no = \'d005\'')
+        self.assertEqual(self.cur.fetchone(), ("d005", "Development"))
+
+
+    def test_read_csv_backup_pieces(self):
+        # a file larger than a piece is loaded into the table and its original piece by piece,
+        # the pieces are cut between records and only the first one has a header
+        folder = tempfile.mkdtemp()
+        filename = os.path.join(folder, "pieces.csv")
+        with open(filename, 'w', encoding="utf-8", newline='') as csv_file:
+            csv_file.write('id,remark\n')
+            for i in range(40000):
+                csv_file.write('{},"line ""{}""\nline {}"\n'.format(i, i, i))
+
+        try:
+            self.test_object.read_file(filename, True)
+        finally:
+            shutil.rmtree(folder)
+
+        for schema in ["0", "original_0"]:
+            self.cur.execute('SELECT COUNT(*), COUNT(DISTINCT id) FROM "{}".pieces'.format(schema))
+            self.assertEqual(self.cur.fetchone(), (40000, 40000))
+            self.cur.execute('SELECT remark FROM "{}".pieces WHERE id = \'39999\''.format(schema))
+            self.assertEqual(self.cur.fetchone()[0], 'line "39999"\nline 39999')
+        self.cur.execute('SELECT * FROM "0".pieces EXCEPT SELECT * FROM "original_0".pieces')
+        self.assertEqual(self.cur.fetchall(), [])
+
+    def test_read_csv_quoted(self):
+        # a utf-8 file with a byte order mark, a custom delimiter and quoted fields containing delimiters and newlines
+        folder = tempfile.mkdtemp()
+        filename = os.path.join(folder, "quoted.csv")
+        with open(filename, 'w', encoding="utf-8-sig", newline='') as csv_file:
+            csv_file.write('name;"the remark"\n"a;b";"line1\nline2"\nc;\n')
+
+        try:
+            self.test_object.read_file(filename, True, delimiter=';')
+        finally:
+            shutil.rmtree(folder)
+
+        # test column names
+        self.cur.execute('SELECT column_name FROM information_schema.columns WHERE table_schema = \'0\' AND table_name = \'quoted\' ORDER BY ordinal_position')
+        self.assertEqual(self.cur.fetchall(), [("name",), ("the_remark",)])
+        # test contents of table, the header is not loaded as a row
+        self.cur.execute('SELECT * FROM "0".quoted ORDER BY name')
+        self.assertEqual(self.cur.fetchall(), [("a;b", "line1\nline2"), ("c", None)])
+
     def test_read_zip(self):
         # load file
         self.test_object.read_file(os.path.dirname(os.path.abspath(__file__)) + "/src/test.zip", True)
@@ -78,6 +155,30 @@ class TestTableUploader(unittest.TestCase):
         self.cur.execute('SELECT * FROM "original_0"."test3" WHERE "original_0"."test3"."Col_1" = \'1\'')
         self.assertEqual(self.cur.fetchone(), ("1", "1", "1", "1"))
 
+    def test_read_zip_typed_parallel(self):
+        # files with the same name are loaded at the same time, their rejected rows go to different tables
+        folder = tempfile.mkdtemp()
+        filename = os.path.join(folder, "typed.zip")
+        with zipfile.ZipFile(filename, 'w') as archive:
+            for member in ["a/typed.csv", "b/typed.csv", "c/typed.csv"]:
+                archive.writestr(member, "id\n" + "".join("{}\n".format(i) for i in range(1000)) + member + "\n")
+
+        uploader = tl.TableUploader(0, self.db_connection, db_config=DatabaseConfiguration())
+        try:
+            uploader.read_file(filename, True, automatic_type_conversion=True)
+        finally:
+            shutil.rmtree(folder)
+
+        self.assertEqual(len(uploader.loaded_tables), 3)
+        self.cur.execute('SELECT table_name FROM information_schema.tables WHERE table_schema = \'0\' AND table_name LIKE \'%rejected%\'')
+        rejected_tables = [x[0] for x in self.cur.fetchall()]
+        self.assertEqual(len(rejected_tables), 3)
+        members = []
+        for tablename in rejected_tables:
+            self.cur.execute('SELECT id FROM "0".{}'.format(tablename))
+            members += [x[0] for x in self.cur.fetchall()]
+        self.assertEqual(sorted(members), ["a/typed.csv", "b/typed.csv", "c/typed.csv"])
+
     def test_read_dump(self):
         # load file
         self.test_object.read_file(os.path.dirname(os.path.abspath(__file__)) + "/src/test.dump", True)
@@ -96,6 +197,202 @@ class TestTableUploader(unittest.TestCase):
         self.cur.execute('SELECT * FROM "original_0".abc WHERE "original_0".abc.userid = 1')
         self.assertEqual(self.cur.fetchone(), (1, "test", "01/01/2018"))
 
+    def test_read_copy_dump(self):
+        # load file, the data of the table is a COPY block
+        self.test_object.read_file(os.path.dirname(os.path.abspath(__file__)) + "/src/test_copy.dump", True)
+        # test contents of table
+        self.cur.execute('SELECT * FROM "0".abc ORDER BY userid')
+        self.assertEqual(self.cur.fetchall(), [(1, "test;with;semicolons", "01/01/2018"), (2, None, "15/01/2018")])
+
+        # test backup
+        self.cur.execute('SELECT COUNT(*) FROM "original_0".abc')
+        self.assertEqual(self.cur.fetchone()[0], 2)
+
+    def test_read_dump_literals(self):
+        # load file, the string literals and comments contain semicolons
+        self.test_object.read_file(os.path.dirname(os.path.abspath(__file__)) + "/src/test_literals.dump", True)
+        # test contents of table
+        self.cur.execute('SELECT * FROM "0".abc ORDER BY userid')
+        self.assertEqual(self.cur.fetchall(), [(1, "test;with;semicolons", "01/01/2018"), (2, "it's;\nmultiline", "15/01/2018"),
+                                               (3, "back\\slash;", "20/01/2018")])
+
+    def test_read_csv_typed(self):
+        # the types are inferred from the first 1000 rows, the row after that doesn't fit them
+        folder = tempfile.mkdtemp()
+        filename = os.path.join(folder, "typed.csv")
+        with open(filename, 'w', encoding="utf-8") as csv_file:
+            csv_file.write("id,price,day,name\n")
+            for i in range(1000):
+                csv_file.write("{},{}.5,2018-01-01,\"name, {}\"\n".format(i, i, i))
+            csv_file.write("abc,1.5,2018-01-01,wrong\n")
+            csv_file.write("1000,,,\n")
+
+        try:
+            self.test_object.read_file(filename, True, automatic_type_conversion=True)
+        finally:
+            shutil.rmtree(folder)
+
+        # test column types
+        self.cur.execute('SELECT column_name, data_type FROM information_schema.columns WHERE table_schema = \'0\' AND table_name = \'typed\' ORDER BY ordinal_position')
+        self.assertEqual(self.cur.fetchall(), [("id", "integer"), ("price", "double precision"), ("day", "date"), ("name", "character varying")])
+        # test contents of table
+        self.cur.execute('SELECT COUNT(*) FROM "0".typed')
+        self.assertEqual(self.cur.fetchone()[0], 1001)
+        self.cur.execute('SELECT * FROM "0".typed WHERE id = 1000')
+        self.assertEqual(self.cur.fetchone(), (1000, None, None, None))
+
+        # test rejected rows
+        self.cur.execute('SELECT * FROM "0".typed_rejected')
+        self.assertEqual(self.cur.fetchall(), [(1001, "abc", "1.5", "2018-01-01", "wrong")])
+
+    def test_read_csv_typed_strict(self):
+        # only values that postgres itself would accept for a type are used to infer it
+        folder = tempfile.mkdtemp()
+        filename = os.path.join(folder, "strict.csv")
+        with open(filename, 'w', encoding="utf-8") as csv_file:
+            csv_file.write("empty,underscore,spaced,digits,number\n")
+            csv_file.write(",1_000, 5 ,\u0663,1e400\n")
+            csv_file.write(",2,6,4,1e10\n")
+
+        try:
+            self.test_object.read_file(filename, True, automatic_type_conversion=True)
+        finally:
+            shutil.rmtree(folder)
+
+        self.cur.execute('SELECT data_type FROM information_schema.columns WHERE table_schema = \'0\' AND table_name = \'strict\' ORDER BY ordinal_position')
+        self.assertEqual([x[0] for x in self.cur.fetchall()], ["character varying"] * 5)
+        self.cur.execute('SELECT underscore, spaced FROM "0".strict ORDER BY number')
+        self.assertEqual(self.cur.fetchall(), [("2", "6"), ("1_000", " 5 ")])
+
+    def test_read_csv_typed_wide_integers(self):
+        # integers that don't fit in an integer become a bigint, or a numeric if they don't fit in a bigint either
+        folder = tempfile.mkdtemp()
+        filename = os.path.join(folder, "wide.csv")
+        with open(filename, 'w', encoding="utf-8") as csv_file:
+            csv_file.write("small,big,huge,fraction\n")
+            csv_file.write("1,1,1,1\n")
+            csv_file.write("2,3000000000,123456789012345678901234567890,2.5\n")
+
+        try:
+            self.test_object.read_file(filename, True, automatic_type_conversion=True)
+        finally:
+            shutil.rmtree(folder)
+
+        self.cur.execute('SELECT data_type FROM information_schema.columns WHERE table_schema = \'0\' AND table_name = \'wide\' ORDER BY ordinal_position')
+        self.assertEqual([x[0] for x in self.cur.fetchall()], ["integer", "bigint", "numeric", "double precision"])
+        # no digits are lost
+        self.cur.execute('SELECT big, huge::text FROM "0".wide WHERE small = 2')
+        self.assertEqual(self.cur.fetchone(), (3000000000, "123456789012345678901234567890"))
+
+    def test_read_csv_typed_ragged(self):
+        # blank lines and rows with too few or too many fields are rejected instead of failing the upload
+        folder = tempfile.mkdtemp()
+        filename = os.path.join(folder, "ragged.csv")
+        with open(filename, 'w', encoding="utf-8") as csv_file:
+            csv_file.write("id,name\n")
+            csv_file.write("1,one\n")
+            csv_file.write("\n")
+            csv_file.write("2\n")
+            csv_file.write("3,three,extra\n")
+            csv_file.write("4,four\n")
+
+        try:
+            self.test_object.read_file(filename, True, automatic_type_conversion=True)
+        finally:
+            shutil.rmtree(folder)
+
+        self.cur.execute('SELECT data_type FROM information_schema.columns WHERE table_schema = \'0\' AND table_name = \'ragged\' ORDER BY ordinal_position')
+        self.assertEqual([x[0] for x in self.cur.fetchall()], ["integer", "character varying"])
+        self.cur.execute('SELECT * FROM "0".ragged ORDER BY id')
+        self.assertEqual(self.cur.fetchall(), [(1, "one"), (4, "four")])
+        self.cur.execute('SELECT * FROM "0".ragged_rejected ORDER BY row_number')
+        self.assertEqual(self.cur.fetchall(), [(2, None, None), (3, "2", None), (4, "3", "three,extra")])
+
+    def test_read_csv_staging(self):
+        # the csv file is loaded while it's still being written, like a file that is uploaded in chunks
+        folder = tempfile.mkdtemp()
+        filename = os.path.join(folder, "staged.csv")
+        open(filename, 'wb').close()
+        status = {'status': 'receiving', 'bytes_received': 0}
+        data = ("id,name\n" + "".join("{},name {}\n".format(i, i) for i in range(5000))).encode("utf-8")
+
+        def write_chunks():
+            # every chunk is written in two steps, only the bytes that were received may be read
+            with open(filename, 'ab') as staging_file:
+                for i in range(0, len(data), 4096):
+                    staging_file.write(data[i:i + 2048])
+                    staging_file.flush()
+                    time.sleep(0.005)
+                    staging_file.write(data[i + 2048:i + 4096])
+                    staging_file.flush()
+                    status['bytes_received'] = min(i + 4096, len(data))
+                    time.sleep(0.005)
+            status['status'] = 'complete'
+
+        writer = threading.Thread(target=write_chunks)
+        writer.start()
+        try:
+            self.test_object.read_file(filename, True, opener=lambda: io.BufferedReader(
+                StagingFile(filename, lambda: (status['status'], status['bytes_received']), poll_interval=0.01)))
+        finally:
+            writer.join()
+            shutil.rmtree(folder)
+
+        # test contents of table
+        self.cur.execute('SELECT COUNT(*) FROM "0".staged')
+        self.assertEqual(self.cur.fetchone()[0], 5000)
+        self.cur.execute('SELECT * FROM "0".staged WHERE id = \'4999\'')
+        self.assertEqual(self.cur.fetchone(), ("4999", "name 4999"))
+
+    @unittest.skipUnless(pyarrow is not None, "pyarrow isn't installed")
+    def test_read_parquet_typed(self):
+        # the types of the columns are taken from the parquet file, every row group is loaded separately
+        folder = tempfile.mkdtemp()
+        filename = os.path.join(folder, "columnar.parquet")
+        table = pyarrow.table({
+            "small": pyarrow.array([1, -2, None], type=pyarrow.int16()),
+            "big": pyarrow.array([2 ** 40, None, -1], type=pyarrow.int64()),
+            "price": pyarrow.array([1.5, None, -0.25], type=pyarrow.float64()),
+            "flag": pyarrow.array([True, False, None]),
+            "day": pyarrow.array([datetime.date(2018, 1, 1), None, datetime.date(1999, 12, 31)]),
+            "moment": pyarrow.array([datetime.datetime(2018, 1, 1, 12, 30, 0, 500), None, None], type=pyarrow.timestamp('us')),
+            "name": pyarrow.array(["comma, \"quote\"", "", None]),
+            "category": pyarrow.array(["a", "b", "a"]).dictionary_encode()})
+        pyarrow.parquet.write_table(table, filename, row_group_size=2)
+
+        try:
+            self.test_object.read_file(filename)
+        finally:
+            shutil.rmtree(folder)
+
+        # test column types
+        self.cur.execute('SELECT data_type FROM information_schema.columns WHERE table_schema = \'0\' AND table_name = \'columnar\' ORDER BY ordinal_position')
+        self.assertEqual([x[0] for x in self.cur.fetchall()], ["smallint", "bigint", "double precision", "boolean", "date",
+                                                               "timestamp without time zone", "character varying", "character varying"])
+        # test contents of table, an empty string isn't a null
+        self.cur.execute('SELECT * FROM "0".columnar ORDER BY price NULLS LAST')
+        self.assertEqual(self.cur.fetchall(), [
+            (None, -1, -0.25, None, datetime.date(1999, 12, 31), None, None, "a"),
+            (1, 2 ** 40, 1.5, True, datetime.date(2018, 1, 1), datetime.datetime(2018, 1, 1, 12, 30, 0, 500), "comma, \"quote\"", "a"),
+            (-2, None, None, False, None, None, "", "b")])
+
+        # test backup
+        self.cur.execute('SELECT COUNT(*) FROM "original_0".columnar')
+        self.assertEqual(self.cur.fetchone()[0], 3)
+
+    @unittest.skipUnless(pyarrow is not None, "pyarrow isn't installed")
+    def test_read_parquet_unsupported_type(self):
+        # columns that can't be stored in postgres are refused
+        folder = tempfile.mkdtemp()
+        filename = os.path.join(folder, "nested.parquet")
+        pyarrow.parquet.write_table(pyarrow.table({"numbers": pyarrow.array([[1, 2], [3]])}), filename)
+
+        try:
+            with self.assertRaises(tl.ColumnTypeException):
+                self.test_object.read_file(filename)
+        finally:
+            shutil.rmtree(folder)
+
 if __name__ == '__main__':
 
     unittest.main()
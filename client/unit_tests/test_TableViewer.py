@@ -3,7 +3,9 @@ import psycopg2
 from sqlalchemy import create_engine
 import Controller.TableViewer as tv
 from Model.DatabaseConfiguration import TestConnection
+from Model.RowCounter import RowCounter
 import math
+import json
 
 
 
@@ -86,6 +88,34 @@ class TestTableViewer(unittest.TestCase):
         self.assertEqual(all_attributes[1] in result, True)
         self.assertEqual(all_attributes[2] in result, True)
 
+    def test_get_numerical_histogram(self):
+        labels, sizes, numerical = self.test_object2.get_numerical_histogram("string")
+        self.assertEqual(numerical, False)
+        labels, sizes, numerical = self.test_object2.get_numerical_histogram("number", 3)
+        self.assertEqual(numerical, True)
+        self.assertEqual(labels, [str((1, 2)), str((2, 3)), str((3, 4))])
+        self.assertEqual(sizes, [1, 3, 2])
+        # the whole table is sampled, so the sizes are not scaled
+        self.assertEqual(self.test_object2.get_numerical_histogram("number", 3, sample_percent=100)[1], [1, 3, 2])
+        labels, sizes, numerical = self.test_object.get_numerical_histogram("number")
+        self.assertEqual(len(labels), 10)
+        self.assertEqual(sum(sizes), 70)
+
+    def test_get_rowcount(self):
+        self.assertEqual(self.test_object.get_rowcount(), 70)
+        self.assertEqual(self.test_object2.get_rowcount(), 6)
+        # the count is cached until the table is invalidated
+        cur = self.db_connection.cursor()
+        cur.execute('INSERT INTO "0".stat_table VALUES(%s, %s, %s)', ('hehe', 5, '01/01/2001'))
+        self.db_connection.commit()
+        self.assertEqual(self.test_object2.get_rowcount(), 6)
+        RowCounter().invalidate(0, 'stat_table')
+        self.assertEqual(self.test_object2.get_rowcount(), 7)
+        cur.execute('DELETE FROM "0".stat_table WHERE string = %s', ['hehe'])
+        self.db_connection.commit()
+        RowCounter().invalidate(0)
+        self.assertEqual(self.test_object2.get_rowcount(), 6)
+
     def test_get_most_frequent_value(self):
         most_frequent = self.test_object2.get_most_frequent_value("string")
         self.assertEqual(most_frequent, "haha")
@@ -125,6 +155,73 @@ class TestTableViewer(unittest.TestCase):
         self.assertTrue(math.isclose(14/6, avg))
         avg = self.test_object2.get_avg("date_time")
         self.assertEqual(avg, "N/A")
+
+    def test_profile_columns(self):
+        profile = self.test_object2.profile_columns()
+        self.assertEqual(list(profile.keys()), ['string', 'number', 'date_time'])
+        self.assertEqual(profile['string']['rows'], 6)
+        self.assertEqual(profile['string']['nulls'], 2)
+        self.assertEqual(profile['string']['distinct'], 3)
+        self.assertEqual(profile['string']['mode'], 'haha')
+        self.assertEqual(profile['string']['avg'], None)
+        self.assertEqual(profile['number']['nulls'], 0)
+        self.assertEqual(profile['number']['mode'], 2)
+        self.assertEqual(profile['number']['min'], 1)
+        self.assertEqual(profile['number']['max'], 4)
+        self.assertTrue(math.isclose(14/6, profile['number']['avg']))
+        self.assertEqual(profile['date_time']['nulls'], 1)
+        self.assertEqual(profile['date_time']['mode'], '01/01/2001')
+        # the most frequent value is the same as the one shown before profiling, NULL included
+        for column in profile:
+            self.assertEqual(profile[column]['mode'], self.test_object2.get_most_frequent_value(column))
+
+        # only the requested columns are profiled, and columns without statistics are still profiled exactly
+        profile = self.test_object2.profile_columns(['number'], approximate=True)
+        self.assertEqual(list(profile.keys()), ['number'])
+        self.assertEqual(profile['number']['rows'], 6)
+        self.assertEqual(json.loads(self.test_object2.render_profile_json(['number']))['number']['max'], 4)
+
+    def test_profile_columns_null_mode(self):
+        # the exact and the approximate profile agree on the most frequent value when it's NULL
+        cur = self.db_connection.cursor()
+        cur.execute('CREATE TABLE "0".null_table AS SELECT CASE WHEN i % 4 = 0 THEN i % 3 END AS number FROM generate_series(1, 100) AS i')
+        cur.execute('ANALYZE "0".null_table')
+        self.db_connection.commit()
+        try:
+            viewer = tv.TableViewer(0, 'null_table', self.engine, self.db_connection)
+            self.assertIsNone(viewer.profile_columns()['number']['mode'])
+            self.assertIsNone(viewer.get_most_frequent_value('number'))
+            profile = viewer.profile_columns(approximate=True)
+            self.assertTrue(profile['number']['approximate'])
+            self.assertIsNone(profile['number']['mode'])
+        finally:
+            cur.execute('DROP TABLE "0".null_table')
+            self.db_connection.commit()
+
+    def test_render_json_page(self):
+        # the pages obtained by seeking with the cursor have to match the pages obtained using OFFSET
+        for ascending in [True, False]:
+            cursor = None
+            for offset in range(0, 70, 20):
+                expected = self.test_object.render_json_page(offset, 20, 'number', ascending)[0]
+                result, cursor = self.test_object.render_json_page(offset, 20, 'number', ascending, cursor)
+                self.assertEqual(json.loads(result), json.loads(expected))
+                self.assertEqual(len(json.loads(result)), min(20, 70 - offset))
+
+        # a cursor that doesn't point to the requested offset is ignored
+        first_page, cursor = self.test_object.render_json_page(0, 10, 'string', True)
+        result = self.test_object.render_json_page(0, 10, 'string', True, cursor)[0]
+        self.assertEqual(json.loads(result), json.loads(first_page))
+        result = self.test_object.render_json_page(10, 10, 'string', True, 'invalid')[0]
+        self.assertEqual(len(json.loads(result)), 10)
+
+        # NULL values are placed last in ascending order
+        cursor = None
+        rows = []
+        for offset in range(0, 6, 4):
+            result, cursor = self.test_object2.render_json_page(offset, 4, 'string', True, cursor)
+            rows += json.loads(result)
+        self.assertEqual([row[0] for row in rows], ['haha', 'haha', 'hihi', 'hoho', None, None])
         
 
 
@@ -0,0 +1,159 @@
+import unittest
+import os
+import io
+import tempfile
+import time
+import zipfile
+import zlib
+from Model.DatabaseConfiguration import TestConnection
+from Model.UploadJobQueue import UploadJobQueue
+from Model.ChunkedUploadManager import ChunkedUploadManager
+
+
+class TestUploadJobQueue(unittest.TestCase):
+    db_connection = None
+    test_object = None
+
+    @classmethod
+    def setUpClass(cls):
+        # the queue is a singleton, the workers of the first instance poll the test database
+        cls.test_object = UploadJobQueue(TestConnection(), poll_interval=0.2, upload_timeout=60, heartbeat_timeout=5)
+
+    def setUp(self):
+        self.db_connection = TestConnection().get_db()
+        self.cur = self.db_connection.cursor()
+        self.cur.execute('CREATE SCHEMA IF NOT EXISTS "0"')
+        self.cur.execute("INSERT INTO SYSTEM.datasets VALUES(0, 0, 0)")
+        self.db_connection.commit()
+
+    def tearDown(self):
+        self.db_connection.rollback()
+        self.cur.execute("DELETE FROM SYSTEM.upload_jobs WHERE setid = 0")
+        self.cur.execute("DELETE FROM SYSTEM.chunked_uploads WHERE setid = 0")
+        self.cur.execute('DROP SCHEMA "0" CASCADE')
+        self.cur.execute('DROP SCHEMA IF EXISTS "original_0" CASCADE')
+        self.cur.execute("DELETE FROM SYSTEM.datasets AS ds WHERE ds.setid = 0")
+        self.db_connection.commit()
+        TestConnection().close_connection(self.db_connection)
+
+    def __wait_for(self, job_id, statuses, timeout=30):
+        """Wait until the status of a job is one of statuses and return the job."""
+        start = time.monotonic()
+        while True:
+            job = self.test_object.get_job(self.db_connection, job_id)
+            self.db_connection.commit()
+            if job['status'] in statuses or time.monotonic() - start > timeout:
+                return job
+            time.sleep(0.1)
+
+    def __checksum(self, data):
+        return 'crc32:' + format(zlib.crc32(data) & 0xffffffff, '08x')
+
+    def test_enqueue(self):
+        # a queued job is claimed by a worker and loads the file, its folder is removed afterwards
+        folder = tempfile.mkdtemp()
+        filename = os.path.join(folder, "queued.csv")
+        with open(filename, 'w', encoding="utf-8") as csv_file:
+            csv_file.write("id,name\n1,one\n2,two\n3,three\n")
+
+        job_id = self.test_object.enqueue(self.db_connection, 0, None, filename)
+        job = self.__wait_for(job_id, ['done', 'failed'])
+        self.assertEqual(job['status'], 'done')
+        self.assertIsNone(job['message'])
+        self.assertEqual(job['bytes_done'], job['bytes_total'])
+        self.assertEqual(job['rows_done'], 3)
+        self.assertIsNotNone(job['started'])
+        self.assertIsNotNone(job['heartbeat'])
+        self.assertIsNotNone(job['finished'])
+        self.assertFalse(os.path.exists(folder))
+
+        self.cur.execute('SELECT * FROM "0".queued ORDER BY id')
+        self.assertEqual(self.cur.fetchall(), [("1", "one"), ("2", "two"), ("3", "three")])
+        self.assertIn(job_id, [x['job_id'] for x in self.test_object.get_jobs(self.db_connection, 0)])
+
+    def test_enqueue_failed(self):
+        # a file that can't be loaded fails its job with the error as message, nothing of it is kept
+        folder = tempfile.mkdtemp()
+        filename = os.path.join(folder, "empty.csv")
+        open(filename, 'w').close()
+
+        job_id = self.test_object.enqueue(self.db_connection, 0, None, filename)
+        job = self.__wait_for(job_id, ['done', 'failed'])
+        self.assertEqual(job['status'], 'failed')
+        self.assertEqual(job['message'], "Given file is empty")
+        self.cur.execute("SELECT COUNT(*) FROM information_schema.tables WHERE table_schema = '0'")
+        self.assertEqual(self.cur.fetchone()[0], 0)
+
+    def test_heartbeat(self):
+        # a csv file is loaded while it's arriving, the job writes a heartbeat while it waits for the chunks
+        folder = tempfile.mkdtemp()
+        filename = os.path.join(folder, "streamed.csv")
+        data = ("id,name\n" + "".join("{},name {}\n".format(i, i) for i in range(1000))).encode("utf-8")
+        uploads = ChunkedUploadManager(self.db_connection)
+        upload_id = uploads.start(0, None, filename, len(data))
+        job_id = self.test_object.enqueue(self.db_connection, 0, None, filename, upload_id=upload_id, bytes_total=len(data))
+        uploads.append(upload_id, 0, data[:100], self.__checksum(data[:100]))
+
+        first_beat = self.__wait_for(job_id, ['running'])['heartbeat']
+        time.sleep(1)
+        job = self.__wait_for(job_id, ['running'])
+        self.assertEqual(job['status'], 'running')
+        self.assertGreater(job['heartbeat'], first_beat)
+
+        uploads.append(upload_id, 100, data[100:], self.__checksum(data[100:]))
+        job = self.__wait_for(job_id, ['done', 'failed'])
+        self.assertEqual(job['status'], 'done')
+        self.cur.execute('SELECT COUNT(*) FROM "0".streamed')
+        self.assertEqual(self.cur.fetchone()[0], 1000)
+
+    def test_expire(self):
+        # a running job of which the heartbeat stopped belongs to a process that died, it's given up
+        folder = tempfile.mkdtemp()
+        filename = os.path.join(folder, "dead.csv")
+        open(filename, 'w').close()
+        self.cur.execute("INSERT INTO system.upload_jobs(setid, filename, header, automatic_types, delimiter, quotechar,"
+                         " encoding, status, started, heartbeat) VALUES (0, %s, true, false, ',', '\"', 'utf-8', 'running',"
+                         " now() - INTERVAL '1 hour', now() - INTERVAL '1 hour') RETURNING job_id", [filename])
+        job_id = self.cur.fetchone()[0]
+        self.db_connection.commit()
+        self.test_object.start()
+
+        job = self.__wait_for(job_id, ['failed'])
+        self.assertEqual(job['status'], 'failed')
+        self.assertEqual(job['message'], "The upload was interrupted.")
+        self.assertFalse(os.path.exists(folder))
+
+    def test_release(self):
+        # a zip has to be complete before it's loaded, its job waits until the upload is released
+        folder = tempfile.mkdtemp()
+        filename = os.path.join(folder, "chunked.zip")
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w') as zip_file:
+            zip_file.writestr("first.csv", "id,name\n1,one\n")
+            zip_file.writestr("second.csv", "id,name\n2,two\n")
+        data = archive.getvalue()
+
+        uploads = ChunkedUploadManager(self.db_connection)
+        upload_id = uploads.start(0, None, filename, len(data))
+        job_id = self.test_object.enqueue(self.db_connection, 0, None, filename, upload_id=upload_id, bytes_total=len(data))
+        uploads.append(upload_id, 0, data[:50], self.__checksum(data[:50]))
+        time.sleep(0.5)
+        self.assertEqual(self.test_object.get_job(self.db_connection, job_id)['status'], 'receiving')
+        self.db_connection.commit()
+
+        upload = uploads.append(upload_id, 50, data[50:], self.__checksum(data[50:]))
+        self.assertEqual(upload['status'], 'complete')
+        self.test_object.release(self.db_connection, upload_id)
+        job = self.__wait_for(job_id, ['done', 'failed'])
+        self.assertEqual(job['status'], 'done')
+        self.cur.execute('SELECT * FROM "0".first UNION ALL SELECT * FROM "0".second ORDER BY id')
+        self.assertEqual(self.cur.fetchall(), [("1", "one"), ("2", "two")])
+
+        # releasing it again has no effect
+        self.test_object.release(self.db_connection, upload_id)
+        self.assertEqual(self.test_object.get_job(self.db_connection, job_id)['status'], 'done')
+        self.db_connection.commit()
+
+
+if __name__ == '__main__':
+    unittest.main()
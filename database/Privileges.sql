@@ -4,6 +4,7 @@ GRANT ALL PRIVILEGES ON SCHEMA system TO dbadmin;
 GRANT USAGE, SELECT ON SEQUENCE system.datasets_setid_seq TO dbadmin;
 GRANT USAGE, SELECT ON SEQUENCE system.user_accounts_userid_seq TO dbadmin;
 GRANT USAGE, SELECT ON SEQUENCE system.dataset_history_transformation_id_seq TO dbadmin;
+GRANT USAGE, SELECT ON SEQUENCE system.upload_jobs_job_id_seq TO dbadmin;
 
 
 GRANT ALL PRIVILEGES ON DATABASE testdb TO dbadmin;
@@ -13,3 +14,4 @@ GRANT ALL PRIVILEGES ON SCHEMA system TO dbadmin;
 GRANT USAGE, SELECT ON SEQUENCE system.datasets_setid_seq TO dbadmin;
 GRANT USAGE, SELECT ON SEQUENCE system.user_accounts_userid_seq TO dbadmin;
 GRANT USAGE, SELECT ON SEQUENCE system.dataset_history_transformation_id_seq TO dbadmin;
+GRANT USAGE, SELECT ON SEQUENCE system.upload_jobs_job_id_seq TO dbadmin;
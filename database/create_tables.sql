@@ -51,6 +51,54 @@ CREATE TABLE SYSTEM.dataset_history (
 	FOREIGN KEY(setid) REFERENCES SYSTEM.datasets(setid) ON DELETE CASCADE
 );
 
+-- Table containing the files that are uploaded in chunks, the chunks are written to a staging file.
+CREATE TABLE SYSTEM.chunked_uploads (
+	upload_id VARCHAR(32),
+	setid INTEGER NOT NULL,
+	userid INTEGER,
+	filename VARCHAR NOT NULL,
+	size BIGINT NOT NULL,
+	bytes_received BIGINT DEFAULT 0 NOT NULL,
+	status VARCHAR(16) DEFAULT 'receiving' NOT NULL,
+	created TIMESTAMP DEFAULT NOW(),
+	updated TIMESTAMP DEFAULT NOW(),
+
+	PRIMARY KEY(upload_id),
+	CHECK(status IN ('receiving', 'complete', 'cancelled')),
+	CHECK(bytes_received <= size),
+	FOREIGN KEY(setid) REFERENCES SYSTEM.datasets(setid) ON DELETE CASCADE,
+	FOREIGN KEY(userid) REFERENCES SYSTEM.user_accounts(userid) ON DELETE SET NULL
+);
+
+-- Table containing the uploaded files that are being loaded in the background.
+CREATE TABLE SYSTEM.upload_jobs (
+	job_id SERIAL,
+	setid INTEGER NOT NULL,
+	userid INTEGER,
+	filename VARCHAR NOT NULL,
+	header BOOLEAN NOT NULL,
+	automatic_types BOOLEAN NOT NULL,
+	delimiter VARCHAR(1) NOT NULL,
+	quotechar VARCHAR(1) NOT NULL,
+	encoding VARCHAR(32) NOT NULL,
+	status VARCHAR(16) DEFAULT 'queued' NOT NULL,
+	bytes_total BIGINT,
+	bytes_done BIGINT DEFAULT 0 NOT NULL,
+	rows_done BIGINT DEFAULT 0 NOT NULL,
+	message VARCHAR,
+	created TIMESTAMP DEFAULT NOW(),
+	started TIMESTAMP,
+	finished TIMESTAMP,
+	heartbeat TIMESTAMP,
+	upload_id VARCHAR(32),
+
+	PRIMARY KEY(job_id),
+	CHECK(status IN ('receiving', 'queued', 'running', 'done', 'failed')),
+	FOREIGN KEY(setid) REFERENCES SYSTEM.datasets(setid) ON DELETE CASCADE,
+	FOREIGN KEY(userid) REFERENCES SYSTEM.user_accounts(userid) ON DELETE SET NULL,
+	FOREIGN KEY(upload_id) REFERENCES SYSTEM.chunked_uploads(upload_id) ON DELETE SET NULL
+);
+
 -- Trigger to delete all the corresponding data if the last admin of the data is deleted.
 CREATE OR REPLACE FUNCTION delete_clean() RETURNS TRIGGER AS $BODY$
 DECLARE